@@ -1,5 +1,13 @@
+import sys
+import os
+import threading
+from collections import OrderedDict
 import flask
 import pub
+import pub.cache
+import pub.metrics
+import pub.negcache
+import assets
 
 app = flask.Flask(__name__, static_url_path='')
 
@@ -8,10 +16,59 @@ def set_env():
     pub.set_config(flask.request.environ.get('CSPUB_CONFIG'))
     return
 
+# _entity_cache[PMID] = ((retrieved timestamp, scoring rules version), 
+# fragments) where fragments[(entity type, entity ID)] = rendered entity 
+# block, least recently used publication first
+#
+# a publication with a new timestamp or re-scored under new rules replaces 
+# all of its old fragments; fragments are kept for as many publications as 
+# the publication cache holds ([cache] size, see pub.cache)
+_entity_cache = OrderedDict()
+_entity_cache_lock = threading.Lock()
+# _entity_cache_sizes[configuration file] = [cache] size, so the file is 
+# read once rather than for every entity rendered
+_entity_cache_sizes = {}
+
+def _entity_cache_size():
+    fname = pub.config._config
+    if fname not in _entity_cache_sizes:
+        c = pub.Config()
+        _entity_cache_sizes[fname] = c.get_default('cache', 'size', 1000)
+    return _entity_cache_sizes[fname]
+
+def render_entity(publication, entity_type, ent):
+    """render an entity block, caching the result"""
+    key = (entity_type, ent.id)
+    stamp = (publication.timestamp, publication.rules_version)
+    size = _entity_cache_size()
+    with _entity_cache_lock:
+        cached = _entity_cache.pop(publication.pmid, None)
+        if cached is None or cached[0] != stamp:
+            cached = (stamp, {})
+        _entity_cache[publication.pmid] = cached
+        while len(_entity_cache) > size:
+            _entity_cache.popitem(last=False)
+    fragments = cached[1]
+    if key not in fragments:
+        fragments[key] = flask.render_template('entity.tmpl', ent=ent)
+    return fragments[key]
+
+app.jinja_env.globals['render_entity'] = render_entity
+
+app.jinja_env.globals['asset_url'] = assets.asset_url
+
+@app.route('/assets/<name>')
+def asset(name):
+    asset_set = assets.get_asset_set(flask.request.script_root)
+    if name not in asset_set.fingerprinted:
+        flask.abort(404)
+    return asset_set.fingerprinted[name].response()
+
 @app.route('/pub.css')
 def css():
-    data = flask.render_template('pub.css', root=flask.request.script_root)
-    return flask.Response(data, mimetype='text/css')
+    # unversioned URL kept for old pages; templates use asset_url()
+    asset_set = assets.get_asset_set(flask.request.script_root)
+    return asset_set.assets['pub.css'].response('public, max-age=300')
 
 @app.route('/')
 def index():
@@ -35,6 +92,8 @@ def publication(id):
             publication = pub.Publication.get_by_pmc_id(id)
         except pub.PublicationNotFoundError:
             error = 'Publication PMC ID %s not found' % id
+        except pub.UpstreamError, data:
+            error = 'Error loading PMC ID %s: %s' % (id, str(data))
         else:
             url = flask.url_for('publication', id=publication.pmid)
             return flask.redirect(url)
@@ -43,6 +102,10 @@ def publication(id):
             publication = pub.Publication.get_by_pmid(id)
         except pub.PublicationNotFoundError:
             error = 'Publication PMID %s not found' % id
+        except pub.UpstreamError, data:
+            error = 'Error loading PMID %s: %s' % (id, str(data))
+        else:
+            pub.scheduler.record_view(publication.pmid)
     else:
         error = 'Bad ID "%s"' % id
     return flask.render_template('pub.tmpl', 
@@ -50,14 +113,64 @@ def publication(id):
                                  error=error, 
                                  pub=publication)
 
+@app.route('/stats')
+def stats():
+    set_env()
+    return flask.render_template('stats.tmpl', 
+                                 root=flask.request.script_root, 
+                                 stats=pub.stats.get_stats())
+
+@app.route('/metrics')
+def metrics():
+    set_env()
+    values = pub.metrics.get()
+    values['negative_cache_entries'] = pub.negcache.count()
+    lines = [ 'cspub_%s %s\n' % (name, values[name]) 
+              for name in sorted(values) ]
+    return flask.Response(''.join(lines), mimetype='text/plain')
+
 @app.route('/reload/<pmid>')
 def reload(pmid):
     set_env()
     pmid = pmid.encode('ascii', 'replace')
-    publication = pub.Publication.get_by_pmid(pmid, True)
+    try:
+        publication = pub.Publication.get_by_pmid(pmid, True)
+    except pub.UpstreamError, data:
+        # keep serving what we have while the upstream service is down
+        notice = 'Reload failed (%s).' % str(data)
+        error = None
+        publication = None
+        try:
+            publication = pub.Publication.get_by_pmid(pmid)
+        except pub.PubError, data:
+            error = 'Error loading PMID %s: %s' % (pmid, str(data))
+        return flask.render_template('pub.tmpl', 
+                                     root=flask.request.script_root, 
+                                     error=error, 
+                                     notice=notice, 
+                                     pub=publication)
     url = flask.url_for('publication', id=publication.pmid)
     return flask.redirect(url)
 
+def warm_up():
+    """warm the publication cache if the configuration is in the process 
+    environment and asks for it ([cache] warm)
+
+    under a WSGI server the configuration is normally only known per 
+    request, so this is a no-op unless CSPUB_CONFIG is also set for the 
+    process
+    """
+    if not os.environ.get('CSPUB_CONFIG'):
+        return
+    pub.set_config(os.environ['CSPUB_CONFIG'])
+    (n, elapsed) = pub.cache.warm()
+    if n:
+        msg = 'warmed %d publications in %.1f seconds\n' % (n, elapsed)
+        sys.stderr.write(msg)
+    return
+
+warm_up()
+
 if __name__ == '__main__':
     app.run(debug=True)
 
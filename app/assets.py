@@ -0,0 +1,118 @@
+# fingerprinted static assets
+#
+# the assets are the files in the static folder plus the templated assets 
+# (pub.css), which are rendered once per deployment root; all of them are 
+# kept in memory along with gzipped copies and served under URLs that 
+# include a hash of their content, so they can be cached forever
+
+import os
+import hashlib
+import gzip
+import mimetypes
+import threading
+import cStringIO
+
+import flask
+import jinja2
+
+# templates that are rendered as assets
+templated_assets = ('pub.css', )
+
+# for fingerprinted URLs
+cache_control = 'public, max-age=31536000, immutable'
+
+# _asset_sets[root] = AssetSet
+_asset_sets = {}
+_asset_sets_lock = threading.Lock()
+
+class Asset:
+
+    """a static file"""
+
+    def __init__(self, name, data):
+        """gzip_data is None if gzipping doesn't make data smaller"""
+        self.name = name
+        self.data = data
+        (self.mimetype, _) = mimetypes.guess_type(name)
+        if self.mimetype is None:
+            self.mimetype = 'application/octet-stream'
+        (base, ext) = os.path.splitext(name)
+        digest = hashlib.sha1(data).hexdigest()[:12]
+        self.fingerprinted_name = '%s.%s%s' % (base, digest, ext)
+        buf = cStringIO.StringIO()
+        # mtime=0 so the gzipped data only depends on the content
+        with gzip.GzipFile(name, 'wb', 9, buf, 0) as fo:
+            fo.write(data)
+        self.gzip_data = buf.getvalue()
+        # already compressed formats (PNGs) don't get any smaller
+        if len(self.gzip_data) >= len(self.data):
+            self.gzip_data = None
+        return
+
+    def response(self, cache_control=cache_control):
+        """return a Flask response for the asset, gzipped if the client 
+        accepts it"""
+        headers = {'Cache-Control': cache_control, 
+                   'Vary': 'Accept-Encoding'}
+        accept_encoding = flask.request.headers.get('Accept-Encoding', '')
+        if self.gzip_data and 'gzip' in accept_encoding:
+            data = self.gzip_data
+            headers['Content-Encoding'] = 'gzip'
+        else:
+            data = self.data
+        return flask.Response(data, mimetype=self.mimetype, headers=headers)
+
+class AssetSet:
+
+    """the assets for one deployment root
+
+    must be created in a Flask application context
+    """
+
+    def __init__(self, root):
+        self.root = root
+        # assets[name] = Asset
+        self.assets = {}
+        # fingerprinted[fingerprinted name] = Asset
+        self.fingerprinted = {}
+        static_folder = flask.current_app.static_folder
+        for name in sorted(os.listdir(static_folder)):
+            with open(os.path.join(static_folder, name)) as fo:
+                self._add(Asset(name, fo.read()))
+        # the static files are in place, so the templated assets can refer 
+        # to them
+        for name in templated_assets:
+            data = flask.render_template(name, 
+                                         root=root, 
+                                         asset_url=self.url)
+            self._add(Asset(name, data.encode('utf-8')))
+        names = sorted(self.fingerprinted)
+        self.version = hashlib.sha1(' '.join(names)).hexdigest()[:12]
+        return
+
+    def _add(self, asset):
+        self.assets[asset.name] = asset
+        self.fingerprinted[asset.fingerprinted_name] = asset
+        return
+
+    def url(self, name):
+        """return the fingerprinted URL of an asset"""
+        return '%s/assets/%s' % (self.root, 
+                                 self.assets[name].fingerprinted_name)
+
+def get_asset_set(root):
+    """return the AssetSet for the deployment root, creating it if needed"""
+    with _asset_sets_lock:
+        if root not in _asset_sets:
+            _asset_sets[root] = AssetSet(root)
+        return _asset_sets[root]
+
+@jinja2.contextfunction
+def asset_url(context, name):
+    """template function giving the fingerprinted URL of an asset
+
+    uses root from the template context
+    """
+    return get_asset_set(context.get('root') or '').url(name)
+
+# eof
@@ -0,0 +1,168 @@
+#!/usr/bin/python
+
+# render the portal to a tree of static HTML files that can be served 
+# without running the application:
+#
+#     <output dir>/index.html
+#     <output dir>/stats/index.html
+#     <output dir>/pm/<PMID>/index.html
+#     <output dir>/assets/<fingerprinted asset names> (and .gz versions)
+#
+# the web server should map /pm/<PMID> to /pm/<PMID>/index.html (for 
+# nginx, "try_files $uri $uri/index.html =404;"); the search form and 
+# reload links are left out of the static pages
+#
+# assets should be served with a far-future Cache-Control header and 
+# gzip_static on
+#
+# a publication page is only rendered again if the publication's 
+# retrieval time has changed since the last export (these are recorded 
+# in <output dir>/.manifest) or if the assets or the scoring rules (see 
+# pub.scoring) have changed
+
+import sys
+import os
+import shutil
+import json
+import argparse
+import multiprocessing
+
+import flask
+import pub
+import pub.scoring
+import assets
+from app import app
+
+manifest_name = '.manifest'
+
+def _write(fname, data):
+    """write data (UTF-8 encoded if it is unicode) atomically"""
+    dname = os.path.dirname(fname)
+    if not os.path.exists(dname):
+        os.makedirs(dname)
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    tmp_fname = '%s.tmp.%d' % (fname, os.getpid())
+    with open(tmp_fname, 'w') as fo:
+        fo.write(data)
+    os.rename(tmp_fname, fname)
+    return
+
+def _render(template, root, **kwargs):
+    with app.test_request_context():
+        data = flask.render_template(template, 
+                                     root=root, 
+                                     static=True, 
+                                     **kwargs)
+    return data
+
+def _init_worker(config, debug):
+    pub.set_config(config)
+    pub.set_debug(debug)
+    return
+
+def _export_publication((pmid, output_dir, root)):
+    """render one publication page; runs in the worker processes
+
+    returns (PMID, error message or None)
+    """
+    try:
+        publication = pub.Publication.get_by_pmid(pmid)
+    except pub.PubError, data:
+        return (pmid, str(data))
+    data = _render('pub.tmpl', root, error=None, pub=publication)
+    _write(os.path.join(output_dir, 'pm', pmid, 'index.html'), data)
+    return (pmid, None)
+
+def export(output_dir, root='', processes=None, debug=False):
+    """export(output_dir[, root][, processes][, debug]) -> 
+    (number rendered, number unchanged, list of (PMID, error message))
+
+    root is the URL path the output will be served under
+    """
+    manifest_fname = os.path.join(output_dir, manifest_name)
+    manifest = {'assets': None, 'rules': None, 'publications': {}}
+    if os.path.exists(manifest_fname):
+        with open(manifest_fname) as fo:
+            manifest.update(json.load(fo))
+    with app.test_request_context():
+        asset_set = assets.get_asset_set(root)
+    for asset in asset_set.assets.itervalues():
+        fname = os.path.join(output_dir, 'assets', asset.fingerprinted_name)
+        _write(fname, asset.data)
+        if asset.gzip_data:
+            _write(fname + '.gz', asset.gzip_data)
+    # pages refer to the assets by fingerprint, so if those have changed 
+    # then all the pages must be rendered again
+    if manifest['assets'] != asset_set.version:
+        manifest['publications'] = {}
+    manifest['assets'] = asset_set.version
+    # and pages show scores, so the same goes for the scoring rules
+    rules_version = pub.scoring.version()
+    if manifest['rules'] != rules_version:
+        manifest['publications'] = {}
+    manifest['rules'] = rules_version
+    rendered = manifest['publications']
+    retrieved = dict([ (pmid, ts.isoformat()) 
+                       for (pmid, ts) 
+                       in pub.Publication.get_retrieved().iteritems() ])
+    to_render = [ pmid for pmid in retrieved 
+                  if rendered.get(pmid) != retrieved[pmid] ]
+    for pmid in rendered.keys():
+        if pmid not in retrieved:
+            shutil.rmtree(os.path.join(output_dir, 'pm', pmid), True)
+            del rendered[pmid]
+    pool = multiprocessing.Pool(processes, 
+                                _init_worker, 
+                                (pub.config._config, debug))
+    args = [ (pmid, output_dir, root) for pmid in sorted(to_render) ]
+    errors = []
+    try:
+        for (pmid, error) in pool.imap_unordered(_export_publication, args):
+            if error:
+                errors.append((pmid, error))
+            else:
+                rendered[pmid] = retrieved[pmid]
+    finally:
+        pool.close()
+        pool.join()
+    known = pub.Publication.get_known()
+    data = _render('index.tmpl', root, known_publications=known)
+    _write(os.path.join(output_dir, 'index.html'), data)
+    data = _render('stats.tmpl', root, stats=pub.stats.get_stats())
+    _write(os.path.join(output_dir, 'stats', 'index.html'), data)
+    _write(manifest_fname, json.dumps(manifest))
+    n_unchanged = len(retrieved) - len(to_render)
+    return (len(to_render) - len(errors), n_unchanged, errors)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='export static pages')
+    parser.add_argument('--root', default='', 
+                        help='URL path the pages will be served under')
+    parser.add_argument('-j', '--processes', type=int, default=None, 
+                        help='number of rendering processes '
+                             '(default: number of CPUs)')
+    parser.add_argument('--debug', action='store_true')
+    parser.add_argument('config')
+    parser.add_argument('output_dir')
+    args = parser.parse_args()
+
+    pub.set_config(args.config)
+    pub.set_debug(args.debug)
+
+    (n_rendered, n_unchanged, errors) = export(args.output_dir, 
+                                               args.root.rstrip('/'), 
+                                               args.processes, 
+                                               args.debug)
+
+    print '%d rendered, %d unchanged' % (n_rendered, n_unchanged)
+    for (pmid, error) in errors:
+        sys.stderr.write('%s: %s\n' % (pmid, error))
+
+    if errors:
+        sys.exit(1)
+
+    sys.exit(0)
+
+# eof
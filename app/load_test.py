@@ -0,0 +1,444 @@
+#!/usr/bin/python
+
+# load test the portal
+#
+# usage: load_test.py [options] <config file>
+#
+# --concurrency threads (default 8) make requests for --duration seconds 
+# (default 30), each choosing what to ask for at random from:
+#
+#     index - the index page
+#     cached - one of --publications publications (default 50) loaded
+#              before the test starts
+#     miss - a publication that hasn't been loaded, so it is fetched from
+#            upstream and stored
+#     reload - a reload of one of the loaded publications
+#
+# in the proportions given by --mix (default 
+# index=5,cached=80,miss=10,reload=5); the choices are seeded by --seed, 
+# so a run can be repeated
+#
+# PubMed and hypothes.is are replaced by a stand-in run in this process, 
+# which answers after --upstream-latency milliseconds (default 100) with a 
+# generated MEDLINE record and a fixed set of annotations; the portal is 
+# run in this process too, on a copy of the configuration file that points 
+# [upstream] at the stand-in (see pub.fetch) and lifts the PubMed rate 
+# limit
+#
+# running everything in one process means the load generator and the 
+# portal share an interpreter; to test a separate server (such as 
+# serve_async.py), give its URL with --url and a fixed --upstream-port, 
+# and configure the server with the [upstream] and [ratelimit] settings 
+# that are printed when the test starts
+#
+# the test publications have PMIDs from 990000000 up and are removed from 
+# the database before and after the test, but this is best run on a 
+# scratch database
+#
+# the report has the throughput, error rate and latency percentiles for 
+# each kind of request, and the number of connections to the database 
+# (sampled from pg_stat_activity); --json also writes it as JSON
+
+import sys
+import os
+import time
+import math
+import json
+import random
+import urllib
+import urlparse
+import httplib
+import argparse
+import tempfile
+import threading
+import ConfigParser
+import BaseHTTPServer
+import SocketServer
+from multiprocessing.pool import ThreadPool
+
+import pub
+from pub import database
+from pub.publication import Publication
+
+kinds = ('index', 'cached', 'miss', 'reload')
+
+base_pmid = 990000000
+
+# the stand-in's annotations: (entity type, text)
+annotations = (('SubjectGroup', 'id: sg1\ndiagnosis: AD\nnsubjects: 20'), 
+               ('AcquisitionInstrument', 'id: ai1\ntype: MRI\nfield: 3T'), 
+               ('Acquisition', 'id: acq1\nacquisitioninstrument: ai1'), 
+               ('Data', 'id: d1\nacquisition: acq1\nsubjectgroup: sg1'), 
+               ('Observation', 'id: o1\ndata: d1\nmeasure: volume'), 
+               ('Model', 'id: m1\ntype: GLM\nvariable: age\nvariable: dx'), 
+               ('ModelApplication', 'id: ma1\nmodel: m1\nobservation: o1'), 
+               ('Result', 'id: r1\nmodelapplication: ma1\nvariable: dx'))
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    """answers PubMed and hypothes.is requests"""
+
+    latency = 0.0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        (path, query) = urllib.splitquery(self.path)
+        params = urlparse.parse_qs(query or '')
+        if path == '/pubmed/':
+            term = params['term'][0]
+            if term.upper().startswith('PMC'):
+                pmid = term[3:]
+            else:
+                pmid = term
+            fmt = 'PMID- %s\nTI  - Load test publication %s\nPMC - PMC%s\n'
+            self._send('text/plain', fmt % (pmid, pmid, pmid))
+        elif path == '/api/search':
+            pmc_id = params['uri'][0].rstrip('/').split('/')[-1]
+            rows = []
+            for (i, (entity_type, text)) in enumerate(annotations):
+                rows.append({'id': '%s_%d' % (pmc_id, i), 
+                             'uri': params['uri'][0], 
+                             'tags': ['CANDISharePub', entity_type], 
+                             'text': text})
+            data = json.dumps({'rows': rows, 'total': len(rows)})
+            self._send('application/json', data)
+        else:
+            self.send_error(404)
+        return
+
+    def _send(self, content_type, data):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        return
+
+    def log_message(self, format, *args):
+        return
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+def start_stand_in(port, latency):
+    """start the stand-in, returning its port"""
+    StandInHandler.latency = latency
+    server = StandInServer(('127.0.0.1', port), StandInHandler)
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    return server.server_address[1]
+
+def start_portal(config_fname):
+    """run the portal in this process, returning its URL"""
+    from werkzeug.serving import make_server, WSGIRequestHandler
+    from app import app
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args):
+            return
+    def wsgi_app(environ, start_response):
+        environ['CSPUB_CONFIG'] = config_fname
+        return app(environ, start_response)
+    server = make_server('127.0.0.1', 
+                         0, 
+                         wsgi_app, 
+                         threaded=True, 
+                         request_handler=QuietHandler)
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    return 'http://127.0.0.1:%d' % server.server_port
+
+def write_config(config_fname, upstream_settings):
+    """write a copy of the configuration with the stand-in settings, 
+    returning its name"""
+    c = ConfigParser.RawConfigParser()
+    c.read(config_fname)
+    for (section, option, value) in upstream_settings:
+        if not c.has_section(section):
+            c.add_section(section)
+        c.set(section, option, value)
+    (fd, fname) = tempfile.mkstemp(prefix='load_test', suffix='.cfg')
+    with os.fdopen(fd, 'w') as fo:
+        c.write(fo)
+    return fname
+
+def clear_test_publications():
+    """remove publications left in the database by test runs"""
+    for pmid in Publication.get_known():
+        if base_pmid <= int(pmid) < base_pmid * 2:
+            Publication._clear_pmid(pmid)
+    with database.pooled() as db:
+        with db.cursor() as c:
+            query = """DELETE FROM crawl_schedule 
+                        WHERE publication >= %s 
+                          AND publication < %s"""
+            c.execute(query, (base_pmid, base_pmid * 2))
+    return
+
+def request(url, path):
+    """request(url, path) -> (latency in seconds, ok)
+
+    a request is ok if it is answered with 200 or a redirect and the page 
+    doesn't report an error
+    """
+    parts = urlparse.urlparse(url)
+    t0 = time.time()
+    conn = httplib.HTTPConnection(parts.netloc, timeout=120)
+    try:
+        conn.request('GET', parts.path + path)
+        response = conn.getresponse()
+        data = response.read()
+    except (IOError, httplib.HTTPException):
+        return (time.time() - t0, False)
+    finally:
+        conn.close()
+    latency = time.time() - t0
+    ok = response.status in (200, 302) and 'class="error"' not in data
+    return (latency, ok)
+
+class ConnectionSampler(threading.Thread):
+
+    """samples the number of connections to the database from 
+    pg_stat_activity until stopped"""
+
+    def __init__(self, interval=0.5):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.interval = interval
+        self.totals = []
+        self.active = []
+        self.stopped = threading.Event()
+        return
+
+    def run(self):
+        db = database.connect()
+        db.autocommit = True
+        query = """SELECT COUNT(*), COUNT(*) FILTER (WHERE state = 'active') 
+                     FROM pg_stat_activity 
+                    WHERE datname = current_database() 
+                      AND pid <> pg_backend_pid()"""
+        try:
+            with db.cursor() as c:
+                while not self.stopped.is_set():
+                    c.execute(query)
+                    (total, active) = c.fetchone()
+                    self.totals.append(total)
+                    self.active.append(active)
+                    self.stopped.wait(self.interval)
+        finally:
+            db.close()
+        return
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return
+
+    def summary(self):
+        if not self.totals:
+            return {'samples': 0}
+        return {'samples': len(self.totals), 
+                'max': max(self.totals), 
+                'mean': float(sum(self.totals)) / len(self.totals), 
+                'max_active': max(self.active)}
+
+def percentile(values, p):
+    """nearest-rank percentile of a sorted list"""
+    if not values:
+        return None
+    rank = int(math.ceil(p / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+def parse_mix(s):
+    mix = {}
+    for item in s.split(','):
+        (kind, weight) = item.split('=')
+        if kind not in kinds:
+            raise ValueError('unknown request kind "%s"' % kind)
+        mix[kind] = float(weight)
+    return mix
+
+def run(url, mix, pmids, concurrency, duration, seed):
+    """run the test, returning a dictionary of lists of (latency, ok) 
+    keyed by kind"""
+    results = dict([ (kind, []) for kind in kinds ])
+    results_lock = threading.Lock()
+    choices = [ kind for kind in kinds if mix.get(kind) ]
+    weights = [ mix[kind] for kind in choices ]
+    total_weight = sum(weights)
+    # new PMIDs for misses, shared by the threads
+    next_miss = [base_pmid + len(pmids)]
+    deadline = time.time() + duration
+    def worker(i):
+        rng = random.Random(seed * 1000 + i)
+        while time.time() < deadline:
+            x = rng.uniform(0, total_weight)
+            for (kind, weight) in zip(choices, weights):
+                x -= weight
+                if x <= 0:
+                    break
+            if kind == 'index':
+                path = '/'
+            elif kind == 'cached':
+                path = '/pm/%s' % rng.choice(pmids)
+            elif kind == 'reload':
+                path = '/reload/%s' % rng.choice(pmids)
+            else:
+                with results_lock:
+                    pmid = next_miss[0]
+                    next_miss[0] += 1
+                path = '/pm/%d' % pmid
+            result = request(url, path)
+            with results_lock:
+                results[kind].append(result)
+        return
+    threads = [ threading.Thread(target=worker, args=(i, ))
+                for i in xrange(concurrency) ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+def make_report(results, elapsed, connections, params):
+    report = {'parameters': params, 
+              'elapsed': elapsed, 
+              'requests': {}, 
+              'db_connections': connections}
+    all_results = []
+    for kind in kinds + ('all', ):
+        if kind == 'all':
+            kind_results = all_results
+        else:
+            kind_results = results[kind]
+            all_results.extend(kind_results)
+        latencies = sorted([ latency for (latency, ok) in kind_results ])
+        n_errors = len([ ok for (latency, ok) in kind_results if not ok ])
+        d = {'requests': len(kind_results), 
+             'errors': n_errors, 
+             'throughput': len(kind_results) / elapsed}
+        for p in (50, 95, 99):
+            value = percentile(latencies, p)
+            if value is not None:
+                value *= 1000.0
+            d['p%d_ms' % p] = value
+        report['requests'][kind] = d
+    return report
+
+def print_report(report):
+    params = report['parameters']
+    fmt = '%.1f s, %d threads, mix %s, seed %d, upstream latency %d ms'
+    print fmt % (report['elapsed'], 
+                 params['concurrency'], 
+                 params['mix'], 
+                 params['seed'], 
+                 params['upstream_latency'])
+    print
+    print '%-8s %8s %7s %8s %8s %8s %8s' % ('', 
+                                           'requests', 
+                                           'errors', 
+                                           'req/s', 
+                                           'p50 ms', 
+                                           'p95 ms', 
+                                           'p99 ms')
+    for kind in kinds + ('all', ):
+        d = report['requests'][kind]
+        if not d['requests']:
+            continue
+        error_rate = '%.1f%%' % (100.0 * d['errors'] / d['requests'])
+        print '%-8s %8d %7s %8.1f %8.1f %8.1f %8.1f' % (kind, 
+                                                         d['requests'], 
+                                                         error_rate, 
+                                                         d['throughput'], 
+                                                         d['p50_ms'], 
+                                                         d['p95_ms'], 
+                                                         d['p99_ms'])
+    conns = report['db_connections']
+    print
+    if conns['samples']:
+        fmt = 'database connections: max %d, mean %.1f, max active %d'
+        print fmt % (conns['max'], conns['mean'], conns['max_active'])
+    return
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='load test the portal')
+    parser.add_argument('--url', 
+                        help='URL of a running portal (default: run one)')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30.0, 
+                        help='seconds')
+    parser.add_argument('--mix', default='index=5,cached=80,miss=10,reload=5')
+    parser.add_argument('--publications', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--upstream-latency', type=int, default=100, 
+                        help='milliseconds')
+    parser.add_argument('--upstream-port', type=int, default=0)
+    parser.add_argument('--json', help='also write the report here')
+    parser.add_argument('config')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+
+    pub.set_config(args.config)
+    clear_test_publications()
+
+    port = start_stand_in(args.upstream_port, args.upstream_latency / 1000.0)
+    stand_in = 'http://127.0.0.1:%d' % port
+    settings = (('upstream', 'www.ncbi.nlm.nih.gov', stand_in), 
+                ('upstream', 'hypothes.is', stand_in), 
+                ('ratelimit', 'www.ncbi.nlm.nih.gov', '1000'))
+    if args.url:
+        url = args.url.rstrip('/')
+        print 'the portal at %s must be configured with:' % url
+        for (section, option, value) in settings:
+            print '    [%s] %s = %s' % (section, option, value)
+        config_fname = None
+    else:
+        config_fname = write_config(args.config, settings)
+        url = start_portal(config_fname)
+
+    try:
+        pmids = [ str(base_pmid + i) for i in xrange(args.publications) ]
+        pool = ThreadPool(args.concurrency)
+        loaded = pool.map(lambda pmid: request(url, '/pm/%s' % pmid), pmids)
+        pool.close()
+        pool.join()
+        if not all([ ok for (latency, ok) in loaded ]):
+            sys.stderr.write('failed to load the test publications\n')
+            sys.exit(1)
+
+        sampler = ConnectionSampler()
+        sampler.start()
+        t0 = time.time()
+        results = run(url, 
+                      mix, 
+                      pmids, 
+                      args.concurrency, 
+                      args.duration, 
+                      args.seed)
+        elapsed = time.time() - t0
+        sampler.stop()
+    finally:
+        clear_test_publications()
+        if config_fname:
+            os.unlink(config_fname)
+
+    params = {'url': args.url, 
+              'concurrency': args.concurrency, 
+              'duration': args.duration, 
+              'mix': args.mix, 
+              'publications': args.publications, 
+              'seed': args.seed, 
+              'upstream_latency': args.upstream_latency}
+    report = make_report(results, elapsed, sampler.summary(), params)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as fo:
+            json.dump(report, fo, indent=2, sort_keys=True)
+
+    sys.exit(0)
+
+# eof
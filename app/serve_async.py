@@ -0,0 +1,52 @@
+#!/usr/bin/python
+
+# serve the portal from a single process using gevent, so requests waiting 
+# on the database or on PubMed and hypothes.is yield to each other instead 
+# of each holding a worker
+#
+# the application, templates, and URLs are the same as under a WSGI server
+#
+# this requires gevent
+
+from gevent import monkey
+monkey.patch_all()
+
+import sys
+import argparse
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+
+import pub
+import pub.cache
+from app import app
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='serve the portal')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--concurrency', type=int, default=1000, 
+                        help='maximum number of requests handled at once')
+    parser.add_argument('--debug', action='store_true')
+    parser.add_argument('config')
+    args = parser.parse_args()
+
+    pub.database.use_gevent()
+
+    # warm the cache before accepting requests
+    pub.set_config(args.config)
+    (n, elapsed) = pub.cache.warm()
+    if n:
+        msg = 'warmed %d publications in %.1f seconds\n' % (n, elapsed)
+        sys.stderr.write(msg)
+
+    environ = {'CSPUB_CONFIG': args.config}
+    if args.debug:
+        environ['CSPUB_DEBUG'] = '1'
+    server = WSGIServer((args.host, args.port), 
+                        app, 
+                        spawn=Pool(args.concurrency), 
+                        environ=environ)
+    server.serve_forever()
+
+# eof
@@ -1,6 +1,14 @@
+# the heavier standard library modules and third-party packages 
+# (psycopg2, httplib, urllib, multiprocessing, cgi) are imported by the 
+# functions that use them rather than at the top of the modules, so 
+# importing pub stays cheap for tools that never touch the database or 
+# the network; scripts/bench_import.py checks this
+
 from .publication import Publication
 from .exceptions import *
 from .debug import debug, set_debug
 from .config import set_config, Config
+from . import stats
+from . import scheduler
 
 # eof
@@ -0,0 +1,224 @@
+# caches of publications
+#
+# Publication.get_by_pmid() returns cached publications after checking
+# that their version is still current, which is one small query instead
+# of the dozens it takes to load a publication from the database (and 
+# that they were scored under the scoring rules in effect)
+#
+# there are two tiers: publications in this process and, if a directory 
+# is configured, serialized publications on local disk that are shared by 
+# all the processes on the host (such as the workers of a prefork WSGI 
+# server), so a publication loaded by one worker is read from disk by the 
+# others; disk entries are named by PMID and version, so a reload in any 
+# process makes the old entry unreachable, and the process that reloads 
+# removes it
+#
+# settings are in the [cache] section of the configuration file:
+#
+#     size - publications to keep in the process, least recently used are 
+#            dropped first (default 1000)
+#     dir - directory for the shared cache (default none)
+#     warm - publications to load by warm() (default 0)
+#     warm_budget - seconds warm() may spend loading (default 30)
+#     warm_threads - concurrent loads in warm() (default 4)
+
+import os
+import imp
+import glob
+import json
+import zlib
+import time
+import threading
+from collections import OrderedDict
+
+from .debug import debug
+from . import config
+from . import database
+from . import snapshot
+from . import scoring
+
+# publications are loaded this many at a time by warm()
+warm_batch = 20
+
+# _cache[PMID] = Publication, least recently used first
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def get(pmid):
+    """return the cached publication for pmid, or None if it is not cached
+    or has been reloaded since it was cached"""
+    with _cache_lock:
+        pub = _cache.pop(pmid, None)
+        if pub is not None:
+            _cache[pmid] = pub
+    shared_dir = _shared_dir()
+    if pub is None and not shared_dir:
+        return None
+    with database.pooled() as db:
+        with db.cursor() as c:
+            query = "SELECT version FROM publication WHERE pmid = %s"
+            database.execute(c, query, (pmid, ))
+            row = c.fetchone()
+    if row is None:
+        discard(pmid)
+        return None
+    if pub is not None \
+        and pub.version == row[0] \
+        and pub.rules_version == scoring.version():
+        return pub
+    if not shared_dir:
+        discard(pmid)
+        return None
+    pub = _shared_get(shared_dir, pmid, row[0])
+    if pub is None:
+        discard(pmid)
+        return None
+    _put_local(pub)
+    return pub
+
+def put(pub):
+    """cache a publication, replacing any older copy"""
+    _put_local(pub)
+    shared_dir = _shared_dir()
+    if shared_dir:
+        _shared_put(shared_dir, pub)
+    return
+
+def _put_local(pub):
+    size = config.Config().get_default('cache', 'size', 1000)
+    with _cache_lock:
+        _cache.pop(pub.pmid, None)
+        _cache[pub.pmid] = pub
+        while len(_cache) > size:
+            _cache.popitem(last=False)
+    return
+
+def _shared_dir():
+    c = config.Config()
+    if not c.has_option('cache', 'dir'):
+        return None
+    return c.get('cache', 'dir')
+
+def _shared_fname(shared_dir, pmid, version):
+    return os.path.join(shared_dir, '%s.%d' % (pmid, version))
+
+def _shared_get(shared_dir, pmid, version):
+    fname = _shared_fname(shared_dir, pmid, version)
+    try:
+        with open(fname, 'rb') as fo:
+            data = fo.read()
+    except IOError:
+        return None
+    try:
+        return snapshot._decode(json.loads(zlib.decompress(data)))
+    except (zlib.error, ValueError), data:
+        debug('bad shared cache entry %s: %s' % (fname, str(data)))
+        try:
+            os.unlink(fname)
+        except OSError:
+            pass
+        return None
+
+def _shared_put(shared_dir, pub):
+    """write a publication to the shared cache (unless it's already there) 
+    and remove older versions of it
+
+    entries are written to a temporary file and renamed into place, so 
+    other processes never see a partial entry
+    """
+    fname = _shared_fname(shared_dir, pub.pmid, pub.version)
+    if not os.path.exists(fname):
+        import tempfile
+        data = zlib.compress(json.dumps(snapshot._encode(pub), 
+                                        separators=(',', ':')))
+        (fd, tmp_fname) = tempfile.mkstemp(prefix='.tmp', dir=shared_dir)
+        try:
+            with os.fdopen(fd, 'wb') as fo:
+                fo.write(data)
+            os.rename(tmp_fname, fname)
+        except:
+            os.unlink(tmp_fname)
+            raise
+    pattern = os.path.join(shared_dir, '%s.*' % pub.pmid)
+    for old_fname in glob.glob(pattern):
+        # leave newer versions written by other processes
+        if int(old_fname.rsplit('.', 1)[1]) >= pub.version:
+            continue
+        try:
+            os.unlink(old_fname)
+        except OSError:
+            # another process got there first
+            pass
+    return
+
+def discard(pmid):
+    with _cache_lock:
+        _cache.pop(pmid, None)
+    return
+
+def _popular(n):
+    """return the PMIDs of up to n publications, most viewed first and then
+    most recently retrieved"""
+    with database.connect(replica=True) as db:
+        with db.cursor() as c:
+            query = """SELECT p.pmid 
+                         FROM publication p 
+                              LEFT JOIN crawl_schedule s 
+                              ON s.publication = p.pmid 
+                        ORDER BY COALESCE(s.views, 0) DESC, 
+                                 p.retrieved DESC 
+                        LIMIT %s"""
+            c.execute(query, (n, ))
+            pmids = [ str(row[0]) for row in c ]
+    return pmids
+
+def warm(n=None, budget=None, threads=None):
+    """warm(n[, budget[, threads]]) -> (publications loaded, seconds taken)
+
+    load the n most viewed (then most recently retrieved) publications
+    into the cache, threads batches at a time; no batch is started after
+    budget seconds
+
+    the arguments default to the [cache] settings
+    """
+    # imported here because publication imports this module
+    from .publication import Publication
+    c = config.Config()
+    if n is None:
+        n = c.get_default('cache', 'warm', 0)
+    if budget is None:
+        budget = c.get_default('cache', 'warm_budget', 30.0)
+    if threads is None:
+        threads = c.get_default('cache', 'warm_threads', 4)
+    start = time.time()
+    if n <= 0:
+        return (0, 0.0)
+    deadline = start + budget
+    pmids = _popular(n)
+    batches = [ pmids[i:i+warm_batch]
+                for i in xrange(0, len(pmids), warm_batch) ]
+    def load(batch):
+        if time.time() > deadline:
+            return 0
+        pubs = Publication.get_many(batch)
+        for pub in pubs.itervalues():
+            put(pub)
+        return len(pubs)
+    if imp.lock_held():
+        # we're being called during an import (say of a WSGI script), and 
+        # other threads would block on the import lock as soon as the 
+        # database driver imports anything, so load from this thread
+        n_loaded = sum(map(load, batches))
+    else:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(max(1, min(threads, len(batches))))
+        try:
+            n_loaded = sum(pool.map(load, batches))
+        finally:
+            pool.close()
+            pool.join()
+    elapsed = time.time() - start
+    debug('cache warm-up: %d publications in %.2f s' % (n_loaded, elapsed))
+    return (n_loaded, elapsed)
+
+# eof
@@ -14,4 +14,19 @@ class Config(ConfigParser.ConfigParser):
         self.read(_config)
         return
 
+    def get_default(self, section, option, default):
+        """return the value of an option, or default if it is not set
+
+        the value is converted to the type of default
+        """
+        if not self.has_option(section, option):
+            return default
+        if isinstance(default, bool):
+            return self.getboolean(section, option)
+        if isinstance(default, int):
+            return self.getint(section, option)
+        if isinstance(default, float):
+            return self.getfloat(section, option)
+        return self.get(section, option)
+
 # eof
@@ -1,12 +1,261 @@
-import psycopg2
+# reads that can tolerate replication lag can go to read replicas, listed 
+# in the [db] section of the configuration file:
+#
+#     [db]
+#     host = primary.example.org
+#     replicas = replica1.example.org, replica2.example.org:5433
+#     replica_retry = 30
+#
+# the replicas use the same database name, user and password as the 
+# primary; they are used in turn, and one that can't be connected to is 
+# skipped for replica_retry seconds (default 30); if none can be 
+# connected to, reads go to the primary
+#
+# connections from pooled() are kept open between uses (up to pool_size 
+# idle connections per server, default 10, in the [db] section) and 
+# queries run on them with execute() are prepared the first time each 
+# connection sees them, so Postgres parses and plans them once per 
+# connection rather than once per page view; set prepare = false in [db] 
+# if connections go through a pooler that doesn't keep a server 
+# connection for the whole session (such as PgBouncer in transaction 
+# mode)
+#
+# prepared statements last as long as the connection, so processes should 
+# be restarted after the schema changes
+#
+# the pool belongs to the process that filled it: a process forked from it 
+# (a multiprocessing worker, or a prefork WSGI worker forked after 
+# warm-up) starts with an empty pool rather than sharing the parent's 
+# sockets
+
+import os
+import time
+import hashlib
+import threading
+import contextlib
 from . import config
+from .debug import debug
+
+_next_replica = 0
+# _replica_down[host] = time until which the host is skipped
+_replica_down = {}
+_replicas_lock = threading.Lock()
+
+# _pool[(primary host, database, replica, prepare)] = list of idle 
+# connections
+_pool = {}
+_pool_lock = threading.Lock()
+# the process the pooled connections were opened in
+_pool_pid = os.getpid()
+# connections inherited from the parent after a fork; they are kept 
+# rather than closed or garbage collected, since closing one would end 
+# the parent's session on the shared socket
+_inherited = []
+
+_pooled_connection_class = None
+
+def _get_pooled_connection_class():
+    """return the class of pooled connections, which keep track of their 
+    prepared statements
+
+    the class is defined on first use so psycopg2 isn't imported until we 
+    need it
+    """
+    global _pooled_connection_class
+    if _pooled_connection_class is None:
+        import psycopg2.extensions
+        class PooledConnection(psycopg2.extensions.connection):
+            def __init__(self, *args, **kwargs):
+                psycopg2.extensions.connection.__init__(self, *args, **kwargs)
+                # names of the statements prepared on this connection
+                self.prepared = set()
+                return
+        _pooled_connection_class = PooledConnection
+    return _pooled_connection_class
 
-def connect():
+def connect(snapshot=False, replica=False):
+    """connect to the database
+
+    if snapshot is true, transactions on the connection are read-only and 
+    see a single snapshot of the database, so a publication read over 
+    several queries is seen either entirely before or entirely after a 
+    concurrent reload; such reads never wait for writers
+
+    if replica is true, the connection may be to a read replica, which 
+    can lag behind the primary; callers that must see their own writes 
+    (or anyone else's) should check what they read against the primary 
+    (see Publication._load_from_db())
+    """
     c = config.Config()
-    db = psycopg2.connect(host=c.get('db', 'host'), 
+    db = None
+    if replica:
+        db = _connect_replica(c)
+    if db is None:
+        db = _connect_host(c, c.get('db', 'host'))
+    if snapshot:
+        db.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    return db
+
+@contextlib.contextmanager
+def pooled(snapshot=False, replica=False):
+    """use a pooled connection for a transaction
+
+        with database.pooled() as db:
+            ...
+
+    the transaction is committed at the end of the block (or rolled back 
+    if there is an exception) and the connection is returned to the pool; 
+    snapshot and replica are as for connect()
+    """
+    c = config.Config()
+    replica = replica and bool(replica_hosts())
+    prepare = c.get_default('db', 'prepare', True)
+    key = (c.get('db', 'host'), c.get('db', 'database'), replica, prepare)
+    if prepare:
+        factory = _get_pooled_connection_class()
+    else:
+        factory = None
+    db = None
+    with _pool_lock:
+        _check_pid()
+        idle = _pool.setdefault(key, [])
+        while idle and db is None:
+            db = idle.pop()
+            if db.closed:
+                db = None
+    if db is None and replica:
+        db = _connect_replica(c, factory)
+    if db is None:
+        db = _connect_host(c, c.get('db', 'host'), factory)
+    if snapshot:
+        db.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    else:
+        db.set_session(isolation_level='DEFAULT', readonly='DEFAULT')
+    pid = os.getpid()
+    try:
+        with db:
+            yield db
+    finally:
+        pool_size = c.get_default('db', 'pool_size', 10)
+        with _pool_lock:
+            _check_pid()
+            idle = _pool.setdefault(key, [])
+            if pid != os.getpid():
+                # forked inside the block; the connection is the parent's
+                _inherited.append(db)
+                db = None
+            elif not db.closed and len(idle) < pool_size:
+                idle.append(db)
+                db = None
+        if db is not None and not db.closed:
+            db.close()
+    return
+
+def _check_pid():
+    """drop the pooled connections if this process was forked from the 
+    one that opened them; call with _pool_lock held"""
+    global _pool_pid
+    if _pool_pid == os.getpid():
+        return
+    for idle in _pool.itervalues():
+        _inherited.extend(idle)
+    _pool.clear()
+    _pool_pid = os.getpid()
+    return
+
+def execute(cursor, query, params=None):
+    """execute a query
+
+    on pooled connections, the query is run as a prepared statement 
+    (prepared the first time the connection sees it); otherwise this is 
+    cursor.execute(query, params)
+    """
+    prepared = getattr(cursor.connection, 'prepared', None)
+    if prepared is None:
+        cursor.execute(query, params)
+        return
+    name = 'q_%s' % hashlib.sha1(query).hexdigest()[:16]
+    if name not in prepared:
+        n_params = query.count('%s')
+        numbered = query % tuple([ '$%d' % (i+1) for i in xrange(n_params) ])
+        cursor.execute('PREPARE %s AS %s' % (name, numbered))
+        prepared.add(name)
+    if params:
+        placeholders = ', '.join(['%s'] * len(params))
+        cursor.execute('EXECUTE %s (%s)' % (name, placeholders), params)
+    else:
+        cursor.execute('EXECUTE %s' % name)
+    return
+
+def replica_hosts():
+    """return the list of configured replica hosts"""
+    c = config.Config()
+    if not c.has_option('db', 'replicas'):
+        return []
+    hosts = [ host.strip() for host in c.get('db', 'replicas').split(',') ]
+    return [ host for host in hosts if host ]
+
+def _connect_host(c, host, connection_factory=None):
+    import psycopg2
+    kwargs = {}
+    if connection_factory:
+        kwargs['connection_factory'] = connection_factory
+    if ':' in host:
+        (host, port) = host.rsplit(':', 1)
+        kwargs['port'] = int(port)
+    db = psycopg2.connect(host=host, 
                           dbname=c.get('db', 'database'), 
                           user=c.get('db', 'user'), 
-                          password=c.get('db', 'password'))
+                          password=c.get('db', 'password'), 
+                          **kwargs)
     return db
 
+def _connect_replica(c, connection_factory=None):
+    """connect to the next available replica, returning None if there are 
+    none"""
+    import psycopg2
+    global _next_replica
+    hosts = replica_hosts()
+    if not hosts:
+        return None
+    with _replicas_lock:
+        start = _next_replica
+        _next_replica = (_next_replica + 1) % len(hosts)
+    for i in xrange(len(hosts)):
+        host = hosts[(start+i) % len(hosts)]
+        if _replica_down.get(host, 0) > time.time():
+            continue
+        try:
+            return _connect_host(c, host, connection_factory)
+        except psycopg2.OperationalError, data:
+            retry = c.get_default('db', 'replica_retry', 30.0)
+            debug('replica %s down: %s' % (host, str(data).strip()))
+            with _replicas_lock:
+                _replica_down[host] = time.time() + retry
+    return None
+
+def _gevent_wait_callback(conn, timeout=None):
+    import psycopg2.extensions
+    from gevent.socket import wait_read, wait_write
+    while True:
+        state = conn.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            break
+        elif state == psycopg2.extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == psycopg2.extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError('bad poll() state %r' % state)
+    return
+
+def use_gevent():
+    """make database calls yield to other greenlets instead of blocking
+
+    this requires gevent
+    """
+    import psycopg2.extensions
+    psycopg2.extensions.set_wait_callback(_gevent_wait_callback)
+    return
+
 # eof
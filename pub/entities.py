@@ -1,5 +1,7 @@
 from collections import OrderedDict
 from . import errors
+from . import database
+from . import scoring
 from .utils import annot_url
 from .fields import *
 
@@ -7,6 +9,21 @@ class Entity(object):
 
     """base class for entities"""
 
+    # (field key, entity type) for fields that refer to other entities; 
+    # these define the dependency graph between entities
+    link_fields = ()
+
+    # attributes holding lists of entities that refer to this one, filled 
+    # in by the other entities' .set_related()
+    backlinks = ()
+
+    # (table, column) for tables holding rows that belong to one entity
+    owned_tables = ()
+
+    # the entity type's ID in the entity_type table, used instead of the 
+    # table name in entity_annotation, entity_error and lineage
+    type_id = None
+
     @classmethod
     def _get_from_def(cls, pub, id, values):
         obj = cls(pub, id)
@@ -22,7 +39,7 @@ class Entity(object):
     @classmethod
     def _clear_pmid(cls, pmid, cursor):
         query = "DELETE FROM %s WHERE publication = %%s" % cls.table
-        cursor.execute(query, (pmid, ))
+        database.execute(cursor, query, (pmid, ))
         return
 
     def __init__(self, pub, id):
@@ -40,6 +57,21 @@ class Entity(object):
     def __getitem__(self, key):
         return self.fields[key].value
 
+    def _signature(self):
+        """return a value that is equal for two entities exactly when they 
+        are stored identically in the database
+        """
+        values = []
+        for field in self.fields.itervalues():
+            if isinstance(field.value, list):
+                values.append(tuple(sorted(field.value)))
+            else:
+                values.append(field.value)
+        errs = [ (err.__class__.__name__, err.data) for err in self.errors ]
+        return (tuple(values), 
+                tuple(sorted(self.annotation_ids)), 
+                tuple(sorted(errs)))
+
     def _insert_annotations(self, cursor):
         query = """INSERT INTO entity_annotation (publication, 
                                                   entity_type, 
@@ -48,10 +80,30 @@ class Entity(object):
                    VALUES (%s, %s, %s, %s)"""
         for annotation_id in self.annotation_ids:
             params = (self.pub.pmid, 
-                      self.table, 
+                      self.type_id, 
                       self.id, 
                       annotation_id)
-            cursor.execute(query, params)
+            database.execute(cursor, query, params)
+        return
+
+    def _delete(self, cursor):
+        """delete the entity from the database"""
+        for (table, column) in self.owned_tables:
+            query = """DELETE FROM %s 
+                        WHERE publication = %%s 
+                          AND %s = %%s""" % (table, column)
+            database.execute(cursor, query, (self.pub.pmid, self.id))
+        for table in ('entity_annotation', 'entity_error', 'lineage'):
+            query = """DELETE FROM %s 
+                        WHERE publication = %%s 
+                          AND entity_type = %%s 
+                          AND entity_id = %%s""" % table
+            params = (self.pub.pmid, self.type_id, self.id)
+            database.execute(cursor, query, params)
+        query = """DELETE FROM %s 
+                    WHERE publication = %%s 
+                      AND id = %%s""" % self.table
+        database.execute(cursor, query, (self.pub.pmid, self.id))
         return
 
     def _insert_errors(self, cursor):
@@ -63,41 +115,114 @@ class Entity(object):
                      VALUES (%s, %s, %s, %s, %s)"""
         for error in self.errors:
             params = (self.pub.pmid, 
-                      self.table, 
+                      self.type_id, 
                       self.id, 
-                      error.__class__.__name__, 
+                      error.type_id, 
                       error.data)
-            cursor.execute(query, params)
+            database.execute(cursor, query, params)
         return
 
     @classmethod
-    def _get_annotation_ids_from_db(cls, pub, d, cursor):
-        query = """SELECT entity_id, annotation_id 
+    def _get_from_db(cls, pub, cursor):
+        """return a dictionary of the publication's entities of this type 
+        keyed by entity ID
+
+        subclasses define _get_many_from_db(pubs, cursor), which does this 
+        for a dictionary of publications keyed by PMID and returns a 
+        dictionary of these dictionaries, also keyed by PMID; as in the 
+        database, these PMIDs are integers
+        """
+        pmid = int(pub.pmid)
+        return cls._get_many_from_db({pmid: pub}, cursor)[pmid]
+
+    @classmethod
+    def _get_annotation_ids_from_db(cls, pubs, d, cursor):
+        query = """SELECT publication, entity_id, annotation_id 
                      FROM entity_annotation 
-                    WHERE publication = %s 
+                    WHERE publication = ANY(%s) 
                       AND entity_type = %s"""
-        cursor.execute(query, (pub.pmid, cls.table))
-        for (entity_id, annotation_id) in cursor:
-            d[entity_id].annotation_ids.add(annotation_id)
+        database.execute(cursor, query, (list(pubs), cls.type_id))
+        for (pmid, entity_id, annotation_id) in cursor:
+            d[pmid][entity_id].annotation_ids.add(annotation_id)
         return
 
     @classmethod
-    def _get_errors_from_db(cls, pub, d, cursor):
-        query = """SELECT entity_id, error_type, data 
+    def _get_errors_from_db(cls, pubs, d, cursor):
+        query = """SELECT publication, entity_id, error_type, data 
                      FROM entity_error 
-                    WHERE publication = %s 
+                    WHERE publication = ANY(%s) 
                       AND entity_type = %s"""
-        cursor.execute(query, (pub.pmid, cls.table))
-        for (entity_id, error_type, data) in cursor:
-            cls = getattr(errors, error_type)
-            err = cls(data)
-            d[entity_id].errors.append(err)
+        database.execute(cursor, query, (list(pubs), cls.type_id))
+        for (pmid, entity_id, error_type, data) in cursor:
+            err = errors.error_types[error_type](data)
+            d[pmid][entity_id].errors.append(err)
         return
 
     def set_related(self):
         """set related entities"""
         return
 
+    def references(self):
+        """return a list of (entity type, entity ID) for the entities this 
+        one refers to
+
+        after .set_related() this only includes defined entities
+        """
+        refs = []
+        for (key, entity_type) in self.link_fields:
+            value = self[key]
+            if value is None:
+                continue
+            if isinstance(value, list):
+                refs.extend([ (entity_type, id) for id in value ])
+            else:
+                refs.append((entity_type, value))
+        return refs
+
+    def ancestors(self):
+        """return a list of (entity, depth) for all the entities this one 
+        depends on, directly (depth 1) or indirectly
+
+        depth is the length of the shortest path to the ancestor; this 
+        relies on .set_related() having been called for all entities
+        """
+        depths = {}
+        queue = [ (ref, 1) for ref in self.references() ]
+        while queue:
+            ((et, id), depth) = queue.pop(0)
+            ent = self.pub.entities[et][id]
+            if ent in depths:
+                continue
+            depths[ent] = depth
+            queue.extend([ (ref, depth+1) for ref in ent.references() ])
+        return depths.items()
+
+    def _insert_lineage(self, cursor):
+        query = """INSERT INTO lineage (publication, 
+                                        entity_type, 
+                                        entity_id, 
+                                        ancestor_type, 
+                                        ancestor_id, 
+                                        depth) 
+                   VALUES (%s, %s, %s, %s, %s, %s)"""
+        for (ancestor, depth) in self.ancestors():
+            params = (self.pub.pmid, 
+                      self.type_id, 
+                      self.id, 
+                      ancestor.type_id, 
+                      ancestor.id, 
+                      depth)
+            database.execute(cursor, query, params)
+        return
+
+    def score(self, rule_set=None):
+        """add the entity's points under the scoring rules (see scoring.py), 
+        by default the rules in effect"""
+        if rule_set is None:
+            rule_set = scoring.get_rule_set()
+        self.points.extend(rule_set.score(self))
+        return
+
     def get_scores(self):
         """obj.get_scores() -> (score, maximum possible score)"""
         s = 0
@@ -123,24 +248,27 @@ class SubjectGroup(Entity):
 
     table = 'subject_group'
 
+    type_id = 1
+
     @classmethod
-    def _get_from_db(cls, pub, cursor):
-        d = {}
+    def _get_many_from_db(cls, pubs, cursor):
+        d = dict([ (pmid, {}) for pmid in pubs ])
         query = """SELECT * 
                      FROM subject_group 
-                    WHERE publication = %s"""
-        cursor.execute(query, (pub.pmid, ))
+                    WHERE publication = ANY(%s)"""
+        database.execute(cursor, query, (list(pubs), ))
         cols = [ el[0] for el in cursor.description ]
         for row in cursor:
             row_dict = dict(zip(cols, row))
+            pub = pubs[row_dict['publication']]
             obj = SubjectGroup(pub, row_dict['id'])
             obj.fields['diagnosis'].set(row_dict['diagnosis'])
             obj.fields['nsubjects'].set(row_dict['n_subjects'])
             obj.fields['agemean'].set(row_dict['age_mean'])
             obj.fields['agesd'].set(row_dict['age_sd'])
-            d[row_dict['id']] = obj
-        SubjectGroup._get_annotation_ids_from_db(pub, d, cursor)
-        SubjectGroup._get_errors_from_db(pub, d, cursor)
+            d[row_dict['publication']][row_dict['id']] = obj
+        SubjectGroup._get_annotation_ids_from_db(pubs, d, cursor)
+        SubjectGroup._get_errors_from_db(pubs, d, cursor)
         return d
 
     def _insert(self, cursor):
@@ -157,19 +285,11 @@ class SubjectGroup(Entity):
                   self['nsubjects'], 
                   self['agemean'], 
                   self['agesd'])
-        cursor.execute(query, params)
+        database.execute(cursor, query, params)
         self._insert_annotations(cursor)
         self._insert_errors(cursor)
         return
 
-    def score(self):
-        self.points.append((5, 'Existential credit'))
-        # check for missing fields
-        for (name, field) in self.fields.iteritems():
-            if not field.value:
-                self.points.append((-1, 'Missing %s' % name))
-        return
-
 class AcquisitionInstrument(Entity):
 
     field_defs = (('type', Field, 'Type'), 
@@ -180,25 +300,28 @@ class AcquisitionInstrument(Entity):
 
     table = 'acquisition_instrument'
 
+    type_id = 2
+
     @classmethod
-    def _get_from_db(cls, pub, cursor):
-        d = {}
+    def _get_many_from_db(cls, pubs, cursor):
+        d = dict([ (pmid, {}) for pmid in pubs ])
         query = """SELECT * 
                      FROM acquisition_instrument 
-                    WHERE publication = %s"""
-        cursor.execute(query, (pub.pmid, ))
+                    WHERE publication = ANY(%s)"""
+        database.execute(cursor, query, (list(pubs), ))
         cols = [ el[0] for el in cursor.description ]
         for row in cursor:
             row_dict = dict(zip(cols, row))
+            pub = pubs[row_dict['publication']]
             obj = AcquisitionInstrument(pub, row_dict['id'])
             obj.fields['type'].set(row_dict['type'])
             obj.fields['location'].set(row_dict['location'])
             obj.fields['field'].set(row_dict['field'])
             obj.fields['manufacturer'].set(row_dict['manufacturer'])
             obj.fields['model'].set(row_dict['model'])
-            d[row_dict['id']] = obj
-        AcquisitionInstrument._get_annotation_ids_from_db(pub, d, cursor)
-        AcquisitionInstrument._get_errors_from_db(pub, d, cursor)
+            d[row_dict['publication']][row_dict['id']] = obj
+        AcquisitionInstrument._get_annotation_ids_from_db(pubs, d, cursor)
+        AcquisitionInstrument._get_errors_from_db(pubs, d, cursor)
         return d
 
     def _insert(self, cursor):
@@ -217,22 +340,11 @@ class AcquisitionInstrument(Entity):
                   self['field'], 
                   self['manufacturer'], 
                   self['model'])
-        cursor.execute(query, params)
+        database.execute(cursor, query, params)
         self._insert_annotations(cursor)
         self._insert_errors(cursor)
         return
 
-    def score(self):
-        self.points.append((7, 'Existential credit'))
-        # check for missing fields
-        for (name, field) in self.fields.iteritems():
-            if not field.value:
-                if name == 'field':
-                    self.points.append((-2, 'Missing %s' % name))
-                else:
-                    self.points.append((-1, 'Missing %s' % name))
-        return
-
 class Acquisition(Entity):
 
     field_defs = (('type', Field, 'Type'), 
@@ -250,16 +362,21 @@ class Acquisition(Entity):
 
     table = 'acquisition'
 
+    type_id = 3
+
+    link_fields = (('acquisitioninstrument', 'AcquisitionInstrument'), )
+
     @classmethod
-    def _get_from_db(cls, pub, cursor):
-        d = {}
+    def _get_many_from_db(cls, pubs, cursor):
+        d = dict([ (pmid, {}) for pmid in pubs ])
         query = """SELECT * 
                      FROM acquisition 
-                    WHERE publication = %s"""
-        cursor.execute(query, (pub.pmid, ))
+                    WHERE publication = ANY(%s)"""
+        database.execute(cursor, query, (list(pubs), ))
         cols = [ el[0] for el in cursor.description ]
         for row in cursor:
             row_dict = dict(zip(cols, row))
+            pub = pubs[row_dict['publication']]
             obj = Acquisition(pub, row_dict['id'])
             val = row_dict['acquisition_instrument']
             obj.fields['acquisitioninstrument'].set(val)
@@ -274,9 +391,9 @@ class Acquisition(Entity):
             obj.fields['slicethickness'].set(row_dict['slice_thickness'])
             obj.fields['matrix'].set(row_dict['matrix'])
             obj.fields['nexcitations'].set(row_dict['n_excitations'])
-            d[row_dict['id']] = obj
-        Acquisition._get_annotation_ids_from_db(pub, d, cursor)
-        Acquisition._get_errors_from_db(pub, d, cursor)
+            d[row_dict['publication']][row_dict['id']] = obj
+        Acquisition._get_annotation_ids_from_db(pubs, d, cursor)
+        Acquisition._get_errors_from_db(pubs, d, cursor)
         return d
 
     def _insert(self, cursor):
@@ -314,7 +431,7 @@ class Acquisition(Entity):
                   self['slicethickness'], 
                   self['matrix'], 
                   self['nexcitations'])
-        cursor.execute(query, params)
+        database.execute(cursor, query, params)
         self._insert_annotations(cursor)
         self._insert_errors(cursor)
         return
@@ -333,15 +450,6 @@ class Acquisition(Entity):
             self.acquisition_instrument = ai
         return
 
-    def score(self):
-        self.points.append((3, 'Existential credit'))
-        # check for missing fields
-        if not self['type']:
-            self.points.append((-1, 'Missing type'))
-        if not self.acquisition_instrument:
-            self.points.append((-1, 'Missing acquisition instrument'))
-        return
-
 class Data(Entity):
 
     field_defs = (('url', URLField, 'URL'), 
@@ -351,30 +459,38 @@ class Data(Entity):
 
     table = 'data'
 
+    type_id = 4
+
+    link_fields = (('acquisition', 'Acquisition'), 
+                   ('subjectgroup', 'SubjectGroup'))
+
+    backlinks = ('observations', )
+
     @classmethod
-    def _get_from_db(cls, pub, cursor):
-        d = {}
+    def _get_many_from_db(cls, pubs, cursor):
+        d = dict([ (pmid, {}) for pmid in pubs ])
         query = """SELECT * 
                      FROM data 
-                    WHERE publication = %s"""
-        cursor.execute(query, (pub.pmid, ))
+                    WHERE publication = ANY(%s)"""
+        database.execute(cursor, query, (list(pubs), ))
         cols = [ el[0] for el in cursor.description ]
         for row in cursor:
             row_dict = dict(zip(cols, row))
+            pub = pubs[row_dict['publication']]
             obj = Data(pub, row_dict['id'])
             obj.fields['url'].set(row_dict['url'])
             obj.fields['doi'].set(row_dict['doi'])
             obj.fields['acquisition'].set(row_dict['acquisition'])
             obj.fields['subjectgroup'].set(row_dict['subject_group'])
-            d[row_dict['id']] = obj
-        Data._get_annotation_ids_from_db(pub, d, cursor)
-        Data._get_errors_from_db(pub, d, cursor)
+            d[row_dict['publication']][row_dict['id']] = obj
+        Data._get_annotation_ids_from_db(pubs, d, cursor)
+        Data._get_errors_from_db(pubs, d, cursor)
         return d
 
     @classmethod
     def _clear_pmid(cls, pmid, cursor):
         query = "DELETE FROM dataXobservation WHERE publication = %s"
-        cursor.execute(query, (pmid, ))
+        database.execute(cursor, query, (pmid, ))
         super(Data, cls)._clear_pmid(pmid, cursor)
         return
 
@@ -396,13 +512,17 @@ class Data(Entity):
             aquisition = self.acquisition.id
         else:
             aquisition = None
+        if self.subject_group:
+            subject_group = self.subject_group.id
+        else:
+            subject_group = None
         params = (self.pub.pmid, 
                   self.id, 
                   aquisition, 
-                  self.subject_group.id, 
+                  subject_group, 
                   self['url'], 
                   self['doi'])
-        cursor.execute(query, params)
+        database.execute(cursor, query, params)
         self._insert_annotations(cursor)
         self._insert_errors(cursor)
         return
@@ -421,25 +541,15 @@ class Data(Entity):
         sg_id = self['subjectgroup']
         if sg_id is None:
             self.subject_group = None
-        if sg_id not in self.pub.entities['SubjectGroup']:
+        elif sg_id not in self.pub.entities['SubjectGroup']:
             self.fields['subjectgroup'].reset()
             self.subject_group = None
-            err = LinkError('Undefined subjectgroup "%s"' % sg_id)
+            err = errors.LinkError('Undefined subjectgroup "%s"' % sg_id)
             self.errors.append(err)
         else:
             self.subject_group = self.pub.entities['SubjectGroup'][sg_id]
         return
 
-    def score(self):
-        self.points.append((10, 'Existential credit'))
-        if not self['url'] and not self['doi']:
-            self.points.append((-5, 'No link to data (DOI or URL)'))
-        if not self.subject_group:
-            self.points.append((-1, 'Missing subject group'))
-        if not self.acquisition:
-            self.points.append((-1, 'Missing acquisition'))
-        return
-
 class AnalysisWorkflow(Entity):
 
     field_defs = (('method', Field, 'Method'), 
@@ -451,16 +561,19 @@ class AnalysisWorkflow(Entity):
 
     table = 'analysis_workflow'
 
+    type_id = 5
+
     @classmethod
-    def _get_from_db(cls, pub, cursor):
-        d = {}
+    def _get_many_from_db(cls, pubs, cursor):
+        d = dict([ (pmid, {}) for pmid in pubs ])
         query = """SELECT * 
                      FROM analysis_workflow 
-                    WHERE publication = %s"""
-        cursor.execute(query, (pub.pmid, ))
+                    WHERE publication = ANY(%s)"""
+        database.execute(cursor, query, (list(pubs), ))
         cols = [ el[0] for el in cursor.description ]
         for row in cursor:
             row_dict = dict(zip(cols, row))
+            pub = pubs[row_dict['publication']]
             obj = AnalysisWorkflow(pub, row_dict['id'])
             obj.fields['method'].set(row_dict['method'])
             obj.fields['methodurl'].set(row_dict['methodurl'])
@@ -468,9 +581,9 @@ class AnalysisWorkflow(Entity):
             obj.fields['softwarenitrcid'].set(row_dict['software_nitrc_id'])
             obj.fields['softwarerrid'].set(row_dict['software_rrid'])
             obj.fields['softwareurl'].set(row_dict['software_url'])
-            d[row_dict['id']] = obj
-        AnalysisWorkflow._get_annotation_ids_from_db(pub, d, cursor)
-        AnalysisWorkflow._get_errors_from_db(pub, d, cursor)
+            d[row_dict['publication']][row_dict['id']] = obj
+        AnalysisWorkflow._get_annotation_ids_from_db(pubs, d, cursor)
+        AnalysisWorkflow._get_errors_from_db(pubs, d, cursor)
         return d
 
     def _insert(self, cursor):
@@ -491,25 +604,11 @@ class AnalysisWorkflow(Entity):
                   self['softwarenitrcid'], 
                   self['softwarerrid'], 
                   self['softwareurl'])
-        cursor.execute(query, params)
+        database.execute(cursor, query, params)
         self._insert_annotations(cursor)
         self._insert_errors(cursor)
         return
 
-    def score(self):
-        self.points.append((7, 'Existential credit'))
-        if not self['method']:
-            self.points.append((-1, 'Missing method'))
-        if not self['methodurl']:
-            self.points.append((-2, 'Missing method URL'))
-        if not self['software']:
-            self.points.append((-1, 'Missing software'))
-        if not self['softwarenitrcid'] \
-            and not self['softwarerrid'] \
-            and not self['softwareurl']:
-                self.points.append((-2, 'Missing software link'))
-        return
-
 class Observation(Entity):
 
     field_defs = (('data', MultiField, 'Data'), 
@@ -518,37 +617,47 @@ class Observation(Entity):
 
     table = 'observation'
 
+    type_id = 6
+
+    link_fields = (('data', 'Data'), 
+                   ('analysisworkflow', 'AnalysisWorkflow'))
+
+    backlinks = ('model_applications', )
+
+    owned_tables = (('dataXobservation', 'observation'), )
+
     @classmethod
-    def _get_from_db(cls, pub, cursor):
-        d = {}
+    def _get_many_from_db(cls, pubs, cursor):
+        d = dict([ (pmid, {}) for pmid in pubs ])
         query = """SELECT * 
                      FROM observation 
-                    WHERE publication = %s"""
-        cursor.execute(query, (pub.pmid, ))
+                    WHERE publication = ANY(%s)"""
+        database.execute(cursor, query, (list(pubs), ))
         cols = [ el[0] for el in cursor.description ]
         for row in cursor:
             row_dict = dict(zip(cols, row))
+            pub = pubs[row_dict['publication']]
             obj = Observation(pub, row_dict['id'])
             obj.fields['analysisworkflow'].set(row_dict['analysis_workflow'])
             obj.fields['measure'].set(row_dict['measure'])
-            d[row_dict['id']] = obj
-        query = """SELECT observation, data 
+            d[row_dict['publication']][row_dict['id']] = obj
+        query = """SELECT publication, observation, data 
                      FROM dataXobservation 
-                    WHERE publication = %s"""
-        cursor.execute(query, (pub.pmid, ))
-        for (observation_id, data_id) in cursor:
-            d[observation_id].fields['data'].set(data_id)
-        Observation._get_annotation_ids_from_db(pub, d, cursor)
-        Observation._get_errors_from_db(pub, d, cursor)
+                    WHERE publication = ANY(%s)"""
+        database.execute(cursor, query, (list(pubs), ))
+        for (pmid, observation_id, data_id) in cursor:
+            d[pmid][observation_id].fields['data'].set(data_id)
+        Observation._get_annotation_ids_from_db(pubs, d, cursor)
+        Observation._get_errors_from_db(pubs, d, cursor)
         return d
 
     @classmethod
     def _clear_pmid(cls, pmid, cursor):
         query = "DELETE FROM dataXobservation WHERE publication = %s"
-        cursor.execute(query, (pmid, ))
+        database.execute(cursor, query, (pmid, ))
         query = """DELETE FROM observationXmodel_application 
                     WHERE publication = %s"""
-        cursor.execute(query, (pmid, ))
+        database.execute(cursor, query, (pmid, ))
         super(Observation, cls)._clear_pmid(pmid, cursor)
         return
 
@@ -572,14 +681,14 @@ class Observation(Entity):
                   self.id, 
                   aw, 
                   self['measure'])
-        cursor.execute(query, params)
+        database.execute(cursor, query, params)
         query = """INSERT INTO dataXobservation (publication, 
                                                  data, 
                                                  observation) 
                    VALUES (%s, %s, %s)"""
         for data in self.data:
             params = (self.pub.pmid, data.id, self.id)
-            cursor.execute(query, params)
+            database.execute(cursor, query, params)
         self._insert_annotations(cursor)
         self._insert_errors(cursor)
         return
@@ -591,7 +700,8 @@ class Observation(Entity):
         elif aw_id not in self.pub.entities['AnalysisWorkflow']:
             self.fields['analysisworkflow'].reset()
             self.analysis_workflow = None
-            err = errors.LinkError('Undefined analysis workflow "%s"' % aw)
+            msg = 'Undefined analysis workflow "%s"' % aw_id
+            err = errors.LinkError(msg)
             self.errors.append(err)
         else:
             aw = self.pub.entities['AnalysisWorkflow'][aw_id]
@@ -611,16 +721,6 @@ class Observation(Entity):
                     d.observations.append(self)
         return
 
-    def score(self):
-        self.points.append((10, 'Existential credit'))
-        if not self['measure']:
-            self.points.append((-5, 'Missing measure'))
-        if not self.data:
-            self.points.append((-2, 'Missing data'))
-        if not self.analysis_workflow:
-            self.points.append((-2, 'Missing analysis workflow'))
-        return
-
 class Model(Entity):
 
     field_defs = (('type', Field, 'Type'), 
@@ -628,40 +728,45 @@ class Model(Entity):
 
     table = 'model'
 
+    type_id = 7
+
+    owned_tables = (('model_variable', 'model'), )
+
     @classmethod
-    def _get_from_db(cls, pub, cursor):
-        d = {}
+    def _get_many_from_db(cls, pubs, cursor):
+        d = dict([ (pmid, {}) for pmid in pubs ])
         query = """SELECT * 
                      FROM model 
-                    WHERE publication = %s"""
-        cursor.execute(query, (pub.pmid, ))
+                    WHERE publication = ANY(%s)"""
+        database.execute(cursor, query, (list(pubs), ))
         cols = [ el[0] for el in cursor.description ]
         for row in cursor:
             row_dict = dict(zip(cols, row))
+            pub = pubs[row_dict['publication']]
             obj = Model(pub, row_dict['id'])
             obj.fields['type'].set(row_dict['type'])
-            d[row_dict['id']] = obj
-        query = """SELECT model, variable 
+            d[row_dict['publication']][row_dict['id']] = obj
+        query = """SELECT publication, model, variable 
                      FROM model_variable 
-                    WHERE publication = %s"""
-        cursor.execute(query, (pub.pmid, ))
-        for (model_id, variable) in cursor:
-            d[model_id].fields['variable'].set(variable)
-        Model._get_annotation_ids_from_db(pub, d, cursor)
-        Model._get_errors_from_db(pub, d, cursor)
+                    WHERE publication = ANY(%s)"""
+        database.execute(cursor, query, (list(pubs), ))
+        for (pmid, model_id, variable) in cursor:
+            d[pmid][model_id].fields['variable'].set(variable)
+        Model._get_annotation_ids_from_db(pubs, d, cursor)
+        Model._get_errors_from_db(pubs, d, cursor)
         return d
 
     @classmethod
     def _clear_pmid(cls, pmid, cursor):
         query = "DELETE FROM model_variable WHERE publication = %s"
-        cursor.execute(query, (pmid, ))
+        database.execute(cursor, query, (pmid, ))
         super(Model, cls)._clear_pmid(pmid, cursor)
         return
 
     def _insert(self, cursor):
         query = "INSERT INTO model (publication, id, type) VALUES (%s, %s, %s)"
         params = (self.pub.pmid, self.id, self['type'])
-        cursor.execute(query, params)
+        database.execute(cursor, query, params)
         if self['variable'] is not None:
             query = """INSERT INTO model_variable (publication, 
                                                    model, 
@@ -669,37 +774,29 @@ class Model(Entity):
                        VALUES (%s, %s, %s)"""
             for val in self['variable']:
                 params = (self.pub.pmid, self.id, val)
-                cursor.execute(query, params)
+                database.execute(cursor, query, params)
         self._insert_annotations(cursor)
         self._insert_errors(cursor)
         return
 
-    def score(self):
-        self.points.append((10, 'Existential credit'))
-        # check if any variables are defined
-        # check for bad interaction variables
-        if not self['type']:
-            self.points.append((-4, 'No model type defined'))
-        if not self['variable']:
-            self.points.append((-4, 'No variables defined'))
-        else:
-            simple_vars = []
-            int_vars = []
-            bad_components = set()
-            for var in self['variable']:
-                if '+' in var:
-                    int_vars.append(var)
-                else:
-                    simple_vars.append(var)
-            for int_var in int_vars:
-                for int_component in int_var.split('+'):
-                    if int_component not in simple_vars:
-                        bad_components.add(int_component)
-            if bad_components:
-                vars = ', '.join(sorted(bad_components))
-                msg = 'Variables only in interaction terms: %s' % vars
-                self.points.append((-2, msg))
-        return
+    def check_interaction_variables(self):
+        """return a note if any variables are only in interaction terms"""
+        simple_vars = []
+        int_vars = []
+        bad_components = set()
+        for var in self['variable'] or []:
+            if '+' in var:
+                int_vars.append(var)
+            else:
+                simple_vars.append(var)
+        for int_var in int_vars:
+            for int_component in int_var.split('+'):
+                if int_component not in simple_vars:
+                    bad_components.add(int_component)
+        if not bad_components:
+            return None
+        vars = ', '.join(sorted(bad_components))
+        return 'Variables only in interaction terms: %s' % vars
 
 class ModelApplication(Entity):
 
@@ -710,36 +807,45 @@ class ModelApplication(Entity):
 
     table = 'model_application'
 
+    type_id = 8
+
+    link_fields = (('observation', 'Observation'), 
+                   ('model', 'Model'))
+
+    owned_tables = (('observationXmodel_application', 'model_application'), )
+
     @classmethod
-    def _get_from_db(cls, pub, cursor):
-        d = {}
+    def _get_many_from_db(cls, pubs, cursor):
+        d = dict([ (pmid, {}) for pmid in pubs ])
         query = """SELECT * 
                      FROM model_application 
-                    WHERE publication = %s"""
-        cursor.execute(query, (pub.pmid, ))
+                    WHERE publication = ANY(%s)"""
+        database.execute(cursor, query, (list(pubs), ))
         cols = [ el[0] for el in cursor.description ]
         for row in cursor:
             row_dict = dict(zip(cols, row))
+            pub = pubs[row_dict['publication']]
             obj = ModelApplication(pub, row_dict['id'])
             obj.fields['model'].set(row_dict['model'])
             obj.fields['url'].set(row_dict['url'])
             obj.fields['software'].set(row_dict['software'])
-            d[row_dict['id']] = obj
-        query = """SELECT observation, model_application 
+            d[row_dict['publication']][row_dict['id']] = obj
+        query = """SELECT publication, observation, model_application 
                      FROM observationXmodel_application 
-                    WHERE publication = %s"""
-        cursor.execute(query, (pub.pmid, ))
-        for (observation_id, model_application_id) in cursor:
-            d[model_application_id].fields['observation'].set(observation_id)
-        ModelApplication._get_annotation_ids_from_db(pub, d, cursor)
-        ModelApplication._get_errors_from_db(pub, d, cursor)
+                    WHERE publication = ANY(%s)"""
+        database.execute(cursor, query, (list(pubs), ))
+        for (pmid, observation_id, model_application_id) in cursor:
+            ma = d[pmid][model_application_id]
+            ma.fields['observation'].set(observation_id)
+        ModelApplication._get_annotation_ids_from_db(pubs, d, cursor)
+        ModelApplication._get_errors_from_db(pubs, d, cursor)
         return d
 
     @classmethod
     def _clear_pmid(cls, pmid, cursor):
         query = """DELETE FROM observationXmodel_application 
                     WHERE publication = %s"""
-        cursor.execute(query, (pmid, ))
+        database.execute(cursor, query, (pmid, ))
         super(ModelApplication, cls)._clear_pmid(pmid, cursor)
         return
 
@@ -759,15 +865,13 @@ class ModelApplication(Entity):
                   model, 
                   self['url'], 
                   self['software'])
-        cursor.execute(query, params)
+        database.execute(cursor, query, params)
         query = """INSERT INTO observationXmodel_application 
                                (publication, observation, model_application) 
                    VALUES (%s, %s, %s)"""
-        print '=', self.id
         for obs in self.observations:
-            print obs.id
             params = (self.pub.pmid, obs.id, self.id)
-            cursor.execute(query, params)
+            database.execute(cursor, query, params)
         self._insert_annotations(cursor)
         self._insert_errors(cursor)
         return
@@ -798,18 +902,6 @@ class ModelApplication(Entity):
                     obs.model_applications.append(self)
         return
 
-    def score(self):
-        self.points.append((11, 'Existential credit'))
-        if not self['url']:
-            self.points.append((-5, 'No link to analysis'))
-        if not self['software']:
-            self.points.append((-1, 'Missing software'))
-        if not self.model:
-            self.points.append((-2, 'Missing model'))
-        if not self['observation']:
-            self.points.append((-2, 'Missing observation(s)'))
-        return
-
 class Result(Entity):
 
     field_defs = (('modelapplication', Field, 'Model Application'), 
@@ -821,37 +913,44 @@ class Result(Entity):
 
     table = 'result'
 
+    type_id = 9
+
+    link_fields = (('modelapplication', 'ModelApplication'), )
+
+    owned_tables = (('result_variable', 'result'), )
+
     @classmethod
-    def _get_from_db(cls, pub, cursor):
-        d = {}
+    def _get_many_from_db(cls, pubs, cursor):
+        d = dict([ (pmid, {}) for pmid in pubs ])
         query = """SELECT * 
                      FROM result 
-                    WHERE publication = %s"""
-        cursor.execute(query, (pub.pmid, ))
+                    WHERE publication = ANY(%s)"""
+        database.execute(cursor, query, (list(pubs), ))
         cols = [ el[0] for el in cursor.description ]
         for row in cursor:
             row_dict = dict(zip(cols, row))
+            pub = pubs[row_dict['publication']]
             obj = Result(pub, row_dict['id'])
             obj.fields['modelapplication'].set(row_dict['model_application'])
             obj.fields['value'].set(row_dict['value'])
             obj.fields['f'].set(row_dict['f'])
             obj.fields['p'].set(row_dict['p'])
             obj.fields['interpretation'].set(row_dict['interpretation'])
-            d[row_dict['id']] = obj
-        query = """SELECT result, variable 
+            d[row_dict['publication']][row_dict['id']] = obj
+        query = """SELECT publication, result, variable 
                      FROM result_variable 
-                    WHERE publication = %s"""
-        cursor.execute(query, (pub.pmid, ))
-        for (result_id, variable) in cursor:
-            d[result_id].fields['variable'].set(variable)
-        Result._get_annotation_ids_from_db(pub, d, cursor)
-        Result._get_errors_from_db(pub, d, cursor)
+                    WHERE publication = ANY(%s)"""
+        database.execute(cursor, query, (list(pubs), ))
+        for (pmid, result_id, variable) in cursor:
+            d[pmid][result_id].fields['variable'].set(variable)
+        Result._get_annotation_ids_from_db(pubs, d, cursor)
+        Result._get_errors_from_db(pubs, d, cursor)
         return d
 
     @classmethod
     def _clear_pmid(cls, pmid, cursor):
         query = "DELETE FROM result_variable WHERE publication = %s"
-        cursor.execute(query, (pmid, ))
+        database.execute(cursor, query, (pmid, ))
         super(Result, cls)._clear_pmid(pmid, cursor)
         return
 
@@ -875,7 +974,7 @@ class Result(Entity):
                   self['f'], 
                   self['p'], 
                   self['interpretation'])
-        cursor.execute(query, params)
+        database.execute(cursor, query, params)
         if self['variable'] is not None:
             query = """INSERT INTO result_variable (publication, 
                                                     result, 
@@ -883,7 +982,7 @@ class Result(Entity):
                        VALUES (%s, %s, %s)"""
             for val in self['variable']:
                 params = (self.pub.pmid, self.id, val)
-                cursor.execute(query, params)
+                database.execute(cursor, query, params)
         self._insert_annotations(cursor)
         self._insert_errors(cursor)
         return
@@ -902,33 +1001,19 @@ class Result(Entity):
             self.model_application = ma
         return
 
-    def score(self):
-        self.points.append((23, 'Existential credit'))
-        if not self['value']:
-            self.points.append((-3, 'Missing "Value"'))
-        if not self['f']:
-            self.points.append((-2, 'Missing F'))
-        if not self['p']:
-            self.points.append((-5, 'Missing P'))
-        if not self['interpretation']:
-            self.points.append((-2, 'Missing interpretation'))
+    def check_model_variables(self):
+        """return a note if any variables aren't defined in the model"""
         model_vars = []
-        if not self.model_application:
-            self.points.append((-5, 'Missing model application'))
-        elif self.model_application.model:
+        if self.model_application and self.model_application.model:
             model_vars = self.model_application.model['variable']
-        if not self['variable']:
-            self.points.append((-5, 'Missing variable(s)'))
-        else:
-            bad_vars = set()
-            for var in self['variable']:
-                if var not in model_vars:
-                    bad_vars.add(var)
-            if bad_vars:
-                fmt = 'Variables not defined in the model: %s'
-                msg = fmt % ', '.join(sorted(bad_vars))
-                self.points.append((-2, msg))
-        return
+        bad_vars = set()
+        for var in self['variable'] or []:
+            if var not in model_vars:
+                bad_vars.add(var)
+        if not bad_vars:
+            return None
+        fmt = 'Variables not defined in the model: %s'
+        return fmt % ', '.join(sorted(bad_vars))
 
 # entities[markup entity type] = entity class
 # this order propagates to Publication.entities, whose order is used to put 
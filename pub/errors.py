@@ -1,4 +1,3 @@
-import cgi
 from .utils import annot_url
 
 class BaseMarkupError:
@@ -7,6 +6,9 @@ class BaseMarkupError:
 
     these are not derived from Exception because they are not errors to be 
     caught in code
+
+    type_id is the error type's ID in the error_type table, which is what 
+    publication_error and entity_error store
     """
 
 class BaseAnnotationError(BaseMarkupError):
@@ -20,6 +22,7 @@ class BaseAnnotationError(BaseMarkupError):
         return
 
     def render(self):
+        import cgi
         fmt = '<a href="%s">%s</a>'
         return fmt % (annot_url(self.annotation_id), cgi.escape(self.msg))
 
@@ -27,6 +30,8 @@ class MissingOrUnknownTypeError(BaseAnnotationError):
 
     """missing or unknown entity type"""
 
+    type_id = 1
+
     def __init__(self, annot_id):
         BaseAnnotationError.__init__(self, annot_id)
         self.data = None
@@ -37,6 +42,8 @@ class BadFieldDefinitionError(BaseAnnotationError):
 
     """bad field definition line"""
 
+    type_id = 2
+
     def __init__(self, annot_id):
         BaseAnnotationError.__init__(self, annot_id)
         self.data = None
@@ -47,6 +54,8 @@ class DuplicateIDError(BaseAnnotationError):
 
     """duplicate entity ID"""
 
+    type_id = 3
+
     def __init__(self, annot_id, id):
         BaseAnnotationError.__init__(self, annot_id)
         self.data = id
@@ -57,6 +66,8 @@ class MissingIDError(BaseAnnotationError):
 
     """missing entity ID"""
 
+    type_id = 4
+
     def __init__(self, annot_id):
         BaseAnnotationError.__init__(self, annot_id)
         self.data = None
@@ -67,6 +78,8 @@ class UnknownIDError(BaseAnnotationError):
 
     """unknown entity ID in extension"""
 
+    type_id = 5
+
     def __init__(self, annot_id, id):
         BaseAnnotationError.__init__(self, annot_id)
         self.data = id
@@ -85,12 +98,15 @@ class BaseEntityError(BaseMarkupError):
         return
 
     def render(self):
+        import cgi
         return cgi.escape(self.msg)
 
 class LinkError(BaseEntityError):
 
     """inter-entity link error"""
 
+    type_id = 6
+
     def __init__(self, msg):
         BaseEntityError.__init__(self)
         self.data = msg
@@ -101,10 +117,22 @@ class UnknownFieldError(BaseEntityError):
 
     """unknown field in entity definition"""
 
+    type_id = 7
+
     def __init__(self, name):
         BaseEntityError.__init__(self)
         self.data = name
         self.msg = 'Unknown field "%s"' % name
         return
 
+# error_types[error type ID] = error class
+error_types = dict([ (cls.type_id, cls) 
+                     for cls in (MissingOrUnknownTypeError, 
+                                 BadFieldDefinitionError, 
+                                 DuplicateIDError, 
+                                 MissingIDError, 
+                                 UnknownIDError, 
+                                 LinkError, 
+                                 UnknownFieldError) ])
+
 # eof
@@ -2,7 +2,11 @@ class PubError(Exception):
 
     """base class for exceptions"""
 
-class PubMedError(PubError):
+class UpstreamError(PubError):
+
+    """error in a request to an upstream service"""
+
+class PubMedError(UpstreamError):
 
     """error in PubMed Central request/response"""
 
@@ -18,7 +22,7 @@ class PublicationNotFoundError(PubError):
     def __str__(self):
         return '%s %s not found' % (self.id_type, self.id)
 
-class HypothesisError(PubError):
+class HypothesisError(UpstreamError):
 
     """error in hypothes.is call"""
 
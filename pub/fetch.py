@@ -0,0 +1,176 @@
+# HTTPS requests to upstream services (PubMed and hypothes.is) with 
+# timeouts, retries, and a per-host circuit breaker
+#
+# settings are in the [fetch] section of the configuration file:
+#
+#     connect_timeout - seconds (default 5)
+#     read_timeout - seconds (default 20)
+#     retries - retries after transient errors (default 3)
+#     backoff - base retry delay in seconds (default 0.5); retry n waits 
+#               a random time up to backoff * 2**n
+#     failure_threshold - consecutive failed requests to a host before 
+#                         its circuit opens (default 5)
+#     reset_timeout - seconds an open circuit waits before letting a 
+#                     trial request through (default 60)
+#
+# requests for a host can be sent somewhere else, such as the local 
+# stand-ins run by app/load_test.py, with the [upstream] section:
+#
+#     [upstream]
+#     hypothes.is = http://127.0.0.1:8025
+#
+# rate limits and circuit breakers still go by the original host name
+
+import time
+import threading
+
+from .debug import debug
+from . import config
+from . import ratelimit
+
+# response statuses worth retrying
+retry_statuses = (429, 500, 502, 503, 504)
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+class CircuitBreaker:
+
+    """circuit breaker for one host
+
+    after threshold consecutive failures the circuit opens and requests 
+    fail immediately; after reset_timeout seconds one trial request is let 
+    through, which closes the circuit if it succeeds and opens it again if 
+    it fails
+    """
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = None
+        self.trial = False
+        self.lock = threading.Lock()
+        return
+
+    def allow(self):
+        """return True if a request may be made, False otherwise"""
+        with self.lock:
+            if self.opened is None:
+                return True
+            if time.time() - self.opened < self.reset_timeout:
+                return False
+            if self.trial:
+                return False
+            self.trial = True
+            return True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+            self.trial = False
+        return
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.threshold:
+                self.opened = time.time()
+            self.trial = False
+        return
+
+def _get_breaker(host, c):
+    with _breakers_lock:
+        if host not in _breakers:
+            threshold = c.get_default('fetch', 'failure_threshold', 5)
+            reset_timeout = c.get_default('fetch', 'reset_timeout', 60.0)
+            _breakers[host] = CircuitBreaker(threshold, reset_timeout)
+        return _breakers[host]
+
+def _get(target, path, headers, connect_timeout, read_timeout):
+    """make one request to target (<scheme>://<host>[:<port>]), returning 
+    (status, body)"""
+    import httplib
+    (scheme, netloc) = target.split('://', 1)
+    if scheme == 'http':
+        conn = httplib.HTTPConnection(netloc, timeout=connect_timeout)
+    else:
+        conn = httplib.HTTPSConnection(netloc, timeout=connect_timeout)
+    try:
+        conn.connect()
+        conn.sock.settimeout(read_timeout)
+        conn.request('GET', path, '', headers)
+        response = conn.getresponse()
+        data = response.read()
+    finally:
+        conn.close()
+    return (response.status, data)
+
+def get(host, path, headers, error_class):
+    """get(host, path, headers, error_class) -> response body
+
+    GET https://<host><path> (or <path> from the host's [upstream] 
+    setting), retrying after connection errors, timeouts, and transient 
+    response statuses
+
+    raises error_class if the request fails or if the host's circuit is 
+    open
+    """
+    import random
+    import socket
+    import httplib
+    c = config.Config()
+    connect_timeout = c.get_default('fetch', 'connect_timeout', 5.0)
+    read_timeout = c.get_default('fetch', 'read_timeout', 20.0)
+    retries = c.get_default('fetch', 'retries', 3)
+    backoff = c.get_default('fetch', 'backoff', 0.5)
+    if c.has_option('upstream', host):
+        target = c.get('upstream', host)
+    else:
+        target = 'https://%s' % host
+    breaker = _get_breaker(host, c)
+    if not breaker.allow():
+        raise error_class('%s unavailable (circuit open)' % host)
+    attempt = 0
+    try:
+        while True:
+            ratelimit.acquire(host)
+            try:
+                (status, data) = _get(target, 
+                                      path, 
+                                      headers, 
+                                      connect_timeout, 
+                                      read_timeout)
+            except (socket.error, httplib.HTTPException), exc:
+                msg = '%s request failed: %s' % (host, str(exc))
+                transient = True
+            else:
+                if status == 200:
+                    breaker.success()
+                    return data
+                msg = '%s response status %d' % (host, status)
+                transient = status in retry_statuses
+            if not transient:
+                # the host is up; this is an error in the request
+                breaker.success()
+                raise error_class(msg)
+            if attempt >= retries:
+                breaker.failure()
+                raise error_class(msg)
+            delay = random.uniform(0, backoff * 2**attempt)
+            debug('%s; retrying in %.2f s' % (msg, delay))
+            time.sleep(delay)
+            attempt += 1
+    except error_class:
+        # the breaker has been told the outcome
+        raise
+    except BaseException:
+        # anything else (a bad [upstream] URL, a certificate error, a 
+        # timeout imposed by the caller) counts as a failure; otherwise a 
+        # trial request would leave the circuit open for good
+        breaker.failure()
+        raise
+    return
+
+# eof
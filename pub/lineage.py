@@ -0,0 +1,88 @@
+# queries on the lineage table
+#
+# entity types here are markup entity types (e.g. "Result"); the functions 
+# return lists of (publication PMID, entity type, entity ID, depth) tuples
+
+import re
+from .entities import entities
+from . import database
+
+# _types[entity type ID] = markup entity type
+_types = dict([ (cls.type_id, et) for (et, cls) in entities.iteritems() ])
+
+def get_ancestors(pmid, entity_type, entity_id, ancestor_type=None):
+    """get_ancestors(pmid, entity_type, entity_id[, ancestor_type]) -> list
+
+    return the entities that the given entity depends on, optionally 
+    limited to one entity type
+    """
+    query = """SELECT publication, ancestor_type, ancestor_id, depth 
+                 FROM lineage 
+                WHERE publication = %s 
+                  AND entity_type = %s 
+                  AND entity_id = %s"""
+    params = [pmid, entities[entity_type].type_id, entity_id]
+    if ancestor_type:
+        query += " AND ancestor_type = %s"
+        params.append(entities[ancestor_type].type_id)
+    return _get(query + " ORDER BY depth, ancestor_type, ancestor_id", params)
+
+def get_descendants(pmid, entity_type, entity_id, descendant_type=None):
+    """get_descendants(pmid, entity_type, entity_id[, descendant_type]) -> 
+    list
+
+    return the entities that depend on the given entity, optionally 
+    limited to one entity type
+    """
+    query = """SELECT publication, entity_type, entity_id, depth 
+                 FROM lineage 
+                WHERE publication = %s 
+                  AND ancestor_type = %s 
+                  AND ancestor_id = %s"""
+    params = [pmid, entities[entity_type].type_id, entity_id]
+    if descendant_type:
+        query += " AND entity_type = %s"
+        params.append(entities[descendant_type].type_id)
+    return _get(query + " ORDER BY depth, entity_type, entity_id", params)
+
+def find_descendants(ancestor_type, field, value, descendant_type):
+    """find_descendants(ancestor_type, field, value, descendant_type) -> list
+
+    search the whole corpus for entities of type descendant_type that 
+    depend on an entity of type ancestor_type whose database column field 
+    has the given value
+
+    for example, all the results that depend on Siemens scanners:
+
+        find_descendants('AcquisitionInstrument', 
+                         'manufacturer', 
+                         'Siemens', 
+                         'Result')
+    """
+    if not re.search('^\w+$', field):
+        raise ValueError('bad field name')
+    ancestor_table = entities[ancestor_type].table
+    query = """SELECT l.publication, l.entity_type, l.entity_id, l.depth 
+                 FROM lineage l 
+                 JOIN %s a 
+                   ON a.publication = l.publication 
+                  AND a.id = l.ancestor_id 
+                WHERE l.ancestor_type = %%s 
+                  AND l.entity_type = %%s 
+                  AND a.%s = %%s 
+                ORDER BY l.publication, l.entity_id""" % (ancestor_table, 
+                                                           field)
+    params = (entities[ancestor_type].type_id, 
+              entities[descendant_type].type_id, 
+              value)
+    return _get(query, params)
+
+def _get(query, params):
+    with database.connect(replica=True) as db:
+        with db.cursor() as c:
+            c.execute(query, params)
+            rows = [ (str(pmid), _types[type_id], id, depth) 
+                     for (pmid, type_id, id, depth) in c ]
+    return rows
+
+# eof
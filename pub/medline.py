@@ -0,0 +1,149 @@
+# MEDLINE records and the local publication metadata table
+#
+# a MEDLINE record is a series of fields, each a tag, a hyphen and a 
+# value, with long values continued on lines that start with spaces:
+#
+#     PMID- 12345678
+#     TI  - A title that goes on
+#           to a second line.
+#     PMC - PMC1234567
+#
+# and records in a file are separated by blank lines; of the fields, we 
+# only use PMID, PMC (the PMC ID) and TI (the title)
+#
+# import_file() loads a file of MEDLINE records (as saved from PubMed or 
+# fetched in bulk with E-utilities, optionally gzip'd) into the 
+# publication_metadata table, which Publication consults before asking 
+# PubMed; files are read a line at a time, so their size doesn't matter
+
+from .debug import debug
+from . import database
+
+# fields kept by get_fields()
+fields_used = ('PMID', 'PMC', 'TI')
+
+def fields(lines):
+    """iterate over (field, value) for the fields in MEDLINE lines"""
+    field = None
+    value = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if not line.startswith(' ') and '-' in line:
+            if value:
+                yield (field, value)
+            (field, value) = [ el.strip() for el in line.split('-', 1) ]
+        elif field and line.strip():
+            value = '%s %s' % (value, line.strip())
+    if value:
+        yield (field, value)
+    return
+
+def get_fields(lines):
+    """get_fields(lines) -> dictionary
+
+    return the fields in fields_used from MEDLINE lines holding one record, 
+    keyed by field
+    """
+    d = {}
+    for (field, value) in fields(lines):
+        if field in fields_used and field not in d:
+            d[field] = value
+    return d
+
+def records(lines):
+    """iterate over the records in MEDLINE lines, yielding the output of 
+    get_fields() for each
+
+    only one record is held at a time
+    """
+    record = []
+    for line in lines:
+        if line.strip():
+            record.append(line)
+        elif record:
+            yield get_fields(record)
+            record = []
+    if record:
+        yield get_fields(record)
+    return
+
+def _open(fname):
+    if fname.endswith('.gz'):
+        import gzip
+        return gzip.open(fname, 'rb')
+    return open(fname, 'rb')
+
+def import_file(fname, batch_size=1000):
+    """import_file(fname[, batch_size]) -> (records read, rows written)
+
+    add or update the titles and PMC IDs in a MEDLINE file in the 
+    publication_metadata table, batch_size records to a transaction
+
+    records without a PMC ID are left out, since a publication can't be 
+    annotated without one, as are records without a title (or with a PMID 
+    that isn't a number)
+    """
+    from psycopg2.extras import execute_values
+    query = """INSERT INTO publication_metadata (pmid, pmc_id, title) 
+               VALUES %s 
+               ON CONFLICT (pmid) 
+               DO UPDATE SET pmc_id = EXCLUDED.pmc_id, 
+                             title = EXCLUDED.title, 
+                             imported = NOW()"""
+    def write(batch):
+        with database.pooled() as db:
+            with db.cursor() as c:
+                execute_values(c, query, batch.values(), page_size=batch_size)
+        return
+    n_read = 0
+    n_written = 0
+    # batch[PMID] = (PMID, PMC ID, title), so a PMID repeated in the file 
+    # is only written once per statement
+    batch = {}
+    with _open(fname) as fo:
+        for d in records(fo):
+            n_read += 1
+            if 'PMID' not in d or 'PMC' not in d or 'TI' not in d:
+                continue
+            if not d['PMID'].isdigit():
+                continue
+            pmid = int(d['PMID'])
+            batch[pmid] = (pmid, d['PMC'].upper(), d['TI'])
+            if len(batch) >= batch_size:
+                write(batch)
+                n_written += len(batch)
+                batch = {}
+        if batch:
+            write(batch)
+            n_written += len(batch)
+    debug('%s: %d records, %d written' % (fname, n_read, n_written))
+    return (n_read, n_written)
+
+def lookup(pmid=None, pmc_id=None):
+    """lookup([pmid[, pmc_id]]) -> (PMID, PMC ID, title) or None
+
+    look up a publication in publication_metadata by PMID or, if no PMID 
+    is given, by PMC ID
+    """
+    if pmid:
+        query = """SELECT pmid, pmc_id, title 
+                     FROM publication_metadata 
+                    WHERE pmid = %s"""
+        params = (pmid, )
+    elif pmc_id:
+        query = """SELECT pmid, pmc_id, title 
+                     FROM publication_metadata 
+                    WHERE pmc_id = %s"""
+        params = (pmc_id.upper(), )
+    else:
+        raise ValueError('neither PMID nor PMC ID given to lookup()')
+    with database.pooled(replica=True) as db:
+        with db.cursor() as c:
+            database.execute(c, query, params)
+            row = c.fetchone()
+    # PMIDs are stored as integers
+    if row:
+        row = (str(row[0]), ) + row[1:]
+    return row
+
+# eof
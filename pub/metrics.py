@@ -0,0 +1,26 @@
+# counters for monitoring
+#
+# counters are kept per process and served by the application at /metrics 
+# along with a few values read from the database; they start at zero when 
+# the process starts
+
+import threading
+
+# _counters[name] = count
+_counters = {}
+_counters_lock = threading.Lock()
+
+def incr(name, n=1):
+    with _counters_lock:
+        _counters[name] = _counters.get(name, 0) + n
+    return
+
+def get():
+    """get() -> dictionary
+
+    return the counters as a dictionary keyed by name
+    """
+    with _counters_lock:
+        return dict(_counters)
+
+# eof
@@ -0,0 +1,94 @@
+# negative cache: IDs that recently failed to load
+#
+# asking for a PMID or PMC ID that PubMed doesn't know (or that isn't in 
+# PMC yet) costs a round trip to NCBI every time, and bots ask for such 
+# IDs a lot; so failures are remembered in the negative_cache table, which 
+# all the processes share, and the same error is raised again without 
+# going upstream until the entry expires
+#
+# settings are in the [negative_cache] section of the configuration file:
+#
+#     ttl - seconds to remember that a publication wasn't found 
+#           (default 3600)
+#     error_ttl - seconds to remember an upstream error (default 60)
+#
+# entries are keyed by the normalized ID (e.g. "PMID 1234" or "PMC ID 
+# PMC1234") and an explicit reload ignores and clears the entry; hits, 
+# misses and stores are counted in pub.metrics
+
+from .exceptions import *
+from . import exceptions
+from . import config
+from . import database
+from . import metrics
+
+def key(id_type, id):
+    """return the cache key for an ID ('PMID' or 'PMC ID' and the ID)"""
+    return '%s %s' % (id_type, id.strip().upper())
+
+def check(key):
+    """raise the remembered error for key if there is one"""
+    with database.pooled() as db:
+        with db.cursor() as c:
+            query = """SELECT error_type, message 
+                         FROM negative_cache 
+                        WHERE key = %s 
+                          AND expires > NOW()"""
+            database.execute(c, query, (key, ))
+            row = c.fetchone()
+    if row is None:
+        metrics.incr('negative_cache_misses')
+        return
+    metrics.incr('negative_cache_hits')
+    (error_type, message) = row
+    if error_type == 'PublicationNotFoundError':
+        (id_type, id) = key.rsplit(' ', 1)
+        raise PublicationNotFoundError(id_type, id)
+    raise getattr(exceptions, error_type)(message)
+
+def put(key, exc):
+    """remember that loading key raised exc (a PublicationNotFoundError or 
+    an UpstreamError)"""
+    c = config.Config()
+    if isinstance(exc, PublicationNotFoundError):
+        ttl = c.get_default('negative_cache', 'ttl', 3600)
+    else:
+        ttl = c.get_default('negative_cache', 'error_ttl', 60)
+    with database.pooled() as db:
+        with db.cursor() as c:
+            query = """INSERT INTO negative_cache (key, 
+                                                   error_type, 
+                                                   message, 
+                                                   expires) 
+                       VALUES (%s, 
+                               %s, 
+                               %s, 
+                               NOW() + CAST(%s AS INTEGER) * INTERVAL '1 s') 
+                       ON CONFLICT (key) 
+                       DO UPDATE SET error_type = EXCLUDED.error_type, 
+                                     message = EXCLUDED.message, 
+                                     expires = EXCLUDED.expires"""
+            params = (key, exc.__class__.__name__, str(exc), ttl)
+            database.execute(c, query, params)
+            # keep the table from filling up with IDs nobody asks for again
+            query = "DELETE FROM negative_cache WHERE expires < NOW()"
+            database.execute(c, query)
+    metrics.incr('negative_cache_stores')
+    return
+
+def clear(key):
+    with database.pooled() as db:
+        with db.cursor() as c:
+            query = "DELETE FROM negative_cache WHERE key = %s"
+            database.execute(c, query, (key, ))
+    return
+
+def count():
+    """return the number of unexpired entries"""
+    with database.pooled(replica=True) as db:
+        with db.cursor() as c:
+            query = "SELECT COUNT(*) FROM negative_cache WHERE expires > NOW()"
+            database.execute(c, query)
+            return c.fetchone()[0]
+
+# eof
@@ -0,0 +1,155 @@
+# PMID to PMC ID mapping
+#
+# NCBI publishes the PMID and PMC ID of every PMC article in a CSV file, 
+# PMC-ids.csv (https://ftp.ncbi.nlm.nih.gov/pub/pmc/PMC-ids.csv.gz); 
+# load() copies the two columns into the pmc_id_map table so Publication 
+# can resolve one identifier from the other without asking PubMed, and 
+# so can ask hypothes.is for the annotations while PubMed is still being 
+# asked for the title
+#
+# the file is streamed into the database with COPY, a row at a time, and 
+# the table is updated from it in the same transaction, so readers see 
+# the old mapping until the new one is complete
+#
+# PMIDs missing from the file are removed from the mapping, so a file 
+# with far fewer PMIDs than the mapping (such as a truncated download) 
+# is refused rather than emptying most of the table
+
+import csv
+
+from .debug import debug
+from . import database
+
+class _CopySource:
+
+    """file-like object that reads (PMID, PMC ID) rows from the CSV 
+    file for COPY, as tab-separated lines"""
+
+    def __init__(self, fo):
+        self.reader = csv.reader(fo)
+        header = self.reader.next()
+        self.pmid_col = header.index('PMID')
+        self.pmc_id_col = header.index('PMCID')
+        self.n_rows = 0
+        self.buf = ''
+        return
+
+    def _next_line(self):
+        """return the next line for COPY, or None at the end of the file"""
+        for row in self.reader:
+            pmid = row[self.pmid_col].strip()
+            pmc_id = row[self.pmc_id_col].strip().upper()
+            # articles without a PMID
+            if not pmid.isdigit() or not pmc_id:
+                continue
+            self.n_rows += 1
+            return '%s\t%s\n' % (pmid, pmc_id)
+        return None
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buf) < size:
+            line = self._next_line()
+            if line is None:
+                break
+            self.buf += line
+        if size < 0:
+            size = len(self.buf)
+        (data, self.buf) = (self.buf[:size], self.buf[size:])
+        return data
+
+def _open(fname):
+    if fname.endswith('.gz'):
+        import gzip
+        return gzip.open(fname, 'rb')
+    return open(fname, 'rb')
+
+def load(fname, delete=True, min_fraction=0.9):
+    """load(fname[, delete[, min_fraction]]) -> (rows read, rows added or 
+    changed, rows removed)
+
+    replace the mapping with the one in a PMC-ids CSV file (gzip'd if 
+    fname ends in .gz)
+
+    if delete is false, PMIDs missing from the file are kept; otherwise 
+    they are removed, unless the file has fewer than min_fraction times as 
+    many PMIDs as the mapping, in which case nothing is changed and 
+    ValueError is raised
+    """
+    db = database.connect()
+    try:
+        with db:
+            with db.cursor() as c:
+                query = """CREATE TEMPORARY TABLE pmc_id_load (pmid INTEGER, 
+                                                               pmc_id TEXT) 
+                           ON COMMIT DROP"""
+                c.execute(query)
+                with _open(fname) as fo:
+                    source = _CopySource(fo)
+                    query = "COPY pmc_id_load (pmid, pmc_id) FROM STDIN"
+                    c.copy_expert(query, source)
+                c.execute("ANALYZE pmc_id_load")
+                if delete and min_fraction:
+                    _check_size(c, fname, min_fraction)
+                query = """INSERT INTO pmc_id_map (pmid, pmc_id) 
+                           SELECT DISTINCT ON (pmid) pmid, pmc_id 
+                             FROM pmc_id_load 
+                            ORDER BY pmid 
+                           ON CONFLICT (pmid) 
+                           DO UPDATE SET pmc_id = EXCLUDED.pmc_id 
+                           WHERE pmc_id_map.pmc_id <> EXCLUDED.pmc_id"""
+                c.execute(query)
+                n_changed = c.rowcount
+                n_removed = 0
+                if delete:
+                    query = """DELETE FROM pmc_id_map 
+                                WHERE NOT EXISTS (SELECT 1 
+                                                    FROM pmc_id_load 
+                                                   WHERE pmc_id_load.pmid = 
+                                                         pmc_id_map.pmid)"""
+                    c.execute(query)
+                    n_removed = c.rowcount
+    finally:
+        db.close()
+    fmt = '%s: %d rows, %d added or changed, %d removed'
+    debug(fmt % (fname, source.n_rows, n_changed, n_removed))
+    return (source.n_rows, n_changed, n_removed)
+
+def _check_size(cursor, fname, min_fraction):
+    """raise ValueError if pmc_id_load has fewer than min_fraction times as 
+    many PMIDs as pmc_id_map"""
+    cursor.execute("SELECT COUNT(DISTINCT pmid) FROM pmc_id_load")
+    n_new = cursor.fetchone()[0]
+    cursor.execute("SELECT COUNT(*) FROM pmc_id_map")
+    n_current = cursor.fetchone()[0]
+    if n_new < min_fraction * n_current:
+        fmt = '%s has only %d PMIDs of the %d mapped; not loaded'
+        raise ValueError(fmt % (fname, n_new, n_current))
+    return
+
+def lookup(pmid=None, pmc_id=None):
+    """lookup([pmid[, pmc_id]]) -> (PMID, PMC ID) or None
+
+    look up a publication in the mapping by PMID or, if no PMID is given, 
+    by PMC ID
+    """
+    if pmid:
+        query = "SELECT pmid, pmc_id FROM pmc_id_map WHERE pmid = %s"
+        params = (pmid, )
+    elif pmc_id:
+        query = """SELECT pmid, pmc_id 
+                     FROM pmc_id_map 
+                    WHERE pmc_id = %s 
+                    LIMIT 1"""
+        params = (pmc_id.upper(), )
+    else:
+        raise ValueError('neither PMID nor PMC ID given to lookup()')
+    with database.pooled(replica=True) as db:
+        with db.cursor() as c:
+            database.execute(c, query, params)
+            row = c.fetchone()
+    # PMIDs are stored as integers
+    if row:
+        row = (str(row[0]), ) + row[1:]
+    return row
+
+# eof
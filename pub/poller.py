@@ -0,0 +1,130 @@
+# poll hypothes.is for CANDISharePub annotations that have changed since 
+# the last poll and reload the publications they belong to
+#
+# the high-water mark (the update time of the last annotation seen) is 
+# kept in the crawl_state table and advances with every poll; the PMC IDs 
+# that failed to reload are kept there too (as a JSON object of PMC ID to 
+# number of failed attempts) and are retried by the following polls until 
+# they reload, or are given up on after max_retries attempts, so one 
+# publication that keeps failing can't hold the mark back
+#
+# settings are in the [poller] section of the configuration file:
+#
+#     max_retries - attempts to reload a publication before giving up on 
+#                   it (default 5)
+
+import re
+import json
+
+from .publication import Publication
+from .exceptions import *
+from .debug import debug
+from . import config
+from . import database
+from . import fetch
+
+state_name = 'hypothesis_updated'
+retry_state_name = 'hypothesis_retry'
+
+pmc_url_re = re.compile('/pmc/articles/(pmc\d+)', re.IGNORECASE)
+
+def _search(params):
+    import urllib
+    url = '/api/search?%s' % urllib.urlencode(params)
+    headers = {'Accept': 'application/json'}
+    return fetch.get('hypothes.is', url, headers, HypothesisError)
+
+def get_state(name):
+    """get_state(name) -> value or None"""
+    with database.connect() as db:
+        with db.cursor() as c:
+            query = "SELECT value FROM crawl_state WHERE name = %s"
+            c.execute(query, (name, ))
+            if not c.rowcount:
+                return None
+            return c.fetchone()[0]
+
+def _set_state(c, name, value):
+    query = """INSERT INTO crawl_state (name, value) 
+               VALUES (%s, %s) 
+               ON CONFLICT (name) 
+               DO UPDATE SET value = EXCLUDED.value"""
+    c.execute(query, (name, value))
+    return
+
+def set_state(name, value):
+    with database.connect() as db:
+        with db.cursor() as c:
+            _set_state(c, name, value)
+    return
+
+def get_changed(since, limit=200):
+    """get_changed(since[, limit]) -> (set of PMC IDs, high-water mark)
+
+    return the PMC IDs of the publications with CANDISharePub annotations 
+    updated after since (a hypothes.is timestamp, or None for all) and the 
+    update time of the latest of those annotations (since if there are none)
+
+    limit is the number of annotations to request at a time
+    """
+    pmc_ids = set()
+    params = {'tag': 'CANDISharePub', 
+              'sort': 'updated', 
+              'order': 'asc', 
+              'limit': limit}
+    while True:
+        if since:
+            params['search_after'] = since
+        obj = json.loads(_search(params))
+        for annot in obj['rows']:
+            mo = pmc_url_re.search(annot['uri'])
+            if mo:
+                pmc_ids.add(mo.group(1).upper())
+            since = annot['updated']
+        if len(obj['rows']) < limit:
+            break
+    return (pmc_ids, since)
+
+def poll():
+    """poll() -> (list of reloaded PMIDs, list of failed PMC IDs)
+
+    reload the publications whose annotations have changed since the last 
+    poll and those that failed to reload in earlier polls
+    """
+    max_retries = config.Config().get_default('poller', 'max_retries', 5)
+    since = get_state(state_name)
+    retry = json.loads(get_state(retry_state_name) or '{}')
+    (pmc_ids, high_water_mark) = get_changed(since)
+    debug('poll: %d publications changed since %s, %d to retry' % 
+          (len(pmc_ids), since, len(retry)))
+    pmids = []
+    failed = []
+    for pmc_id in sorted(pmc_ids | set(retry)):
+        try:
+            publication = Publication.get_by_pmc_id(pmc_id, True)
+        except PublicationNotFoundError:
+            # not in PubMed; there is nothing to reload and nothing to 
+            # retry
+            debug('poll: %s not found' % pmc_id)
+            retry.pop(pmc_id, None)
+        except PubError, data:
+            debug('poll: error reloading %s: %s' % (pmc_id, str(data)))
+            failed.append(pmc_id)
+            retry[pmc_id] = retry.get(pmc_id, 0) + 1
+            if retry[pmc_id] >= max_retries:
+                debug('poll: giving up on %s after %d attempts' % 
+                      (pmc_id, retry[pmc_id]))
+                del retry[pmc_id]
+        else:
+            pmids.append(publication.pmid)
+            retry.pop(pmc_id, None)
+    # the mark and the retry list are saved together, so a crash between 
+    # the two can't lose a failed PMC ID
+    with database.connect() as db:
+        with db.cursor() as c:
+            if high_water_mark != since:
+                _set_state(c, state_name, high_water_mark)
+            _set_state(c, retry_state_name, json.dumps(retry))
+    return (pmids, failed)
+
+# eof
@@ -1,92 +1,258 @@
 from collections import OrderedDict
+import sys
 import re
 import datetime
-import httplib
-import urllib
 import json
+import threading
+import contextlib
 
 from . import errors
 from .entities import *
 from .exceptions import *
 from .debug import debug
 from . import database
+from . import stats
+from . import scoring
+from . import medline
+from . import pmcids
+from . import negcache
+from . import fetch
+from . import snapshot
+from . import cache
 
 pmid_re = re.compile('^\d+$')
 pmc_id_re = re.compile('pmc\d+$', re.IGNORECASE)
 
+# _load_locks[PMID or PMC ID] = (lock, number of users)
+_load_locks = {}
+_load_locks_lock = threading.Lock()
+
+@contextlib.contextmanager
+def _single_flight(key):
+    """serialize loads of the same publication within this process
+
+    concurrent requests for a publication that isn't in the database then 
+    cause one upstream fetch rather than one each
+    """
+    with _load_locks_lock:
+        (lock, n) = _load_locks.get(key, (None, 0))
+        if lock is None:
+            lock = threading.Lock()
+        _load_locks[key] = (lock, n+1)
+    lock.acquire()
+    try:
+        yield
+    finally:
+        lock.release()
+        with _load_locks_lock:
+            (lock, n) = _load_locks[key]
+            if n == 1:
+                del _load_locks[key]
+            else:
+                _load_locks[key] = (lock, n-1)
+
 class Publication:
 
     @classmethod
     def get_by_pmid(cls, pmid, refresh_cache=False):
         if not pmid_re.search(pmid):
             raise ValueError('bad PMID')
+        if not refresh_cache:
+            obj = snapshot.get(pmid)
+            if obj is not None:
+                return obj
+            obj = cache.get(pmid)
+            if obj is not None:
+                return obj
         obj = cls()
         obj.pmid = pmid
-        if refresh_cache:
-            cls._clear_pmid(pmid)
-        else:
+        if not refresh_cache and obj._load_from_db():
+            cache.put(obj)
+            return obj
+        with _single_flight(pmid):
             if obj._load_from_db():
+                if refresh_cache:
+                    obj._reload()
+                    snapshot.supersede(pmid)
+                cache.put(obj)
                 return obj
-        obj._load()
+            obj._load_uncached('PMID', pmid, refresh_cache)
+        cache.put(obj)
         return obj
 
     @classmethod
     def get_by_pmc_id(cls, pmc_id, refresh_cache=False):
         if not pmc_id_re.search(pmc_id):
             raise ValueError('bad PMC ID')
+        # with the PMID, the publication can come from the snapshot or cache
+        ids = pmcids.lookup(pmc_id=pmc_id)
+        if ids:
+            return cls.get_by_pmid(ids[0], refresh_cache)
         obj = cls()
         obj.pmc_id = pmc_id.upper()
-        if refresh_cache:
-            cls._clear_pmc_id(pmc_id)
-        else:
+        if not refresh_cache and obj._load_from_db():
+            return obj
+        with _single_flight(obj.pmc_id):
             if obj._load_from_db():
+                if refresh_cache:
+                    obj._reload()
+                    snapshot.supersede(obj.pmid)
                 return obj
-        obj._load()
+            obj._load_uncached('PMC ID', obj.pmc_id, refresh_cache)
+        return obj
+
+    @classmethod
+    def get_many(cls, pmids, fetch_missing=False, max_fetches=4):
+        """Publication.get_many(pmids[, fetch_missing[, max_fetches]]) -> 
+        dictionary
+
+        return a dictionary of Publications keyed by PMID
+
+        publications in the database are loaded with a fixed number of 
+        queries however many there are; the others are left out unless 
+        fetch_missing is true, in which case they are fetched from PubMed 
+        and hypothes.is, max_fetches at a time (those that can't be fetched 
+        are still left out)
+        """
+        pmids = list(set(pmids))
+        for pmid in pmids:
+            if not pmid_re.search(pmid):
+                raise ValueError('bad PMID')
+        pubs = cls._read_many_from_db(pmids, True)
+        if database.replica_hosts():
+            # as in _load_from_db(), replace what the replica had if it 
+            # isn't the primary's current version
+            versions = cls._get_versions(pmids)
+            for pmid in pubs.keys():
+                if pmid not in versions:
+                    del pubs[pmid]
+            stale = [ pmid for (pmid, version) in versions.iteritems() 
+                      if pmid not in pubs or pubs[pmid].version != version ]
+            if stale:
+                debug('get_many: %d stale on replica' % len(stale))
+                pubs.update(cls._read_many_from_db(stale, False))
+        missing = [ pmid for pmid in pmids if pmid not in pubs ]
+        if fetch_missing and missing:
+            def fetch(pmid):
+                try:
+                    return cls.get_by_pmid(pmid)
+                except PubError, data:
+                    debug('get_many: %s: %s' % (pmid, str(data)))
+                    return None
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(min(max_fetches, len(missing)))
+            try:
+                for obj in pool.map(fetch, missing):
+                    if obj:
+                        pubs[obj.pmid] = obj
+            finally:
+                pool.close()
+                pool.join()
+        return pubs
+
+    @classmethod
+    def _read_many_from_db(cls, pmids, replica):
+        pubs = {}
+        with database.pooled(snapshot=True, replica=replica) as db:
+            with db.cursor() as c:
+                query = """SELECT pmid, pmc_id, retrieved, title, version 
+                             FROM publication 
+                            WHERE pmid = ANY(%s)"""
+                database.execute(c, query, ([ int(p) for p in pmids ], ))
+                for (pmid, pmc_id, retrieved, title, version) in c.fetchall():
+                    pmid = str(pmid)
+                    obj = cls()
+                    obj.pmid = pmid
+                    obj.pmc_id = pmc_id
+                    obj.timestamp = retrieved
+                    obj.title = title
+                    obj.version = version
+                    pubs[pmid] = obj
+                if pubs:
+                    cls._load_many_from_db(pubs, c)
+        return pubs
+
+    @classmethod
+    def _get_versions(cls, pmids):
+        """return a dictionary mapping PMIDs to their current versions, as 
+        read from the primary"""
+        with database.pooled() as db:
+            with db.cursor() as c:
+                query = """SELECT pmid, version 
+                             FROM publication 
+                            WHERE pmid = ANY(%s)"""
+                database.execute(c, query, ([ int(p) for p in pmids ], ))
+                d = dict([ (str(pmid), version) for (pmid, version) in c ])
+        return d
+
+    @classmethod
+    def from_annotations(cls, annotations, pmid=None, pmc_id=None, 
+                         title=None):
+        """Publication.from_annotations(annotations[, pmid[, pmc_id[, title]]])
+        -> Publication
+
+        build and score a publication from a list of hypothes.is 
+        annotations (as decoded from the hypothes.is JSON) without using 
+        the network or the database
+
+        the identifiers and title are only recorded, since nothing is 
+        looked up
+        """
+        obj = cls()
+        obj.pmid = pmid
+        obj.pmc_id = pmc_id
+        obj.title = title
+        obj.timestamp = datetime.datetime.utcnow()
+        obj._parse_annotations(annotations)
+        obj._score()
         return obj
 
     @classmethod
     def get_known(cls):
-        db = database.connect()
-        with db:
+        with database.pooled(replica=True) as db:
             with db.cursor() as c:
-                c.execute("SELECT pmid, title FROM publication")
-                d = dict(c)
-        db.close()
+                database.execute(c, "SELECT pmid, title FROM publication")
+                d = dict([ (str(pmid), title) for (pmid, title) in c ])
+        return d
+
+    @classmethod
+    def get_retrieved(cls):
+        """return a dictionary mapping known PMIDs to retrieval times"""
+        with database.pooled(replica=True) as db:
+            with db.cursor() as c:
+                database.execute(c, "SELECT pmid, retrieved FROM publication")
+                d = dict([ (str(pmid), t) for (pmid, t) in c ])
         return d
 
     @classmethod
     def _clear_pmid(cls, pmid):
-        with database.connect() as db:
+        with database.pooled() as db:
             with db.cursor() as c:
+                stats._clear_pmid(pmid, c)
                 query = "DELETE FROM entity_error WHERE publication = %s"
-                c.execute(query, (pmid, ))
+                database.execute(c, query, (pmid, ))
                 query = "DELETE FROM entity_annotation WHERE publication = %s"
-                c.execute(query, (pmid, ))
+                database.execute(c, query, (pmid, ))
+                query = "DELETE FROM lineage WHERE publication = %s"
+                database.execute(c, query, (pmid, ))
                 classes = entities.values()
                 classes.reverse()
                 for cls in classes:
                     cls._clear_pmid(pmid, c)
                 query = "DELETE FROM publication_error WHERE publication = %s"
-                c.execute(query, (pmid, ))
-                c.execute("DELETE FROM publication WHERE pmid = %s", (pmid, ))
-        return
-
-    @classmethod
-    def _clear_pmc_id(cls, pmc_id):
-        with database.connect() as db:
-            with db.cursor() as c:
-                query = "SELECT pmid FROM publication WHERE pmc_id = %s"
-                c.execute(query, (pmc_id, ))
-                if c.rowcount == 0:
-                    return
-                pmid = c.fetchone()[0]
-        cls._clear_pmid(pmid)
+                database.execute(c, query, (pmid, ))
+                query = "DELETE FROM publication WHERE pmid = %s"
+                database.execute(c, query, (pmid, ))
         return
 
     def __init__(self):
         self.pmid = None
         self.pmc_id = None
         self.title = None
+        # incremented each time the publication is reloaded
+        self.version = None
+        # version of the scoring rules the entities were scored under
+        self.rules_version = None
         self.errors = []
         # since we iterate over this to insert entities in the database and 
         # we need foreign keys in place, so order is important; the order 
@@ -94,92 +260,338 @@ class Publication:
         self.entities = OrderedDict()
         for et in entities:
             self.entities[et] = {}
+        # _entity_order[entity type] = list of entities sorted by ID, 
+        # filled in by sorted_entities()
+        self._entity_order = {}
         return
 
-    def _load_from_db(self):
+    def _load_from_db(self, replica=True):
+        """load the publication from the database, returning False if it 
+        isn't there
+
+        if replica is true, the publication is read from a read replica (if 
+        there are any) and then read again from the primary if the replica 
+        doesn't have the current version, so what is returned is never older 
+        than the last reload
+        """
+        found = self._read_from_db(replica)
+        if replica and database.replica_hosts():
+            if self.pmid:
+                versions = self._get_versions([self.pmid])
+                version = versions.get(self.pmid)
+            else:
+                version = None
+            if not found or self.version != version:
+                debug('%s stale or missing on replica' % self.pmid)
+                found = self._read_from_db(False)
+        return found
+
+    def _read_from_db(self, replica):
         if self.pmid:
-            query = """SELECT pmid, pmc_id, retrieved, title 
+            query = """SELECT pmid, pmc_id, retrieved, title, version 
                          FROM publication 
                         WHERE pmid = %s"""
             params = (self.pmid, )
         elif self.pmc_id:
-            query = """SELECT pmid, pmc_id, retrieved, title 
+            query = """SELECT pmid, pmc_id, retrieved, title, version 
                          FROM publication 
                         WHERE pmc_id = %s"""
             params = (self.pmc_id, )
         else:
             raise ValueError('neither PMID nor PMC ID given to _load_from_db()')
-        with database.connect() as db:
+        with database.pooled(snapshot=True, replica=replica) as db:
             with db.cursor() as c:
-                c.execute(query, params)
+                database.execute(c, query, params)
                 if not c.rowcount:
                     return False
                 row = c.fetchone()
-        self.pmid = row[0]
-        self.pmc_id = row[1]
-        self.timestamp = row[2]
-        self.title = row[3]
-        with database.connect() as db:
-            with db.cursor() as c:
-                for (entity_type, cls) in entities.iteritems():
-                    self.entities[entity_type] = cls._get_from_db(self, c)
-        for et in self.entities:
-            for ent in self.entities[et].itervalues():
-                ent.set_related()
-        for et in self.entities:
-            for ent in self.entities[et].itervalues():
-                ent.score()
-        self.errors = []
-        with database.connect() as db:
-            with db.cursor() as c:
-                query = """SELECT annotation, error_type, data 
-                             FROM publication_error 
-                            WHERE publication = %s"""
-                c.execute(query, (self.pmid, ))
-                for (annotation_id, err_type, data) in c:
-                    cls = getattr(errors, err_type)
-                    if data is None:
-                        err = cls(annotation_id)
-                    else:
-                        err = cls(annotation_id, data)
-                    self.errors.append(err)
+                self.pmid = str(row[0])
+                self.pmc_id = row[1]
+                self.timestamp = row[2]
+                self.title = row[3]
+                self.version = row[4]
+                self._entity_order = {}
+                self._load_many_from_db({self.pmid: self}, c)
         return True
 
+    @classmethod
+    def _load_many_from_db(cls, pubs, cursor, rule_set=None):
+        """load the entities and errors of publications
+
+        pubs is a dictionary of Publications keyed by PMID whose basic 
+        information (from the publication table) has already been read; 
+        the number of queries does not depend on the number of publications
+
+        the entities are scored under rule_set, by default the scoring 
+        rules in effect
+        """
+        if rule_set is None:
+            rule_set = scoring.get_rule_set()
+        # the database keys publications by integer PMID
+        by_pmid = dict([ (int(pmid), obj) 
+                         for (pmid, obj) in pubs.iteritems() ])
+        for (entity_type, ent_cls) in entities.iteritems():
+            d = ent_cls._get_many_from_db(by_pmid, cursor)
+            for (pmid, ed) in d.iteritems():
+                by_pmid[pmid].entities[entity_type] = ed
+        for obj in pubs.itervalues():
+            for ed in obj.entities.itervalues():
+                for ent in ed.itervalues():
+                    ent.set_related()
+        for obj in pubs.itervalues():
+            for ed in obj.entities.itervalues():
+                for ent in ed.itervalues():
+                    ent.score(rule_set)
+            obj.rules_version = rule_set.version
+            obj.errors = []
+        query = """SELECT publication, annotation, error_type, data 
+                     FROM publication_error 
+                    WHERE publication = ANY(%s)"""
+        database.execute(cursor, query, (list(by_pmid), ))
+        for (pmid, annotation_id, err_type, data) in cursor:
+            err_cls = errors.error_types[err_type]
+            if data is None:
+                err = err_cls(annotation_id)
+            else:
+                err = err_cls(annotation_id, data)
+            by_pmid[pmid].errors.append(err)
+        return
+
     def _load(self):
         """load information from pubmed and hypothesis"""
-        self._read_pubmed()
-        self.timestamp = datetime.datetime.utcnow()
-        self._read_annotations()
+        self._fetch()
+        self._score()
+        self.version = 1
+        with database.pooled() as db:
+            with db.cursor() as c:
+                query = """INSERT INTO publication (pmid, 
+                                                    pmc_id, 
+                                                    retrieved, 
+                                                    title, 
+                                                    version) 
+                           VALUES (%s, %s, %s, %s, %s)"""
+                params = (self.pmid, 
+                          self.pmc_id, 
+                          self.timestamp, 
+                          self.title, 
+                          self.version)
+                database.execute(c, query, params)
+                self._insert_errors(c)
+                for ed in self.entities.itervalues():
+                    for ent in ed.itervalues():
+                        ent._insert(c)
+                        ent.set_related()
+                for ed in self.entities.itervalues():
+                    for ent in ed.itervalues():
+                        ent._insert_lineage(c)
+                stats._insert(self, c)
+        return
+
+    def _load_uncached(self, id_type, id, refresh):
+        """_load() the publication unless loading it failed recently (see 
+        pub.negcache), in which case the same error is raised again
+
+        if refresh is true, any remembered failure is forgotten and the 
+        publication is loaded
+        """
+        key = negcache.key(id_type, id)
+        if refresh:
+            negcache.clear(key)
+        else:
+            negcache.check(key)
+        try:
+            self._load()
+        except (PublicationNotFoundError, UpstreamError), data:
+            negcache.put(key, data)
+            raise
+        return
+
+    def _score(self):
+        """resolve the links between entities and score them"""
         for ed in self.entities.itervalues():
             for ent in ed.itervalues():
                 ent.set_related()
         # run all .set_related() before any .score() because some .score()s 
         # rely on other entities' cross-references
+        rule_set = scoring.get_rule_set()
         for ed in self.entities.itervalues():
             for ent in ed.itervalues():
-                ent.score()
-        with database.connect() as db:
+                ent.score(rule_set)
+        self.rules_version = rule_set.version
+        return
+
+    def sorted_entities(self, entity_type):
+        """return a list of the entities of the given type sorted by ID
+
+        the order is computed once per publication
+        """
+        if entity_type not in self._entity_order:
+            ed = self.entities[entity_type]
+            order = [ ed[id] for id in sorted(ed) ]
+            self._entity_order[entity_type] = order
+        return self._entity_order[entity_type]
+
+    def _reload(self):
+        """re-read the publication and update only what has changed
+
+        the publication must have been loaded from the database; entities 
+        that are changed, added, or removed, along with all the entities 
+        that depend on them, are re-resolved, re-scored, and rewritten, and 
+        the rest are left alone
+
+        nothing is written until everything has been fetched, and then the 
+        new version is written in a single transaction, so readers see the 
+        old version until it commits and the new one after (and a failed 
+        fetch leaves the old version in place); if another process reloaded 
+        the publication in the meantime, its version is kept and read back 
+        instead
+
+        returns True if anything changed, False otherwise
+        """
+        new = self.__class__()
+        new.pmid = self.pmid
+        new.pmc_id = self.pmc_id
+        new._fetch()
+        # entities as stored in the database are already resolved, so we 
+        # need to resolve the new ones before comparing
+        for ed in new.entities.itervalues():
+            for ent in ed.itervalues():
+                ent.set_related()
+        changed = set()
+        for et in entities:
+            old_ed = self.entities[et]
+            new_ed = new.entities[et]
+            for id in set(old_ed) | set(new_ed):
+                if id not in old_ed or id not in new_ed:
+                    changed.add((et, id))
+                elif old_ed[id]._signature() != new_ed[id]._signature():
+                    changed.add((et, id))
+        # dependents of removed entities are only in the old graph and 
+        # dependents of added entities are only in the new one
+        graph = self.dependency_graph()
+        for (key, dependents) in new.dependency_graph().iteritems():
+            graph.setdefault(key, set()).update(dependents)
+        dirty = _closure(changed, graph)
+        fmt = 'reload %s: %d entities changed, %d to update'
+        debug(fmt % (self.pmid, len(changed), len(dirty)))
+        # both lists in entities order
+        old_dirty = []
+        new_dirty = []
+        for et in entities:
+            for id in self.entities[et].keys():
+                if (et, id) in dirty:
+                    old_dirty.append(self.entities[et].pop(id))
+            for (id, ent) in new.entities[et].iteritems():
+                if (et, id) not in dirty:
+                    continue
+                ent.pub = self
+                ent.points = []
+                for attr in ent.backlinks:
+                    setattr(ent, attr, [])
+                self.entities[et][id] = ent
+                new_dirty.append(ent)
+        # clean entities may hold back-links to the old dirty entities; 
+        # the new ones are put back in by .set_related() below
+        removed = set(old_dirty)
+        for ed in self.entities.itervalues():
+            for ent in ed.itervalues():
+                for attr in ent.backlinks:
+                    current = [ other for other in getattr(ent, attr) 
+                                if other not in removed ]
+                    setattr(ent, attr, current)
+        for ent in new_dirty:
+            ent.set_related()
+        rule_set = scoring.get_rule_set()
+        if self.rules_version == rule_set.version:
+            to_score = new_dirty
+        else:
+            # the clean entities were scored under other rules
+            to_score = []
+            for ed in self.entities.itervalues():
+                to_score.extend(ed.itervalues())
+        for ent in to_score:
+            ent.points = []
+            ent.score(rule_set)
+        self.rules_version = rule_set.version
+        old_errors = [ _error_key(err) for err in self.errors ]
+        new_errors = [ _error_key(err) for err in new.errors ]
+        any_changed = bool(changed) \
+                      or new.title != self.title \
+                      or sorted(new_errors) != sorted(old_errors)
+        self.title = new.title
+        self.timestamp = new.timestamp
+        self.errors = new.errors
+        self._entity_order = {}
+        with database.pooled() as db:
             with db.cursor() as c:
-                query = """INSERT INTO publication 
-                                       (pmid, pmc_id, retrieved, title) 
-                           VALUES (%s, %s, %s, %s)"""
-                params = (self.pmid, self.pmc_id, self.timestamp, self.title)
-                c.execute(query, params)
-                query = """INSERT INTO publication_error (publication, 
-                                                          annotation, 
-                                                          error_type, 
-                                                          data) 
-                           VALUES (%s, %s, %s, %s)"""
-                for error in self.errors:
-                    params = (self.pmid, 
-                              error.annotation_id, 
-                              error.__class__.__name__, 
-                              error.data)
-                    c.execute(query, params)
-                for ed in self.entities.itervalues():
-                    for ent in ed.itervalues():
-                        ent._insert(c)
-                        ent.set_related()
+                # this also locks the publication row until we commit, so 
+                # concurrent reloads are applied one at a time
+                query = """UPDATE publication 
+                              SET retrieved = %s, 
+                                  title = %s, 
+                                  version = version + 1 
+                            WHERE pmid = %s 
+                              AND version = %s"""
+                params = (self.timestamp, self.title, self.pmid, self.version)
+                database.execute(c, query, params)
+                if not c.rowcount:
+                    stale = True
+                else:
+                    stale = False
+                    self._write_reload(c, old_dirty, new_dirty)
+        if stale:
+            debug('reload %s: superseded by a concurrent reload' % self.pmid)
+            self._load_from_db()
+            return True
+        self.version += 1
+        return any_changed
+
+    def _write_reload(self, cursor, old_dirty, new_dirty):
+        """write the changes found by _reload() (other than to the 
+        publication row itself)"""
+        query = "DELETE FROM publication_error WHERE publication = %s"
+        database.execute(cursor, query, (self.pmid, ))
+        self._insert_errors(cursor)
+        # delete dependents before what they depend on and insert in the 
+        # opposite order
+        for ent in reversed(old_dirty):
+            ent._delete(cursor)
+        for ent in new_dirty:
+            ent._insert(cursor)
+        # the ancestors of clean entities are all clean, so only the lineage 
+        # of dirty entities changes
+        for ent in new_dirty:
+            ent._insert_lineage(cursor)
+        stats._clear_pmid(self.pmid, cursor)
+        stats._insert(self, cursor)
+        return
+
+    def dependency_graph(self):
+        """return the dependency graph between the entities
+
+        returns a dictionary d such that d[(entity type, entity ID)] is the 
+        set of (entity type, entity ID) of the entities that refer directly 
+        to that entity
+        """
+        graph = {}
+        for (et, ed) in self.entities.iteritems():
+            for ent in ed.itervalues():
+                for ref in ent.references():
+                    graph.setdefault(ref, set()).add((et, ent.id))
+        return graph
+
+    def _insert_errors(self, cursor):
+        query = """INSERT INTO publication_error (publication, 
+                                                  annotation, 
+                                                  error_type, 
+                                                  data) 
+                   VALUES (%s, %s, %s, %s)"""
+        for error in self.errors:
+            params = (self.pmid, 
+                      error.annotation_id, 
+                      error.type_id, 
+                      error.data)
+            database.execute(cursor, query, params)
         return
 
     def get_scores(self):
@@ -199,49 +611,70 @@ class Publication:
         f = float(s)/max;
         return int((f+0.1) / 0.2)
 
+    def _fetch(self):
+        """read the pubmed entry and the annotations
+
+        if both IDs are known beforehand (from pmc_id_map, see pub.pmcids), 
+        the annotations are read in another thread while pubmed is read in 
+        this one; otherwise pubmed has to be read first for the PMC ID
+        """
+        if not self.pmid or not self.pmc_id:
+            ids = pmcids.lookup(self.pmid, self.pmc_id)
+            if ids:
+                (self.pmid, self.pmc_id) = ids
+        if not self.pmid or not self.pmc_id:
+            self._read_pubmed()
+            self.timestamp = datetime.datetime.utcnow()
+            self._read_annotations()
+            return
+        self.timestamp = datetime.datetime.utcnow()
+        # exc_info[0] = sys.exc_info() from the annotation thread
+        exc_info = []
+        def read_annotations():
+            try:
+                self._read_annotations()
+            except:
+                exc_info.append(sys.exc_info())
+            return
+        t = threading.Thread(target=read_annotations)
+        t.start()
+        try:
+            self._read_pubmed()
+        finally:
+            t.join()
+        if exc_info:
+            raise exc_info[0][0], exc_info[0][1], exc_info[0][2]
+        return
+
     def _get_pubmed_data(self, term):
+        import urllib
         key = 'pubmed:%s' % term
-        conn = httplib.HTTPSConnection('www.ncbi.nlm.nih.gov')
         params = {'report': 'medline', 'format': 'text', 'term': term}
         url = '/pubmed/?%s' % urllib.urlencode(params)
-        conn.request('GET', url)
-        response = conn.getresponse()
-        if response.status != 200:
-            msg = 'PubMed response status %d' % response.status
-            raise PubMedError(msg)
-        data = response.read()
-        conn.close()
-        return data
+        return fetch.get('www.ncbi.nlm.nih.gov', url, {}, PubMedError)
 
     def _read_pubmed(self):
-        """get the pubmed entry
+        """get the pubmed entry, from publication_metadata if it has been 
+        imported (see pub.medline) and from PubMed otherwise
 
         raises PublicationNotFoundError if the pubmed record is not found
         """
+        row = medline.lookup(self.pmid, self.pmc_id)
+        if row:
+            (self.pmid, self.pmc_id, self.title) = row
+            return
         if self.pmid:
             term = self.pmid
         else:
             term = self.pmc_id
         data = self._get_pubmed_data(term)
-        field = None
-        value = None
-        for line in data.split('\n'):
-            if not line.startswith(' ') and '-' in line:
-                if value:
-                    if field == 'TI':
-                        self.title = value
-                    if not self.pmc_id and field == 'PMC':
-                        self.pmc_id = value
-                    if not self.pmid and field == 'PMID':
-                        self.pmid = value
-                (field, value) = [ el.strip() for el in line.split('-', 1) ]
-            elif field:
-                value = '%s %s' % (value, line.strip())
-        if value:
-            if field == 'TI':
-                self.title = value
-            if field == 'PMC':
-                self.pmc_id = value
+        d = medline.get_fields(data.split('\n'))
+        if 'TI' in d:
+            self.title = d['TI']
+        if not self.pmc_id:
+            self.pmc_id = d.get('PMC')
+        if not self.pmid:
+            self.pmid = d.get('PMID')
         if not self.pmid or not self.title or not self.pmc_id:
             if self.pmid:
                 raise PublicationNotFoundError('PMID', self.pmid)
@@ -250,26 +683,27 @@ class Publication:
         return
 
     def _get_hypothesis_data(self, url):
+        import urllib
         key = 'hypothesisurl:%s' % url
-        conn = httplib.HTTPSConnection('hypothes.is')
         url = '/api/search?%s' % urllib.urlencode({'uri': url})
-        conn.request('GET', url, '', {'Accept': 'application/json'})
-        response = conn.getresponse()
-        if response.status != 200:
-            msg = 'hypothes.is response status %d' % response.status
-            raise HypothesisError(msg)
-        data = response.read()
-        conn.close()
-        return data
+        headers = {'Accept': 'application/json'}
+        return fetch.get('hypothes.is', url, headers, HypothesisError)
 
     def _read_annotations(self):
+        """reads annotations from a PubMed Central manuscript"""
+        url_fmt = 'http://www.ncbi.nlm.nih.gov/pmc/articles/%s'
+        url = url_fmt % self.pmc_id
+        data = self._get_hypothesis_data(url)
+        obj = json.loads(data)
+        self._parse_annotations(obj['rows'])
+        return
 
-        """reads annotations from a PubMed Central manuscript
+    def _parse_annotations(self, annotations):
 
-        returns a dictionary d such that:
+        """creates entities from a list of hypothes.is annotations (as 
+        decoded from the hypothes.is JSON)
 
-            d[entity type][entity id] = list of (annotation ID, name, value) 
-                                        tuples
+        annotations without the CANDISharePub tag are ignored
 
         generates errors for:
 
@@ -284,11 +718,6 @@ class Publication:
             bad "name: value" lines
         """
 
-        url_fmt = 'http://www.ncbi.nlm.nih.gov/pmc/articles/%s'
-        url = url_fmt % self.pmc_id
-        data = self._get_hypothesis_data(url)
-        obj = json.loads(data)
-
         # first pass: through the annotations to generate a dictionary d0 
         # where d0[entity type] = list of (annotation ID, list of lines) tuples
 
@@ -296,7 +725,7 @@ class Publication:
 
         d0 = {}
 
-        for annot in obj['rows']:
+        for annot in annotations:
             if 'CANDISharePub' not in annot['tags']:
                 continue
             for et in entities:
@@ -378,7 +807,7 @@ class Publication:
                 except KeyError:
                     annot_id = d_plus[entity_type][entity_id][0][0]
                     err = errors.UnknownIDError(annot_id, entity_id)
-                    self.errors.append(err, annot_id)
+                    self.errors.append(err)
                 else:
                     base.extend(d_plus[entity_type][entity_id])
 
@@ -394,4 +823,24 @@ class Publication:
 
         return
 
+def _error_key(err):
+    return (err.__class__.__name__, err.annotation_id, err.data)
+
+def _closure(keys, graph):
+    """_closure(keys, graph) -> set of keys
+
+    return the given keys along with everything that depends on them, 
+    directly or indirectly, according to graph (as returned by 
+    Publication.dependency_graph())
+    """
+    closure = set()
+    stack = list(keys)
+    while stack:
+        key = stack.pop()
+        if key in closure:
+            continue
+        closure.add(key)
+        stack.extend(graph.get(key, ()))
+    return closure
+
 # eof
@@ -0,0 +1,136 @@
+# per-host request rate limiting
+#
+# rates are in requests per second and can be set per host in the 
+# [ratelimit] section of the configuration file, e.g.:
+#
+#     [ratelimit]
+#     www.ncbi.nlm.nih.gov = 3
+#
+# when the configuration names a database, a host's limit is shared by 
+# every process using that database (web workers, the re-crawler, export 
+# workers and so on): the bucket is a row of the rate_limit table, and 
+# each request takes its turn with one short update of the row; if the 
+# table can't be used, each process falls back to a bucket of its own, 
+# and the combined rate can then exceed the limit
+
+import time
+import threading
+from .debug import debug
+from . import config
+from . import database
+
+# default_rates[host] = requests per second; NCBI allows 3 requests per 
+# second without an API key
+default_rates = {'www.ncbi.nlm.nih.gov': 3}
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+class TokenBucket:
+
+    """token bucket rate limiter
+
+    tokens are added at rate per second up to burst; a request takes a 
+    token, waiting until one is available
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        if burst is None:
+            burst = max(1.0, self.rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.updated = time.time()
+        self.lock = threading.Lock()
+        return
+
+    def acquire(self):
+        """take a token, sleeping until it is available"""
+        with self.lock:
+            now = time.time()
+            self.tokens += (now - self.updated) * self.rate
+            self.tokens = min(self.tokens, self.burst)
+            self.updated = now
+            # the token is reserved now even if we have to wait for it, so 
+            # concurrent callers queue up behind each other
+            self.tokens -= 1
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+        return
+
+class SharedTokenBucket:
+
+    """token bucket rate limiter shared through the database
+
+    the host's row in rate_limit holds the time by which the requests 
+    granted so far are paid for at rate requests per second (the 
+    theoretical arrival time of the generic cell rate algorithm); a request 
+    moves it on by 1 / rate and then waits until it is no more than 
+    burst / rate away, which admits the same requests as TokenBucket
+    """
+
+    def __init__(self, host, rate, burst=None):
+        self.host = host
+        self.rate = float(rate)
+        if burst is None:
+            burst = max(1.0, self.rate)
+        self.burst = float(burst)
+        # used if the database can't be
+        self.local = TokenBucket(rate, burst)
+        return
+
+    def acquire(self):
+        """take a token, sleeping until it is available"""
+        import psycopg2
+        interval = 1.0 / self.rate
+        query = """INSERT INTO rate_limit (host, paid_until) 
+                   VALUES (%s, clock_timestamp() 
+                               + %s::FLOAT8 * INTERVAL '1 second') 
+                   ON CONFLICT (host) 
+                   DO UPDATE SET paid_until = 
+                       GREATEST(rate_limit.paid_until, clock_timestamp()) 
+                       + %s::FLOAT8 * INTERVAL '1 second' 
+                   RETURNING EXTRACT(EPOCH FROM paid_until 
+                                                - clock_timestamp())"""
+        try:
+            with database.pooled() as db:
+                with db.cursor() as c:
+                    database.execute(c, query, (self.host, interval, interval))
+                    ahead = float(c.fetchone()[0])
+        except psycopg2.Error, data:
+            debug('shared rate limit for %s unavailable: %s' % 
+                  (self.host, str(data).strip()))
+            self.local.acquire()
+            return
+        # the row is updated and committed before we wait, so other 
+        # processes queue up behind us rather than behind the row lock
+        wait = ahead - self.burst * interval
+        if wait > 0:
+            time.sleep(wait)
+        return
+
+def _get_bucket(host):
+    with _buckets_lock:
+        if host not in _buckets:
+            c = config.Config()
+            if c.has_option('ratelimit', host):
+                rate = c.getfloat('ratelimit', host)
+            else:
+                rate = default_rates.get(host)
+            if not rate:
+                _buckets[host] = None
+            elif c.has_option('db', 'host'):
+                _buckets[host] = SharedTokenBucket(host, rate)
+            else:
+                _buckets[host] = TokenBucket(rate)
+        return _buckets[host]
+
+def acquire(host):
+    """wait until a request to host is allowed"""
+    bucket = _get_bucket(host)
+    if bucket:
+        bucket.acquire()
+    return
+
+# eof
@@ -0,0 +1,153 @@
+# periodic re-crawl of known publications
+#
+# each run refreshes the publications with the highest priority, where 
+# priority grows with staleness (time since the publication was 
+# retrieved), page views, and how often past checks found changes; 
+# publications retrieved or checked within min_age hours are skipped
+#
+# settings are in the [crawl] section of the configuration file:
+#
+#     batch - publications to refresh per run (default 20)
+#     interval - seconds between runs (default 300)
+#     min_age - hours before a publication is refreshed again (default 24)
+#
+# fetches are limited by pub.ratelimit; throughput is at most batch 
+# publications per interval
+#
+# view and change counts live in the crawl_schedule table and the time 
+# of the last run in crawl_state, so a restarted scheduler picks up where 
+# it left off
+
+import time
+import threading
+
+from .publication import Publication
+from .exceptions import *
+from .debug import debug
+from .poller import get_state, set_state
+from . import config
+from . import database
+
+state_name = 'recrawl_last_run'
+
+# page views are counted in memory and written at most this often 
+# (seconds)
+views_flush_interval = 60
+
+_views = {}
+_views_lock = threading.Lock()
+_views_flushed = time.time()
+
+def record_view(pmid):
+    """count a page view of a publication"""
+    global _views_flushed
+    with _views_lock:
+        _views[pmid] = _views.get(pmid, 0) + 1
+        if time.time() - _views_flushed < views_flush_interval:
+            return
+        views = _views.items()
+        _views.clear()
+        _views_flushed = time.time()
+    with database.connect() as db:
+        with db.cursor() as c:
+            query = """INSERT INTO crawl_schedule (publication, views) 
+                       VALUES (%s, %s) 
+                       ON CONFLICT (publication) 
+                       DO UPDATE SET views = crawl_schedule.views 
+                                             + EXCLUDED.views"""
+            for (pmid, n) in views:
+                c.execute(query, (pmid, n))
+    return
+
+def get_candidates(n, min_age):
+    """get_candidates(n, min_age) -> list of PMIDs
+
+    return up to n PMIDs to refresh, highest priority first
+    """
+    query = """SELECT p.pmid 
+                 FROM publication p 
+                 LEFT JOIN crawl_schedule s ON s.publication = p.pmid 
+                WHERE p.retrieved < NOW() AT TIME ZONE 'UTC' 
+                                    - %(min_age)s * INTERVAL '1 hour' 
+                  AND (s.last_checked IS NULL 
+                       OR s.last_checked < NOW() AT TIME ZONE 'UTC' 
+                                           - %(min_age)s * INTERVAL '1 hour') 
+                ORDER BY EXTRACT(EPOCH FROM NOW() AT TIME ZONE 'UTC' 
+                                            - p.retrieved) / 3600 
+                         * (1 + LN(1 + COALESCE(s.views, 0))) 
+                         * (1 + COALESCE(s.changes, 0)) 
+                         / (1 + COALESCE(s.checks, 0)) DESC 
+                LIMIT %(n)s"""
+    with database.connect() as db:
+        with db.cursor() as c:
+            c.execute(query, {'n': n, 'min_age': min_age})
+            pmids = [ str(row[0]) for row in c ]
+    return pmids
+
+def refresh(pmid):
+    """refresh(pmid) -> True if the publication changed, False otherwise
+
+    raises PubError subclasses if the refresh fails; the check is recorded 
+    either way
+    """
+    changed = False
+    try:
+        obj = Publication()
+        obj.pmid = pmid
+        if obj._load_from_db():
+            changed = obj._reload()
+    finally:
+        with database.connect() as db:
+            with db.cursor() as c:
+                query = """INSERT INTO crawl_schedule (publication, 
+                                                       checks, 
+                                                       changes, 
+                                                       last_checked) 
+                           VALUES (%s, 1, %s, NOW() AT TIME ZONE 'UTC') 
+                           ON CONFLICT (publication) 
+                           DO UPDATE SET 
+                               checks = crawl_schedule.checks + 1, 
+                               changes = crawl_schedule.changes 
+                                         + EXCLUDED.changes, 
+                               last_checked = EXCLUDED.last_checked"""
+                c.execute(query, (pmid, int(changed)))
+    return changed
+
+def run_once():
+    """run_once() -> (number refreshed, number changed, number failed)
+
+    refresh one batch of publications
+    """
+    c = config.Config()
+    batch = c.get_default('crawl', 'batch', 20)
+    min_age = c.get_default('crawl', 'min_age', 24.0)
+    set_state(state_name, str(time.time()))
+    n_refreshed = 0
+    n_changed = 0
+    n_failed = 0
+    for pmid in get_candidates(batch, min_age):
+        try:
+            if refresh(pmid):
+                n_changed += 1
+        except PubError, data:
+            debug('recrawl: error refreshing %s: %s' % (pmid, str(data)))
+            n_failed += 1
+        else:
+            n_refreshed += 1
+    return (n_refreshed, n_changed, n_failed)
+
+def run():
+    """refresh publications forever"""
+    while True:
+        interval = config.Config().get_default('crawl', 'interval', 300.0)
+        last_run = get_state(state_name)
+        if last_run is not None:
+            wait = float(last_run) + interval - time.time()
+            if wait > 0:
+                time.sleep(wait)
+        (n_refreshed, n_changed, n_failed) = run_once()
+        fmt = 'recrawl: %d refreshed, %d changed, %d failed'
+        debug(fmt % (n_refreshed, n_changed, n_failed))
+    return
+
+# eof
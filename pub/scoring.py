@@ -0,0 +1,267 @@
+# scoring rules
+#
+# an entity's points come from the rules listed for its type in rules; 
+# each rule is (name, points, note, condition), and an entity gets the 
+# points, with the note, if the condition holds for it:
+#
+#     ('always', ) - always (existential credit)
+#     ('missing', field, ...) - all of the fields are empty
+#     ('unlinked', attribute) - the attribute (set by .set_related()) is
+#                               empty, i.e. a link to another entity is
+#                               missing or doesn't resolve
+#     ('check', method) - the entity's method returns a note, which
+#                         replaces the rule's note (or None if the rule
+#                         doesn't apply)
+#
+# the points can be changed without changing the code with rows in the 
+# scoring_rule table, e.g.
+#
+#     INSERT INTO scoring_rule (entity_type, rule, points)
+#     VALUES ('Result', 'existential', 20);
+#
+# and a rule is switched off by giving it 0 points
+#
+# the rules in effect (these with the overrides) have a version, recorded 
+# in publications when they are scored, so cached and snapshotted 
+# publications scored under other rules are re-scored or reloaded from the 
+# database rather than served; the overrides are read again every 
+# [scoring] refresh seconds (default 60)
+#
+# since the points aren't stored, a rule change only needs the corpus 
+# statistics recomputed, which rescore() does from the database without 
+# fetching anything (scripts/rescore.py)
+
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from .debug import debug
+from . import config
+from . import database
+
+# rules[entity type] = tuple of (name, points, note, condition)
+rules = OrderedDict()
+
+rules['SubjectGroup'] = (
+    ('existential', 5, 'Existential credit', ('always', )), 
+    ('diagnosis', -1, 'Missing diagnosis', ('missing', 'diagnosis')), 
+    ('nsubjects', -1, 'Missing nsubjects', ('missing', 'nsubjects')), 
+    ('agemean', -1, 'Missing agemean', ('missing', 'agemean')), 
+    ('agesd', -1, 'Missing agesd', ('missing', 'agesd')))
+
+rules['AcquisitionInstrument'] = (
+    ('existential', 7, 'Existential credit', ('always', )), 
+    ('type', -1, 'Missing type', ('missing', 'type')), 
+    ('location', -1, 'Missing location', ('missing', 'location')), 
+    ('field', -2, 'Missing field', ('missing', 'field')), 
+    ('manufacturer', -1, 'Missing manufacturer', 
+     ('missing', 'manufacturer')), 
+    ('model', -1, 'Missing model', ('missing', 'model')))
+
+rules['Acquisition'] = (
+    ('existential', 3, 'Existential credit', ('always', )), 
+    ('type', -1, 'Missing type', ('missing', 'type')), 
+    ('acquisition_instrument', -1, 'Missing acquisition instrument', 
+     ('unlinked', 'acquisition_instrument')))
+
+rules['Data'] = (
+    ('existential', 10, 'Existential credit', ('always', )), 
+    ('link', -5, 'No link to data (DOI or URL)', ('missing', 'url', 'doi')), 
+    ('subject_group', -1, 'Missing subject group', 
+     ('unlinked', 'subject_group')), 
+    ('acquisition', -1, 'Missing acquisition', ('unlinked', 'acquisition')))
+
+rules['AnalysisWorkflow'] = (
+    ('existential', 7, 'Existential credit', ('always', )), 
+    ('method', -1, 'Missing method', ('missing', 'method')), 
+    ('methodurl', -2, 'Missing method URL', ('missing', 'methodurl')), 
+    ('software', -1, 'Missing software', ('missing', 'software')), 
+    ('software_link', -2, 'Missing software link', 
+     ('missing', 'softwarenitrcid', 'softwarerrid', 'softwareurl')))
+
+rules['Observation'] = (
+    ('existential', 10, 'Existential credit', ('always', )), 
+    ('measure', -5, 'Missing measure', ('missing', 'measure')), 
+    ('data', -2, 'Missing data', ('unlinked', 'data')), 
+    ('analysis_workflow', -2, 'Missing analysis workflow', 
+     ('unlinked', 'analysis_workflow')))
+
+rules['Model'] = (
+    ('existential', 10, 'Existential credit', ('always', )), 
+    ('type', -4, 'No model type defined', ('missing', 'type')), 
+    ('variable', -4, 'No variables defined', ('missing', 'variable')), 
+    ('interaction_variables', -2, None, 
+     ('check', 'check_interaction_variables')))
+
+rules['ModelApplication'] = (
+    ('existential', 11, 'Existential credit', ('always', )), 
+    ('url', -5, 'No link to analysis', ('missing', 'url')), 
+    ('software', -1, 'Missing software', ('missing', 'software')), 
+    ('model', -2, 'Missing model', ('unlinked', 'model')), 
+    ('observation', -2, 'Missing observation(s)', 
+     ('missing', 'observation')))
+
+rules['Result'] = (
+    ('existential', 23, 'Existential credit', ('always', )), 
+    ('value', -3, 'Missing "Value"', ('missing', 'value')), 
+    ('f', -2, 'Missing F', ('missing', 'f')), 
+    ('p', -5, 'Missing P', ('missing', 'p')), 
+    ('interpretation', -2, 'Missing interpretation', 
+     ('missing', 'interpretation')), 
+    ('model_application', -5, 'Missing model application', 
+     ('unlinked', 'model_application')), 
+    ('variable', -5, 'Missing variable(s)', ('missing', 'variable')), 
+    ('model_variables', -2, None, ('check', 'check_model_variables')))
+
+_rule_set = None
+_rule_set_lock = threading.Lock()
+
+class RuleSet:
+
+    """the scoring rules in effect: the rules above with the points 
+    overridden from the database
+
+    the rule set is good for max_age seconds (for ever if None) under the 
+    configuration file it was read with
+    """
+
+    def __init__(self, overrides, max_age=None):
+        self.rules = OrderedDict()
+        for (entity_type, entity_rules) in rules.iteritems():
+            self.rules[entity_type] = []
+            for (name, points, note, condition) in entity_rules:
+                points = overrides.get((entity_type, name), points)
+                rule = (name, points, note, condition)
+                self.rules[entity_type].append(rule)
+        for key in overrides:
+            if key[0] not in rules \
+                or key[1] not in [ r[0] for r in rules[key[0]] ]:
+                debug('unknown scoring rule %s.%s' % key)
+        effective = repr(self.rules.items())
+        self.version = hashlib.sha1(effective).hexdigest()[:12]
+        self.loaded = time.time()
+        self.config = config._config
+        self.max_age = max_age
+        return
+
+    def score(self, ent):
+        """return the list of (points, note) for an entity"""
+        return [ (value, note) for (name, value, note) in self.apply(ent) ]
+
+    def apply(self, ent):
+        """return the list of (rule name, points, note) for the rules that 
+        apply to an entity"""
+        points = []
+        entity_rules = self.rules[ent.__class__.__name__]
+        for (name, value, note, condition) in entity_rules:
+            if value == 0:
+                continue
+            if condition[0] == 'always':
+                pass
+            elif condition[0] == 'missing':
+                if [ f for f in condition[1:] if ent[f] ]:
+                    continue
+            elif condition[0] == 'unlinked':
+                if getattr(ent, condition[1]):
+                    continue
+            elif condition[0] == 'check':
+                note = getattr(ent, condition[1])()
+                if note is None:
+                    continue
+            else:
+                raise ValueError('unknown scoring condition %s' % condition[0])
+            points.append((name, value, note))
+        return points
+
+def _read_overrides():
+    """return a dictionary of point overrides keyed by (entity type, rule 
+    name)
+
+    there are none if there is no configuration (and so no database), as 
+    when scoring offline
+    """
+    if config._config is None:
+        return {}
+    with database.pooled() as db:
+        with db.cursor() as c:
+            query = "SELECT entity_type, rule, points FROM scoring_rule"
+            database.execute(c, query)
+            overrides = dict([ ((row[0], row[1]), row[2]) for row in c ])
+    return overrides
+
+def _read_max_age():
+    """return [scoring] refresh, or None if there is no configuration"""
+    if config._config is None:
+        return None
+    return config.Config().get_default('scoring', 'refresh', 60.0)
+
+def _expired(rule_set):
+    if rule_set.config != config._config:
+        return True
+    if rule_set.max_age is None:
+        return False
+    return time.time() - rule_set.loaded > rule_set.max_age
+
+def get_rule_set(refresh=False):
+    """return the RuleSet in effect
+
+    the overrides are read again if they are older than [scoring] refresh 
+    seconds, or if refresh is true
+    """
+    global _rule_set
+    with _rule_set_lock:
+        if refresh or _rule_set is None or _expired(_rule_set):
+            _rule_set = RuleSet(_read_overrides(), _read_max_age())
+        return _rule_set
+
+def version():
+    """return the version of the rules in effect"""
+    return get_rule_set().version
+
+def rescore(batch_size=100):
+    """re-score every publication in the database under the rules in effect 
+    and recompute its statistics
+
+    publications are read from the primary batch_size at a time and locked 
+    while their statistics are rewritten, so a concurrent reload waits 
+    rather than interleaving its statistics with ours
+
+    returns the number of publications re-scored
+    """
+    # imported here because publication imports this module
+    from .publication import Publication
+    from . import stats
+    rule_set = get_rule_set(refresh=True)
+    pmids = sorted(Publication.get_known(), key=int)
+    n = 0
+    for i in xrange(0, len(pmids), batch_size):
+        batch = pmids[i:i+batch_size]
+        with database.pooled() as db:
+            with db.cursor() as c:
+                query = """SELECT pmid, pmc_id, retrieved, title, version 
+                             FROM publication 
+                            WHERE pmid = ANY(%s) 
+                              FOR UPDATE"""
+                database.execute(c, query, ([ int(p) for p in batch ], ))
+                pubs = {}
+                for (pmid, pmc_id, retrieved, title, version) in c.fetchall():
+                    pmid = str(pmid)
+                    obj = Publication()
+                    obj.pmid = pmid
+                    obj.pmc_id = pmc_id
+                    obj.timestamp = retrieved
+                    obj.title = title
+                    obj.version = version
+                    pubs[pmid] = obj
+                if not pubs:
+                    continue
+                Publication._load_many_from_db(pubs, c, rule_set)
+                for obj in pubs.itervalues():
+                    stats._clear_pmid(obj.pmid, c)
+                    stats._insert(obj, c, rule_set)
+        n += len(pubs)
+        debug('rescore: %d of %d' % (n, len(pmids)))
+    return n
+
+# eof
@@ -0,0 +1,313 @@
+# read-only snapshots of the publications in the database
+#
+# a snapshot is a single file holding every publication with its entities, 
+# errors and scores, so a new web process can serve publications without
+# loading them from the database; it is used when the configuration file 
+# names one:
+#
+#     [snapshot]
+#     file = /var/lib/cspub/snapshot
+#     check_interval = 10
+#
+# the file is:
+#
+#     magic, index offset and publication count (the header)
+#     one zlib-compressed JSON record per publication
+#     the index: (PMID, record offset, record length) for each
+#         publication, sorted by PMID
+#
+# the file is memory-mapped and the index is searched in place, so opening
+# a snapshot reads nothing but the header and only the publications that
+# are asked for are decoded
+#
+# decoded publications are kept in the process, as many as the 
+# publication cache holds ([cache] size, see pub.cache), so a publication 
+# read again is neither decompressed nor decoded again
+#
+# a publication is only served from the snapshot while its version 
+# matches the one in the database; that is checked (one small query, as 
+# for pub.cache) when the publication is first read and then at most 
+# every check_interval seconds (default 10), so reads in between don't go 
+# to the database at all, and a reload by another process is noticed 
+# within check_interval seconds (a reload by this process at once), after 
+# which the snapshot copy is passed over; publications are also re-scored 
+# if the scoring rules have changed (see pub.scoring)
+
+import os
+import mmap
+import json
+import zlib
+import time
+import struct
+import datetime
+import threading
+from collections import OrderedDict
+from . import config
+from . import database
+from . import errors
+from . import scoring
+from .entities import entities
+
+magic = 'CSPUBSN1'
+_header = struct.Struct('<QI')
+_index_entry = struct.Struct('<IQI')
+
+# _snapshots[configuration file] = Snapshot, or None if it names none
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+class Snapshot:
+
+    """an open snapshot file
+
+    up to keep decoded publications are kept, and their versions are 
+    checked against the database every check_interval seconds
+    """
+
+    def __init__(self, fname, keep=1000, check_interval=10.0):
+        self.fname = fname
+        self.keep = keep
+        self.check_interval = check_interval
+        with open(fname, 'rb') as fo:
+            self._map = mmap.mmap(fo.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(magic)] != magic:
+            self._map.close()
+            raise ValueError('%s is not a publication snapshot' % fname)
+        (self._index_offset, self._count) = \
+            _header.unpack_from(self._map, len(magic))
+        # PMIDs known to have been reloaded since the snapshot was written
+        self._superseded = set()
+        # _decoded[PMID] = (Publication, time its version was checked), 
+        # least recently used first
+        self._decoded = OrderedDict()
+        self._lock = threading.Lock()
+        return
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, pmid):
+        return self._find(pmid) is not None
+
+    def _entry(self, i):
+        offset = self._index_offset + i * _index_entry.size
+        return _index_entry.unpack_from(self._map, offset)
+
+    def _find(self, pmid):
+        """return (offset, length) of the record for pmid, or None"""
+        if pmid in self._superseded:
+            return None
+        pmid = int(pmid)
+        lo = 0
+        hi = self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            (entry_pmid, offset, length) = self._entry(mid)
+            if entry_pmid == pmid:
+                return (offset, length)
+            if entry_pmid < pmid:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def pmids(self):
+        """iterate over the PMIDs in the snapshot, in order"""
+        for i in xrange(self._count):
+            yield str(self._entry(i)[0])
+        return
+
+    def get(self, pmid):
+        """return the Publication for pmid, or None if it is not in the
+        snapshot or the database has a newer version"""
+        with self._lock:
+            entry = self._decoded.pop(pmid, None)
+            if entry is not None:
+                self._decoded[pmid] = entry
+        if entry is None or entry[0].rules_version != scoring.version():
+            loc = self._find(pmid)
+            if loc is None:
+                return None
+            (offset, length) = loc
+            data = zlib.decompress(self._map[offset:offset+length])
+            entry = (_decode(json.loads(data)), None)
+        (pub, checked) = entry
+        now = time.time()
+        if checked is None or now - checked >= self.check_interval:
+            if not _is_current(pub):
+                # versions only go up, so the copy won't be current again
+                self.supersede(pmid)
+                return None
+            checked = now
+        with self._lock:
+            # superseded by another thread while we were checking
+            if pmid in self._superseded:
+                return None
+            self._decoded.pop(pmid, None)
+            self._decoded[pmid] = (pub, checked)
+            while len(self._decoded) > self.keep:
+                self._decoded.popitem(last=False)
+        return pub
+
+    def supersede(self, pmid):
+        """stop serving pmid from the snapshot"""
+        with self._lock:
+            self._superseded.add(pmid)
+            self._decoded.pop(pmid, None)
+        return
+
+    def close(self):
+        self._map.close()
+        return
+
+def _is_current(pub):
+    """return whether the database has the same version of a publication"""
+    with database.pooled() as db:
+        with db.cursor() as c:
+            query = "SELECT version FROM publication WHERE pmid = %s"
+            database.execute(c, query, (pub.pmid, ))
+            row = c.fetchone()
+    return row is not None and row[0] == pub.version
+
+def _encode(pub):
+    """return a JSON-able representation of a Publication"""
+    ts = pub.timestamp
+    d = {'pmid': pub.pmid, 
+         'pmc_id': pub.pmc_id, 
+         'title': pub.title, 
+         'retrieved': list(ts.timetuple()[:6]) + [ts.microsecond], 
+         'version': pub.version, 
+         'rules': pub.rules_version, 
+         'errors': [], 
+         'entities': []}
+    for err in pub.errors:
+        d['errors'].append((err.__class__.__name__, 
+                            err.annotation_id, 
+                            err.data))
+    for (entity_type, ed) in pub.entities.iteritems():
+        for ent in ed.itervalues():
+            values = [ field.value for field in ent.fields.itervalues() ]
+            errs = [ (err.__class__.__name__, err.data)
+                     for err in ent.errors ]
+            d['entities'].append((entity_type, 
+                                  ent.id, 
+                                  values, 
+                                  sorted(ent.annotation_ids), 
+                                  errs, 
+                                  ent.points))
+    return d
+
+def _decode(d):
+    """build a Publication from the output of _encode()"""
+    # imported here because publication imports this module
+    from .publication import Publication
+    pub = Publication()
+    pub.pmid = str(d['pmid'])
+    pub.pmc_id = str(d['pmc_id'])
+    pub.title = d['title']
+    pub.timestamp = datetime.datetime(*d['retrieved'])
+    pub.version = d['version']
+    for (err_type, annotation_id, data) in d['errors']:
+        err_cls = getattr(errors, err_type)
+        if data is None:
+            pub.errors.append(err_cls(annotation_id))
+        else:
+            pub.errors.append(err_cls(annotation_id, data))
+    points = {}
+    for (entity_type, id, values, annotation_ids, errs, ent_points) \
+            in d['entities']:
+        ent = entities[entity_type](pub, id)
+        for (field, value) in zip(ent.fields.itervalues(), values):
+            field.value = value
+        ent.annotation_ids.update(annotation_ids)
+        for (err_type, data) in errs:
+            ent.errors.append(getattr(errors, err_type)(data))
+        pub.entities[entity_type][id] = ent
+        points[ent] = [ tuple(p) for p in ent_points ]
+    # the links between entities are rebuilt, but the scores are kept 
+    # unless they were given under other scoring rules
+    rule_set = scoring.get_rule_set()
+    for ed in pub.entities.itervalues():
+        for ent in ed.itervalues():
+            ent.set_related()
+    if d.get('rules') == rule_set.version:
+        for (ent, ent_points) in points.iteritems():
+            ent.points = ent_points
+    else:
+        for ent in points:
+            ent.score(rule_set)
+    pub.rules_version = rule_set.version
+    return pub
+
+def write(fname, batch_size=100):
+    """write a snapshot of all the publications in the database to fname
+
+    the file is replaced atomically, so processes that already have the
+    old one open can keep reading it
+
+    returns the number of publications written
+    """
+    from .publication import Publication
+    pmids = sorted(Publication.get_known(), key=int)
+    tmp_fname = '%s.%d.tmp' % (fname, os.getpid())
+    index = []
+    with open(tmp_fname, 'wb') as fo:
+        fo.write(magic)
+        fo.write(_header.pack(0, 0))
+        offset = fo.tell()
+        for i in xrange(0, len(pmids), batch_size):
+            batch = pmids[i:i+batch_size]
+            pubs = Publication.get_many(batch)
+            for pmid in batch:
+                # removed since get_known()
+                if pmid not in pubs:
+                    continue
+                data = zlib.compress(json.dumps(_encode(pubs[pmid]), 
+                                                separators=(',', ':')))
+                fo.write(data)
+                index.append((int(pmid), offset, len(data)))
+                offset += len(data)
+        for entry in index:
+            fo.write(_index_entry.pack(*entry))
+        fo.seek(len(magic))
+        fo.write(_header.pack(offset, len(index)))
+    os.rename(tmp_fname, fname)
+    return len(index)
+
+def get_snapshot():
+    """return the Snapshot named in the configuration, or None if there
+    isn't one
+
+    the configuration is read and the snapshot opened once per process
+    """
+    with _snapshots_lock:
+        if config._config not in _snapshots:
+            c = config.Config()
+            if c.has_option('snapshot', 'file'):
+                keep = c.get_default('cache', 'size', 1000)
+                interval = c.get_default('snapshot', 'check_interval', 10.0)
+                snapshot = Snapshot(c.get('snapshot', 'file'), 
+                                    keep, 
+                                    interval)
+            else:
+                snapshot = None
+            _snapshots[config._config] = snapshot
+        return _snapshots[config._config]
+
+def get(pmid):
+    """return the Publication for pmid from the configured snapshot, or None
+    if there is no snapshot, the publication isn't in it or the database 
+    has a newer version"""
+    snapshot = get_snapshot()
+    if snapshot is None:
+        return None
+    return snapshot.get(pmid)
+
+def supersede(pmid):
+    """note that pmid has been reloaded, so the snapshot copy is stale"""
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        snapshot.supersede(pmid)
+    return
+
+# eof
@@ -0,0 +1,116 @@
+# corpus-wide statistics
+#
+# each publication's contribution to the statistics is stored in 
+# publication_stat when the publication is stored and added to the totals 
+# in corpus_stat; it is subtracted again when the publication is cleared 
+# or reloaded, so reading the statistics never needs to load publications
+#
+# statistics are counts keyed by (stat, key):
+#
+#     ('publications', '') - number of publications
+#     ('stars', number of stars) - publications by star rating
+#     ('score', percentage) - publications by score as a percentage of 
+#                             the maximum possible score, in steps of 10
+#     ('missing', '<entity type>: <rule name>') - negative points, by 
+#                                                the scoring rule (see 
+#                                                pub.scoring) that gave 
+#                                                them
+#     ('publication_error', error type) - publication-level errors
+#     ('entity_error', error type) - entity errors
+
+from . import database
+from . import scoring
+
+stat_names = ('publications', 
+              'stars', 
+              'score', 
+              'missing', 
+              'publication_error', 
+              'entity_error')
+
+def _get_publication_stats(pub, rule_set=None):
+    """_get_publication_stats(pub[, rule_set]) -> dictionary
+
+    return the publication's contributions to the statistics as a 
+    dictionary d such that d[(stat, key)] = count
+
+    the publication's entities must have been scored under rule_set, by 
+    default the scoring rules in effect
+    """
+    if rule_set is None:
+        rule_set = scoring.get_rule_set()
+    d = {('publications', ''): 1}
+    def add(stat, key):
+        d[(stat, key)] = d.get((stat, key), 0) + 1
+        return
+    add('stars', str(pub.stars()))
+    (s, max) = pub.get_scores()
+    if max > 0:
+        add('score', str(min(100 * s / max, 100) / 10 * 10))
+    for err in pub.errors:
+        add('publication_error', err.__class__.__name__)
+    for (entity_type, ed) in pub.entities.iteritems():
+        for ent in ed.itervalues():
+            # the points only have the notes, which can name the 
+            # publication's variables, so the rules are applied again for 
+            # their names
+            for (name, value, note) in rule_set.apply(ent):
+                if value < 0:
+                    add('missing', '%s: %s' % (entity_type, name))
+            for err in ent.errors:
+                add('entity_error', err.__class__.__name__)
+    return d
+
+def _insert(pub, cursor, rule_set=None):
+    """store the publication's statistics and add them to the totals"""
+    query = """INSERT INTO publication_stat (publication, stat, key, n) 
+               VALUES (%s, %s, %s, %s)"""
+    d = _get_publication_stats(pub, rule_set)
+    for ((stat, key), n) in d.iteritems():
+        database.execute(cursor, query, (pub.pmid, stat, key, n))
+    query = """INSERT INTO corpus_stat (stat, key, n) 
+               SELECT stat, key, n 
+                 FROM publication_stat 
+                WHERE publication = %s 
+               ON CONFLICT (stat, key) 
+               DO UPDATE SET n = corpus_stat.n + EXCLUDED.n"""
+    database.execute(cursor, query, (pub.pmid, ))
+    return
+
+def _clear_pmid(pmid, cursor):
+    """subtract the publication's statistics from the totals and remove 
+    them"""
+    query = """UPDATE corpus_stat 
+                  SET n = corpus_stat.n - publication_stat.n 
+                 FROM publication_stat 
+                WHERE publication_stat.publication = %s 
+                  AND corpus_stat.stat = publication_stat.stat 
+                  AND corpus_stat.key = publication_stat.key"""
+    database.execute(cursor, query, (pmid, ))
+    query = "DELETE FROM publication_stat WHERE publication = %s"
+    database.execute(cursor, query, (pmid, ))
+    return
+
+def get_stats():
+    """get_stats() -> dictionary
+
+    return the corpus statistics as a dictionary d such that d[stat] is a 
+    list of (key, count) tuples in decreasing order of count, except for 
+    stars and score, which are in decreasing order of their (integer) keys
+    """
+    d = dict([ (stat, []) for stat in stat_names ])
+    with database.pooled(replica=True) as db:
+        with db.cursor() as c:
+            query = """SELECT stat, key, n 
+                         FROM corpus_stat 
+                        WHERE n > 0 
+                        ORDER BY n DESC, key"""
+            database.execute(c, query)
+            for (stat, key, n) in c:
+                d.setdefault(stat, []).append((key, n))
+    for stat in ('stars', 'score'):
+        d[stat] = sorted([ (int(key), n) for (key, n) in d[stat] ], 
+                         reverse=True)
+    return d
+
+# eof
@@ -0,0 +1,275 @@
+#!/usr/bin/python
+
+# compare the old and compact schemas on a synthetic corpus
+#
+# usage: bench_compact_schema.py [--publications N] [--rounds N]
+#                                [--batch N] <config file>
+#
+# the tables that entities' annotation IDs, errors and lineage are read 
+# from are built three times, in schemas of their own in the configured 
+# database:
+#
+#     bench_text - as before migrate_compact_schema.py: TEXT PMIDs and
+#                  entity and error types, no index on the publication
+#     bench_text_indexed - the same with the (publication, entity_type)
+#                          indexes
+#     bench_compact - INTEGER PMIDs, SMALLINT types and the indexes
+#
+# and filled with the same --publications publications (default 50000), 
+# each with 27 entities; the report has the size of each table and index 
+# and the mean time, over --rounds rounds (default 50), to read the 
+# annotation IDs and errors of --batch publications (default 20, as 
+# Publication.get_many() does) and of one publication (as get_by_pmid() 
+# does), and to look up an entity's descendants in the lineage
+#
+# bench_text is read with sequential scans, so most of a run is spent on 
+# it; the schemas are dropped at the end
+
+import sys
+import time
+import random
+import argparse
+
+import pub
+from pub import database
+from pub.entities import entities
+from pub import errors
+
+schemas = ('bench_text', 'bench_text_indexed', 'bench_compact')
+
+first_pmid = 20000000
+
+entity_types = [ cls.table for cls in entities.itervalues() ]
+error_types = [ errors.error_types[id].__name__ 
+                for id in sorted(errors.error_types) ]
+
+def array(names):
+    return 'ARRAY[%s]' % ', '.join([ "'%s'" % name for name in names ])
+
+def create(c, schema, n_pubs):
+    """create and fill the tables in a schema"""
+    compact = schema == 'bench_compact'
+    if compact:
+        types = {'pmid': 'INTEGER', 'type': 'SMALLINT'}
+        exprs = {'pmid': 'p', 
+                 'type': 't', 
+                 'error': 'k', 
+                 'ancestor': 't - d'}
+    else:
+        types = {'pmid': 'TEXT', 'type': 'TEXT'}
+        exprs = {'pmid': 'p::TEXT', 
+                 'type': '(%s)[t]' % array(entity_types), 
+                 'error': '(%s)[k]' % array(error_types), 
+                 'ancestor': '(%s)[t - d]' % array(entity_types)}
+    c.execute('DROP SCHEMA IF EXISTS %s CASCADE' % schema)
+    c.execute('CREATE SCHEMA %s' % schema)
+    c.execute('SET search_path TO %s' % schema)
+    c.execute("""CREATE TABLE entity_annotation ( 
+                     id SERIAL PRIMARY KEY, 
+                     publication %(pmid)s NOT NULL, 
+                     entity_type %(type)s NOT NULL, 
+                     entity_id TEXT NOT NULL, 
+                     annotation_id TEXT NOT NULL)""" % types)
+    c.execute("""CREATE TABLE entity_error ( 
+                     id SERIAL PRIMARY KEY, 
+                     publication %(pmid)s NOT NULL, 
+                     entity_type %(type)s NOT NULL, 
+                     entity_id TEXT NOT NULL, 
+                     error_type %(type)s NOT NULL, 
+                     data TEXT DEFAULT NULL)""" % types)
+    c.execute("""CREATE TABLE lineage ( 
+                     publication %(pmid)s NOT NULL, 
+                     entity_type %(type)s NOT NULL, 
+                     entity_id TEXT NOT NULL, 
+                     ancestor_type %(type)s NOT NULL, 
+                     ancestor_id TEXT NOT NULL, 
+                     depth INTEGER NOT NULL, 
+                     PRIMARY KEY (publication, entity_type, entity_id, 
+                                  ancestor_type, ancestor_id))""" % types)
+    c.execute("""CREATE INDEX lineage_ancestor_index 
+                     ON lineage (publication, ancestor_type, ancestor_id, 
+                                 entity_type)""")
+    # 3 entities of each type per publication, the first with two 
+    # annotations; one entity in 5 has an error; each entity depends on 
+    # the entities of the two types before it
+    params = {'first': first_pmid, 'last': first_pmid + n_pubs - 1}
+    query = """INSERT INTO entity_annotation (publication, 
+                                              entity_type, 
+                                              entity_id, 
+                                              annotation_id) 
+               SELECT %(pmid)s, %(type)s, 'e' || e, 
+                      substr(md5(p || '.' || t || '.' || e || '.' || a), 
+                             1, 22) 
+                 FROM generate_series(%%(first)s, %%(last)s) p, 
+                      generate_series(1, 9) t, 
+                      generate_series(1, 3) e, 
+                      generate_series(1, CASE WHEN e = 1 THEN 2 ELSE 1 END) a 
+                ORDER BY p""" % exprs
+    c.execute(query, params)
+    query = """INSERT INTO entity_error (publication, 
+                                         entity_type, 
+                                         entity_id, 
+                                         error_type, 
+                                         data) 
+               SELECT %(pmid)s, %(type)s, 'e' || e, %(error)s, 
+                      'Undefined entity "x' || e || '"' 
+                 FROM generate_series(%%(first)s, %%(last)s) p, 
+                      generate_series(1, 9) t, 
+                      generate_series(1, 3) e, 
+                      LATERAL (SELECT 1 + (p + e) %%%% 7) x (k) 
+                WHERE (p + t + e) %%%% 5 = 0 
+                ORDER BY p""" % exprs
+    c.execute(query, params)
+    query = """INSERT INTO lineage (publication, 
+                                    entity_type, 
+                                    entity_id, 
+                                    ancestor_type, 
+                                    ancestor_id, 
+                                    depth) 
+               SELECT %(pmid)s, %(type)s, 'e' || e, %(ancestor)s, 'e' || e, d 
+                 FROM generate_series(%%(first)s, %%(last)s) p, 
+                      generate_series(1, 9) t, 
+                      generate_series(1, 3) e, 
+                      generate_series(1, 2) d 
+                WHERE t - d >= 1 
+                ORDER BY p""" % exprs
+    c.execute(query, params)
+    if schema != 'bench_text':
+        c.execute("""CREATE INDEX entity_annotation_entity_index 
+                         ON entity_annotation (publication, entity_type)""")
+        c.execute("""CREATE INDEX entity_error_entity_index 
+                         ON entity_error (publication, entity_type)""")
+    c.execute('VACUUM ANALYZE entity_annotation')
+    c.execute('VACUUM ANALYZE entity_error')
+    c.execute('VACUUM ANALYZE lineage')
+    return
+
+def sizes(c, schema):
+    """return a dictionary of relation sizes in bytes keyed by name"""
+    query = """SELECT c.relname, pg_relation_size(c.oid) 
+                 FROM pg_class c 
+                 JOIN pg_namespace n ON n.oid = c.relnamespace 
+                WHERE n.nspname = %s 
+                  AND c.relkind IN ('r', 'i')"""
+    c.execute(query, (schema, ))
+    return dict(c.fetchall())
+
+def stored_pmid(schema, pmid):
+    """return a PMID as stored in the schema"""
+    if schema == 'bench_compact':
+        return pmid
+    return str(pmid)
+
+def stored_type(schema, i):
+    """return entity_types[i] as stored in the schema"""
+    if schema == 'bench_compact':
+        return i + 1
+    return entity_types[i]
+
+def time_load(c, schema, batches):
+    """return the mean time in milliseconds to read the annotation IDs and 
+    errors of each batch of PMIDs, as Publication._load_many_from_db() 
+    does"""
+    annotation_query = """SELECT publication, entity_id, annotation_id 
+                            FROM entity_annotation 
+                           WHERE publication = ANY(%s) 
+                             AND entity_type = %s"""
+    error_query = """SELECT publication, entity_id, error_type, data 
+                       FROM entity_error 
+                      WHERE publication = ANY(%s) 
+                        AND entity_type = %s"""
+    t0 = time.time()
+    for batch in batches:
+        pmids = [ stored_pmid(schema, pmid) for pmid in batch ]
+        for i in xrange(len(entity_types)):
+            entity_type = stored_type(schema, i)
+            for query in (annotation_query, error_query):
+                c.execute(query, (pmids, entity_type))
+                c.fetchall()
+    return (time.time() - t0) * 1000.0 / len(batches)
+
+def time_lineage(c, schema, entities):
+    """return the mean time in milliseconds to look up the descendants of 
+    each (PMID, index into entity_types, entity ID), as 
+    lineage.get_descendants() does"""
+    query = """SELECT publication, entity_type, entity_id, depth 
+                 FROM lineage 
+                WHERE publication = %s 
+                  AND ancestor_type = %s 
+                  AND ancestor_id = %s 
+                ORDER BY depth, entity_type, entity_id"""
+    t0 = time.time()
+    for (pmid, i, id) in entities:
+        params = (stored_pmid(schema, pmid), stored_type(schema, i), id)
+        c.execute(query, params)
+        c.fetchall()
+    return (time.time() - t0) * 1000.0 / len(entities)
+
+def mb(n):
+    return '%.1f' % (n / 1048576.0)
+
+parser = argparse.ArgumentParser(description='compare schemas')
+parser.add_argument('--publications', type=int, default=50000)
+parser.add_argument('--rounds', type=int, default=50)
+parser.add_argument('--batch', type=int, default=20)
+parser.add_argument('config')
+args = parser.parse_args()
+
+pub.set_config(args.config)
+
+rng = random.Random(1)
+pmids = range(first_pmid, first_pmid + args.publications)
+batches = [ rng.sample(pmids, args.batch) for i in xrange(args.rounds) ]
+singles = [ [rng.choice(pmids)] for i in xrange(args.rounds) ]
+lineage_entities = [ (rng.choice(pmids), 
+                      rng.randrange(len(entity_types) - 1), 
+                      'e%d' % rng.randint(1, 3))
+                     for i in xrange(args.rounds) ]
+
+db = database.connect()
+db.autocommit = True
+results = {}
+try:
+    with db.cursor() as c:
+        for schema in schemas:
+            t0 = time.time()
+            create(c, schema, args.publications)
+            print '%s: built in %.1f seconds' % (schema, time.time() - t0)
+            # a round of each first, so all three are timed with warm caches
+            time_load(c, schema, batches)
+            time_lineage(c, schema, lineage_entities)
+            results[schema] = {'sizes': sizes(c, schema), 
+                               'batch': time_load(c, schema, batches), 
+                               'single': time_load(c, schema, singles), 
+                               'lineage': time_lineage(c, schema, 
+                                                       lineage_entities)}
+        for schema in schemas:
+            c.execute('DROP SCHEMA %s CASCADE' % schema)
+finally:
+    db.close()
+
+print
+print '%d publications, %d rounds' % (args.publications, args.rounds)
+print
+fmt = '%-36s %12s %19s %14s'
+print fmt % ('size (MB)', 'text', 'text + indexes', 'compact')
+names = set()
+for schema in schemas:
+    names.update(results[schema]['sizes'])
+for name in sorted(names):
+    values = [ results[schema]['sizes'].get(name) for schema in schemas ]
+    print fmt % tuple([name] + [ '-' if v is None else mb(v) for v in values ])
+totals = [ sum(results[schema]['sizes'].itervalues()) for schema in schemas ]
+print fmt % tuple(['total'] + [ mb(v) for v in totals ])
+print
+print fmt % ('time (ms)', 'text', 'text + indexes', 'compact')
+labels = (('batch', 'load %d publications' % args.batch), 
+          ('single', 'load 1 publication'), 
+          ('lineage', 'lineage descendants'))
+for (name, label) in labels:
+    values = [ '%.3f' % results[schema][name] for schema in schemas ]
+    print fmt % tuple([label] + values)
+
+sys.exit(0)
+
+# eof
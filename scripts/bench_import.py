@@ -0,0 +1,76 @@
+#!/usr/bin/python
+
+# check how long "import pub" takes
+#
+# usage: bench_import.py [--runs N] [--budget MS]
+#
+# "python -c 'import pub'" is timed over --runs runs (default 21) and the
+# median time over a bare interpreter start is compared with --budget
+# milliseconds (default 50); the check also fails if importing pub loads
+# any of the modules that pub is supposed to import only when they are
+# used
+#
+# exits with status 1 if the check fails
+
+import sys
+import os
+import time
+import argparse
+import subprocess
+
+# modules that "import pub" should not load
+lazy_modules = ('psycopg2', 
+                'httplib', 
+                'urllib', 
+                'socket', 
+                'multiprocessing', 
+                'tempfile', 
+                'cgi')
+
+def median_time(code, runs, env):
+    """return the median time (in seconds) to run python -c code"""
+    times = []
+    for i in xrange(runs):
+        t0 = time.time()
+        subprocess.check_call([sys.executable, '-c', code], env=env)
+        times.append(time.time() - t0)
+    times.sort()
+    return times[len(times)//2]
+
+parser = argparse.ArgumentParser(description='time "import pub"')
+parser.add_argument('--runs', type=int, default=21)
+parser.add_argument('--budget', type=float, default=50.0, 
+                    help='milliseconds allowed for the import')
+args = parser.parse_args()
+
+# import this checkout's pub
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+env = dict(os.environ)
+env['PYTHONPATH'] = os.pathsep.join(filter(None, [root, 
+                                                  env.get('PYTHONPATH')]))
+
+base = median_time('pass', args.runs, env)
+total = median_time('import pub', args.runs, env)
+import_ms = (total - base) * 1000
+
+code = 'import sys, pub; print " ".join(sys.modules)'
+loaded = subprocess.check_output([sys.executable, '-c', code], env=env)
+loaded = set(loaded.split())
+eager = [ name for name in lazy_modules if name in loaded ]
+
+print 'import pub: %.1f ms (budget %.1f ms)' % (import_ms, args.budget)
+
+failed = False
+if import_ms > args.budget:
+    print 'over budget'
+    failed = True
+if eager:
+    print 'loaded at import: %s' % ', '.join(eager)
+    failed = True
+
+if failed:
+    sys.exit(1)
+
+sys.exit(0)
+
+# eof
@@ -0,0 +1,119 @@
+#!/usr/bin/python
+
+# measure what prepared statements save when loading publications
+#
+# usage: bench_prepared.py [--rounds N] <config file> <PMID> [<PMID> ...]
+#
+# the entity and error queries that load the given publications are 
+# recorded and then run --rounds times (default 100) as plain queries and 
+# as prepared statements (as on connections from pub.database.pooled()), 
+# reporting the wall time for a whole load and the planning time that 
+# Postgres reports (from EXPLAIN ANALYZE) summed over the queries
+#
+# Postgres plans each of the first five executions of a prepared statement 
+# separately before it settles on a generic plan, so the planning times for 
+# prepared statements are measured after the timed rounds
+
+import sys
+import time
+import json
+import hashlib
+import psycopg2.extensions
+import pub
+from pub import database
+from pub.publication import Publication
+
+progname = sys.argv[0].split('/')[-1]
+
+recorded = []
+
+class RecordingCursor(psycopg2.extensions.cursor):
+
+    """cursor that records the queries it runs"""
+
+    def execute(self, query, params=None):
+        recorded.append((query, params))
+        return psycopg2.extensions.cursor.execute(self, query, params)
+
+def record_queries(pmids):
+    """return the list of (query, params) run to load the publications"""
+    pubs = Publication.get_many(pmids)
+    db = database.connect(snapshot=True)
+    with db:
+        with db.cursor(cursor_factory=RecordingCursor) as c:
+            Publication._load_many_from_db(pubs, c)
+    db.close()
+    return list(recorded)
+
+def planning_time(cursor, query, params, prepared):
+    """return the planning time (in milliseconds) for a query"""
+    if prepared:
+        # database.execute() prepares the query the first time
+        database.execute(cursor, query, params)
+        cursor.fetchall()
+        name = 'q_%s' % hashlib.sha1(query).hexdigest()[:16]
+        explain = 'EXPLAIN (ANALYZE, FORMAT JSON) EXECUTE %s' % name
+        if params:
+            placeholders = ', '.join(['%s'] * len(params))
+            explain = '%s (%s)' % (explain, placeholders)
+    else:
+        explain = 'EXPLAIN (ANALYZE, FORMAT JSON) %s' % query
+    cursor.execute(explain, params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, basestring):
+        plan = json.loads(plan)
+    return plan[0]['Planning Time']
+
+def run(queries, rounds, prepared):
+    """returns (mean planning time per load, mean wall time per load), both
+    in milliseconds"""
+    c = pub.Config()
+    if prepared:
+        factory = database._get_pooled_connection_class()
+    else:
+        factory = None
+    db = database._connect_host(c, c.get('db', 'host'), factory)
+    planning = 0.0
+    with db:
+        with db.cursor() as cursor:
+            t0 = time.time()
+            for i in xrange(rounds):
+                for (query, params) in queries:
+                    if prepared:
+                        database.execute(cursor, query, params)
+                    else:
+                        cursor.execute(query, params)
+                    cursor.fetchall()
+            wall = (time.time() - t0) * 1000.0 / rounds
+            for (query, params) in queries:
+                planning += planning_time(cursor, query, params, prepared)
+    db.close()
+    return (planning, wall)
+
+args = sys.argv[1:]
+rounds = 100
+if len(args) > 1 and args[0] == '--rounds':
+    rounds = int(args[1])
+    args = args[2:]
+
+if len(args) < 2:
+    msg = 'usage: %s [--rounds N] <config file> <PMID> [<PMID> ...]\n'
+    sys.stderr.write(msg % progname)
+    sys.exit(1)
+
+pub.set_config(args[0])
+
+queries = record_queries(args[1:])
+print '%d queries per load' % len(queries)
+
+(plain_planning, plain_wall) = run(queries, rounds, False)
+(prep_planning, prep_wall) = run(queries, rounds, True)
+
+print 'planning time per load: %.3f ms plain, %.3f ms prepared' % \
+      (plain_planning, prep_planning)
+print 'wall time per load:     %.3f ms plain, %.3f ms prepared' % \
+      (plain_wall, prep_wall)
+
+sys.exit(0)
+
+# eof
@@ -0,0 +1,28 @@
+#!/usr/bin/python
+
+# import titles and PMC IDs from MEDLINE files (see pub.medline)
+#
+# usage: import_medline.py <config file> <MEDLINE file> [<MEDLINE file> ...]
+#
+# files ending in .gz are read as gzip'd
+
+import sys
+import pub
+import pub.medline
+
+progname = sys.argv[0].split('/')[-1]
+
+if len(sys.argv) < 3:
+    fmt = 'usage: %s <config file> <MEDLINE file> [<MEDLINE file> ...]\n'
+    sys.stderr.write(fmt % progname)
+    sys.exit(1)
+
+pub.set_config(sys.argv[1])
+
+for fname in sys.argv[2:]:
+    (n_read, n_written) = pub.medline.import_file(fname)
+    print '%s: %d records read, %d written' % (fname, n_read, n_written)
+
+sys.exit(0)
+
+# eof
@@ -0,0 +1,49 @@
+#!/usr/bin/python
+
+# load the PMID to PMC ID mapping from NCBI's PMC-ids.csv (see pub.pmcids)
+#
+# usage: load_pmc_ids.py [--no-delete] [--force] <config file> 
+#                        <PMC-ids.csv[.gz]>
+#
+# PMIDs missing from the file are removed from the mapping unless 
+# --no-delete is given; a file with fewer than 90% as many PMIDs as the 
+# mapping (such as a truncated download) is refused unless --force is 
+# given
+
+import sys
+import argparse
+import pub
+import pub.pmcids
+
+progname = sys.argv[0].split('/')[-1]
+
+parser = argparse.ArgumentParser(description='load the PMC ID mapping')
+parser.add_argument('--no-delete', action='store_true', 
+                    help='keep PMIDs missing from the file')
+parser.add_argument('--force', action='store_true', 
+                    help='load the file however few PMIDs it has')
+parser.add_argument('config')
+parser.add_argument('pmc_ids')
+args = parser.parse_args()
+
+pub.set_config(args.config)
+
+if args.force:
+    min_fraction = 0
+else:
+    min_fraction = 0.9
+
+try:
+    (n_rows, n_changed, n_removed) = pub.pmcids.load(args.pmc_ids, 
+                                                     not args.no_delete, 
+                                                     min_fraction)
+except ValueError, data:
+    sys.stderr.write('%s: %s\n' % (progname, str(data)))
+    sys.exit(1)
+
+fmt = '%d rows read, %d added or changed, %d removed'
+print fmt % (n_rows, n_changed, n_removed)
+
+sys.exit(0)
+
+# eof
@@ -0,0 +1,159 @@
+#!/usr/bin/python
+
+# migrate a database to the compact schema: PMIDs stored as integers and 
+# entity and error types stored as IDs into the entity_type and error_type 
+# lookup tables, with indexes on (publication, entity_type) for the 
+# entity_annotation and entity_error lookups
+#
+# usage: migrate_compact_schema.py <config file>
+#
+# the migration is one transaction, so readers see the old schema until it 
+# commits, but it rewrites (and locks) every table; stop the portal and the 
+# background jobs first, since their prepared statements are planned for 
+# the old column types
+#
+# replicas follow the primary, so run this against the primary only
+
+import sys
+import time
+import pub
+from pub import database
+from pub.entities import entities
+from pub import errors
+
+progname = sys.argv[0].split('/')[-1]
+
+# (table, column) holding PMIDs other than the publication columns
+pmid_columns = (('publication', 'pmid'), 
+                ('publication_metadata', 'pmid'), 
+                ('pmc_id_map', 'pmid'))
+
+# (table, column, lookup table) for the entity and error type columns
+type_columns = (('entity_annotation', 'entity_type', 'entity_type'), 
+                ('entity_error', 'entity_type', 'entity_type'), 
+                ('entity_error', 'error_type', 'error_type'), 
+                ('publication_error', 'error_type', 'error_type'), 
+                ('lineage', 'entity_type', 'entity_type'), 
+                ('lineage', 'ancestor_type', 'entity_type'))
+
+# (index name, table, columns)
+indexes = (('publication_error_publication_index', 
+            'publication_error', 
+            'publication'), 
+           ('entity_annotation_entity_index', 
+            'entity_annotation', 
+            'publication, entity_type'), 
+           ('entity_error_entity_index', 
+            'entity_error', 
+            'publication, entity_type'))
+
+def column_type(c, table, column):
+    query = """SELECT data_type 
+                 FROM information_schema.columns 
+                WHERE table_schema = current_schema() 
+                  AND table_name = %s 
+                  AND column_name = %s"""
+    c.execute(query, (table, column))
+    row = c.fetchone()
+    if not row:
+        return None
+    return row[0]
+
+def drop_foreign_keys(c):
+    """drop the foreign keys in the schema, returning a list of (table, 
+    constraint name, definition) to restore them"""
+    query = """SELECT conrelid::regclass::text, 
+                      conname, 
+                      pg_get_constraintdef(oid) 
+                 FROM pg_constraint 
+                WHERE contype = 'f' 
+                  AND connamespace = current_schema()::regnamespace"""
+    c.execute(query)
+    fkeys = c.fetchall()
+    for (table, name, definition) in fkeys:
+        c.execute('ALTER TABLE %s DROP CONSTRAINT %s' % (table, name))
+    return fkeys
+
+def create_lookup_table(c, table, types):
+    """create a lookup table from a list of (ID, name)"""
+    c.execute("""CREATE TABLE %s (id SMALLINT PRIMARY KEY, 
+                                  name TEXT NOT NULL UNIQUE)""" % table)
+    for (id, name) in types:
+        query = "INSERT INTO %s (id, name) VALUES (%%s, %%s)" % table
+        c.execute(query, (id, name))
+    return
+
+def migrate(c):
+    fkeys = drop_foreign_keys(c)
+    query = """SELECT table_name 
+                 FROM information_schema.columns 
+                WHERE table_schema = current_schema() 
+                  AND column_name = 'publication' 
+                  AND data_type = 'text'"""
+    c.execute(query)
+    columns = [ (row[0], 'publication') for row in c.fetchall() ]
+    columns.extend(pmid_columns)
+    for (table, column) in columns:
+        print '%s.%s -> INTEGER' % (table, column)
+        query = """ALTER TABLE %s 
+                   ALTER COLUMN %s TYPE INTEGER USING %s::INTEGER"""
+        c.execute(query % (table, column, column))
+    entity_types = [ (cls.type_id, cls.table) 
+                     for cls in entities.itervalues() ]
+    create_lookup_table(c, 'entity_type', entity_types)
+    error_types = [ (id, cls.__name__) 
+                    for (id, cls) in errors.error_types.iteritems() ]
+    create_lookup_table(c, 'error_type', error_types)
+    lookups = {'entity_type': entity_types, 'error_type': error_types}
+    for (table, column, lookup_table) in type_columns:
+        print '%s.%s -> SMALLINT' % (table, column)
+        # USING can't have a subquery, so the lookup is spelled out; a name 
+        # not in the lookup table becomes NULL and fails NOT NULL
+        whens = [ "WHEN '%s' THEN %d" % (name, id) 
+                  for (id, name) in lookups[lookup_table] ]
+        query = """ALTER TABLE %s 
+                   ALTER COLUMN %s TYPE SMALLINT 
+                   USING CASE %s %s END"""
+        c.execute(query % (table, column, column, ' '.join(whens)))
+    # the primary key left out the publication, so two publications 
+    # couldn't use the same variable name in models with the same ID
+    c.execute('ALTER TABLE model_variable DROP CONSTRAINT model_variable_pkey')
+    query = """ALTER TABLE model_variable 
+               ADD PRIMARY KEY (publication, model, variable)"""
+    c.execute(query)
+    for (table, name, definition) in fkeys:
+        query = 'ALTER TABLE %s ADD CONSTRAINT %s %s'
+        c.execute(query % (table, name, definition))
+    for (table, column, lookup_table) in type_columns:
+        query = 'ALTER TABLE %s ADD FOREIGN KEY (%s) REFERENCES %s'
+        c.execute(query % (table, column, lookup_table))
+    for (name, table, columns) in indexes:
+        print 'index %s' % name
+        c.execute('CREATE INDEX %s ON %s (%s)' % (name, table, columns))
+    # the planner needs statistics on the new columns to use the indexes
+    c.execute('ANALYZE')
+    return
+
+if len(sys.argv) != 2:
+    sys.stderr.write('usage: %s <config file>\n' % progname)
+    sys.exit(1)
+
+pub.set_config(sys.argv[1])
+
+t0 = time.time()
+db = database.connect()
+try:
+    with db:
+        with db.cursor() as c:
+            if column_type(c, 'publication', 'pmid') == 'integer':
+                print 'already migrated'
+                sys.exit(0)
+            migrate(c)
+finally:
+    db.close()
+
+print 'migrated in %.1f seconds' % (time.time() - t0)
+
+sys.exit(0)
+
+# eof
@@ -0,0 +1,32 @@
+#!/usr/bin/python
+
+# reload the publications whose CANDISharePub annotations have changed 
+# since the last run; meant to be run periodically (e.g. from cron)
+#
+# usage: poll_hypothesis.py <config file>
+
+import sys
+import pub
+import pub.poller
+
+progname = sys.argv[0].split('/')[-1]
+
+if len(sys.argv) != 2:
+    sys.stderr.write('usage: %s <config file>\n' % progname)
+    sys.exit(1)
+
+pub.set_config(sys.argv[1])
+
+(pmids, failed) = pub.poller.poll()
+
+for pmid in pmids:
+    print 'reloaded %s' % pmid
+for pmc_id in failed:
+    sys.stderr.write('%s: error reloading %s\n' % (progname, pmc_id))
+
+if failed:
+    sys.exit(1)
+
+sys.exit(0)
+
+# eof
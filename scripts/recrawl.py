@@ -0,0 +1,38 @@
+#!/usr/bin/python
+
+# periodically refresh known publications (see pub.scheduler)
+#
+# usage: recrawl.py [--once] <config file>
+
+import sys
+import pub
+import pub.scheduler
+
+progname = sys.argv[0].split('/')[-1]
+
+args = sys.argv[1:]
+once = '--once' in args
+if once:
+    args.remove('--once')
+
+if len(args) != 1:
+    sys.stderr.write('usage: %s [--once] <config file>\n' % progname)
+    sys.exit(1)
+
+pub.set_config(args[0])
+
+if not once:
+    pub.scheduler.run()
+
+(n_refreshed, n_changed, n_failed) = pub.scheduler.run_once()
+
+print '%d refreshed, %d changed, %d failed' % (n_refreshed, 
+                                               n_changed, 
+                                               n_failed)
+
+if n_failed:
+    sys.exit(1)
+
+sys.exit(0)
+
+# eof
@@ -0,0 +1,31 @@
+#!/usr/bin/python
+
+# re-score all publications under the scoring rules in effect and 
+# recompute the corpus statistics (see pub.scoring)
+#
+# usage: rescore.py <config file>
+#
+# nothing is fetched from PubMed or hypothes.is
+
+import sys
+import time
+import pub
+import pub.scoring
+
+progname = sys.argv[0].split('/')[-1]
+
+if len(sys.argv) != 2:
+    sys.stderr.write('usage: %s <config file>\n' % progname)
+    sys.exit(1)
+
+pub.set_config(sys.argv[1])
+
+t0 = time.time()
+n = pub.scoring.rescore()
+
+fmt = '%d publications re-scored under rules %s in %.1f seconds'
+print fmt % (n, pub.scoring.version(), time.time() - t0)
+
+sys.exit(0)
+
+# eof
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+
+# score publications from hypothes.is annotation dumps without using the
+# network or the database
+#
+# usage: score_annotations.py [--processes N] [--output FILE] <JSON file> ...
+#
+# each file holds hypothes.is annotations, either as a search result
+# ({"rows": [...]}) or as a list; annotations are grouped into publications
+# by the PMC ID in their URI (others are skipped) and each publication is
+# written as a line of JSON:
+#
+#     {"pmc_id": ..., "score": ..., "max": ..., "stars": ..., 
+#      "errors": [<message>, ...], 
+#      "entities": [{"type": ..., "id": ..., "score": ..., "max": ..., 
+#                    "points": [[<points>, <reason>], ...], 
+#                    "errors": [<message>, ...]}, ...]}
+#
+# files are scored in parallel, one file per process at a time, so a
+# large dump should be split into several files to use more than one core
+
+import sys
+import re
+import json
+import argparse
+import multiprocessing
+
+from pub.publication import Publication
+
+pmc_id_re = re.compile('(PMC\d+)', re.IGNORECASE)
+
+def summarize(pub):
+    """return a JSON-able summary of a publication's scores and errors"""
+    (score, max) = pub.get_scores()
+    d = {'pmc_id': pub.pmc_id, 
+         'score': score, 
+         'max': max, 
+         'stars': pub.stars(), 
+         'errors': [ err.msg for err in pub.errors ], 
+         'entities': []}
+    for (entity_type, ed) in pub.entities.iteritems():
+        for id in sorted(ed):
+            ent = ed[id]
+            (score, max) = ent.get_scores()
+            d['entities'].append({'type': entity_type, 
+                                  'id': id, 
+                                  'score': score, 
+                                  'max': max, 
+                                  'points': ent.points, 
+                                  'errors': [ err.msg for err in ent.errors ]})
+    return d
+
+def score_file(fname):
+    """score_file(fname) -> (list of JSON lines, error message or None)"""
+    try:
+        with open(fname) as fo:
+            data = json.load(fo)
+    except (IOError, ValueError), exc:
+        return ([], '%s: %s' % (fname, str(exc)))
+    if isinstance(data, dict):
+        data = data['rows']
+    # by_pmc_id[PMC ID] = list of annotations
+    by_pmc_id = {}
+    for annot in data:
+        mo = pmc_id_re.search(annot.get('uri', ''))
+        if not mo:
+            continue
+        by_pmc_id.setdefault(mo.group(1).upper(), []).append(annot)
+    lines = []
+    for pmc_id in sorted(by_pmc_id):
+        pub = Publication.from_annotations(by_pmc_id[pmc_id], pmc_id=pmc_id)
+        lines.append(json.dumps(summarize(pub), sort_keys=True))
+    return (lines, None)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='score annotation dumps')
+    parser.add_argument('--processes', type=int, default=None, 
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('--output', default='-', 
+                        help='output file (default: standard output)')
+    parser.add_argument('files', nargs='+')
+    args = parser.parse_args()
+
+    if args.output == '-':
+        fo = sys.stdout
+    else:
+        fo = open(args.output, 'w')
+
+    pool = multiprocessing.Pool(args.processes)
+    n_pubs = 0
+    n_failed = 0
+    try:
+        for (lines, error) in pool.imap_unordered(score_file, args.files):
+            if error:
+                sys.stderr.write('%s\n' % error)
+                n_failed += 1
+            for line in lines:
+                fo.write('%s\n' % line)
+            n_pubs += len(lines)
+    finally:
+        pool.close()
+        pool.join()
+        if fo is not sys.stdout:
+            fo.close()
+
+    msg = '%d publications scored, %d files failed\n' % (n_pubs, n_failed)
+    sys.stderr.write(msg)
+
+    if n_failed:
+        sys.exit(1)
+
+    sys.exit(0)
+
+# eof
@@ -0,0 +1,25 @@
+#!/usr/bin/python
+
+# write a snapshot of all known publications (see pub.snapshot)
+#
+# usage: write_snapshot.py <config file> <snapshot file>
+
+import sys
+import pub
+import pub.snapshot
+
+progname = sys.argv[0].split('/')[-1]
+
+if len(sys.argv) != 3:
+    sys.stderr.write('usage: %s <config file> <snapshot file>\n' % progname)
+    sys.exit(1)
+
+pub.set_config(sys.argv[1])
+
+n = pub.snapshot.write(sys.argv[2])
+
+print '%d publications written to %s' % (n, sys.argv[2])
+
+sys.exit(0)
+
+# eof
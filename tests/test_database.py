@@ -0,0 +1,61 @@
+# tests of pub.database; these need a scratch database, named by the
+# configuration file in CSPUB_TEST_CONFIG
+#
+# run from the top of the tree with: python -m unittest discover -s tests
+
+import os
+import signal
+import unittest
+
+import pub
+from pub import database
+
+config_fname = os.environ.get('CSPUB_TEST_CONFIG')
+
+def backend_pid():
+    """return the PID of the server process behind a pooled connection"""
+    with database.pooled() as db:
+        with db.cursor() as c:
+            database.execute(c, 'SELECT pg_backend_pid()')
+            return c.fetchone()[0]
+
+@unittest.skipUnless(config_fname, 'CSPUB_TEST_CONFIG is not set')
+class PoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        pub.set_config(config_fname)
+        return
+
+    def test_reuse(self):
+        self.assertEqual(backend_pid(), backend_pid())
+        return
+
+    def test_fork_after_pooled_query(self):
+        parent_backend = backend_pid()
+        (r, w) = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # the child must not share the parent's connection, and must
+            # not hang if it does
+            status = 1
+            try:
+                os.close(r)
+                signal.alarm(20)
+                os.write(w, str(backend_pid()))
+                status = 0
+            finally:
+                os._exit(status)
+        os.close(w)
+        child_backend = os.read(r, 100)
+        os.close(r)
+        (_, status) = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
+        self.assertNotEqual(int(child_backend), parent_backend)
+        # and the parent's connection is still open and still pooled
+        self.assertEqual(backend_pid(), parent_backend)
+        return
+
+if __name__ == '__main__':
+    unittest.main()
+
+# eof
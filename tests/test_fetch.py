@@ -0,0 +1,74 @@
+# tests of pub.fetch; requests are answered by a stand-in for the HTTP
+# request, so nothing is fetched and no database is needed
+#
+# run from the top of the tree with: python -m unittest discover -s tests
+
+import os
+import socket
+import tempfile
+import unittest
+
+import pub
+from pub import fetch
+from pub.exceptions import *
+
+host = 'fetch.test.invalid'
+
+config = """[fetch]
+retries = 0
+failure_threshold = 1
+reset_timeout = 0
+"""
+
+class CircuitBreakerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self.config_fname) = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as fo:
+            fo.write(config)
+        pub.set_config(self.config_fname)
+        fetch._breakers.pop(host, None)
+        self.saved_get = fetch._get
+        # exceptions to raise from the request, or responses to return
+        self.outcomes = []
+        fetch._get = self.get
+        return
+
+    def tearDown(self):
+        fetch._get = self.saved_get
+        fetch._breakers.pop(host, None)
+        os.unlink(self.config_fname)
+        return
+
+    def get(self, target, path, headers, connect_timeout, read_timeout):
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    def fetch(self):
+        return fetch.get(host, '/', {}, UpstreamError)
+
+    def test_trial_success_closes(self):
+        self.outcomes = [socket.error('refused'), (200, 'ok')]
+        self.assertRaises(UpstreamError, self.fetch)
+        self.assertEqual(self.fetch(), 'ok')
+        self.assertIsNone(fetch._breakers[host].opened)
+        return
+
+    def test_unexpected_error_ends_trial(self):
+        self.outcomes = [socket.error('refused'),
+                         ValueError('bad URL'),
+                         (200, 'ok')]
+        self.assertRaises(UpstreamError, self.fetch)
+        # the trial request fails with something other than a network
+        # error, and the next trial is still let through
+        self.assertRaises(ValueError, self.fetch)
+        self.assertFalse(fetch._breakers[host].trial)
+        self.assertEqual(self.fetch(), 'ok')
+        return
+
+if __name__ == '__main__':
+    unittest.main()
+
+# eof
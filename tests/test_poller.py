@@ -0,0 +1,103 @@
+# tests of pub.poller; these need a scratch database, named by the
+# configuration file in CSPUB_TEST_CONFIG
+#
+# hypothes.is and the publication reloads are replaced with stand-ins, so
+# nothing is fetched
+#
+# run from the top of the tree with: python -m unittest discover -s tests
+
+import os
+import json
+import unittest
+
+import pub
+from pub import database
+from pub import poller
+from pub.exceptions import *
+
+config_fname = os.environ.get('CSPUB_TEST_CONFIG')
+
+class FakePublication:
+
+    def __init__(self, pmid):
+        self.pmid = pmid
+        return
+
+@unittest.skipUnless(config_fname, 'CSPUB_TEST_CONFIG is not set')
+class PollTestCase(unittest.TestCase):
+
+    def setUp(self):
+        pub.set_config(config_fname)
+        self.clear_state()
+        # (set of PMC IDs, high-water mark) for each call to get_changed()
+        self.changes = []
+        # PMC IDs whose reload fails
+        self.failing = set()
+        self.reloaded = []
+        self.saved_get_changed = poller.get_changed
+        self.saved_get_by_pmc_id = poller.Publication.__dict__['get_by_pmc_id']
+        poller.get_changed = self.get_changed
+        poller.Publication.get_by_pmc_id = staticmethod(self.get_by_pmc_id)
+        return
+
+    def tearDown(self):
+        poller.get_changed = self.saved_get_changed
+        poller.Publication.get_by_pmc_id = self.saved_get_by_pmc_id
+        self.clear_state()
+        return
+
+    def clear_state(self):
+        with database.connect() as db:
+            with db.cursor() as c:
+                query = "DELETE FROM crawl_state WHERE name IN (%s, %s)"
+                c.execute(query, (poller.state_name, poller.retry_state_name))
+        return
+
+    def get_changed(self, since, limit=200):
+        if not self.changes:
+            return (set(), since)
+        return self.changes.pop(0)
+
+    def get_by_pmc_id(self, pmc_id, refresh_cache=False):
+        self.reloaded.append(pmc_id)
+        if pmc_id in self.failing:
+            raise UpstreamError('%s failed' % pmc_id)
+        return FakePublication(int(pmc_id[3:]))
+
+    def retry_list(self):
+        return json.loads(poller.get_state(poller.retry_state_name))
+
+    def test_mark_advances_past_failure(self):
+        self.failing.add('PMC2')
+        self.changes.append((set(['PMC1', 'PMC2']), '2020-01-01'))
+        self.assertEqual(poller.poll(), ([1], ['PMC2']))
+        self.assertEqual(poller.get_state(poller.state_name), '2020-01-01')
+        self.assertEqual(self.retry_list(), {'PMC2': 1})
+        # the next poll retries the failure along with the new changes
+        self.changes.append((set(['PMC3']), '2020-01-02'))
+        self.reloaded = []
+        self.assertEqual(poller.poll(), ([3], ['PMC2']))
+        self.assertEqual(sorted(self.reloaded), ['PMC2', 'PMC3'])
+        self.assertEqual(poller.get_state(poller.state_name), '2020-01-02')
+        self.assertEqual(self.retry_list(), {'PMC2': 2})
+        # and a successful retry takes it off the list
+        self.failing.clear()
+        self.assertEqual(poller.poll(), ([2], []))
+        self.assertEqual(self.retry_list(), {})
+        return
+
+    def test_retries_are_capped(self):
+        self.failing.add('PMC2')
+        self.changes.append((set(['PMC2']), '2020-01-01'))
+        for i in xrange(5):
+            self.assertEqual(poller.poll(), ([], ['PMC2']))
+        self.assertEqual(self.retry_list(), {})
+        self.reloaded = []
+        self.assertEqual(poller.poll(), ([], []))
+        self.assertEqual(self.reloaded, [])
+        return
+
+if __name__ == '__main__':
+    unittest.main()
+
+# eof
@@ -0,0 +1,80 @@
+# tests of pub.ratelimit; the shared limiter needs a scratch database,
+# named by the configuration file in CSPUB_TEST_CONFIG
+#
+# run from the top of the tree with: python -m unittest discover -s tests
+
+import os
+import time
+import threading
+import unittest
+
+import pub
+from pub import database
+from pub import ratelimit
+
+config_fname = os.environ.get('CSPUB_TEST_CONFIG')
+
+host = 'ratelimit.test.invalid'
+
+def run(buckets, n):
+    """take n tokens from each bucket, each in a thread of its own, and
+    return the time taken"""
+    def take(bucket):
+        for i in xrange(n):
+            bucket.acquire()
+        return
+    threads = [ threading.Thread(target=take, args=(bucket, ))
+                for bucket in buckets ]
+    t0 = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.time() - t0
+
+class TokenBucketTestCase(unittest.TestCase):
+
+    def test_rate(self):
+        bucket = ratelimit.TokenBucket(20, 1)
+        # the first is free, the other 9 take 1/20 s each
+        elapsed = run([bucket], 10)
+        self.assertTrue(0.4 <= elapsed < 1.0, elapsed)
+        return
+
+@unittest.skipUnless(config_fname, 'CSPUB_TEST_CONFIG is not set')
+class SharedTokenBucketTestCase(unittest.TestCase):
+
+    def setUp(self):
+        pub.set_config(config_fname)
+        self.clear()
+        return
+
+    def tearDown(self):
+        self.clear()
+        return
+
+    def clear(self):
+        with database.connect() as db:
+            with db.cursor() as c:
+                c.execute("DELETE FROM rate_limit WHERE host = %s", (host, ))
+        return
+
+    def test_limit_is_shared(self):
+        # separate buckets for the same host stand in for separate
+        # processes; together they get 20 requests per second, not 20 each
+        buckets = [ ratelimit.SharedTokenBucket(host, 20, 1)
+                    for i in xrange(2) ]
+        elapsed = run(buckets, 5)
+        self.assertTrue(0.4 <= elapsed < 1.0, elapsed)
+        return
+
+    def test_burst(self):
+        bucket = ratelimit.SharedTokenBucket(host, 1, 5)
+        elapsed = run([bucket], 5)
+        self.assertTrue(elapsed < 0.5, elapsed)
+        return
+
+if __name__ == '__main__':
+    unittest.main()
+
+# eof
@@ -0,0 +1,72 @@
+# tests of pub.snapshot; these need a scratch database with at least one
+# publication in it, named by the configuration file in CSPUB_TEST_CONFIG
+#
+# run from the top of the tree with: python -m unittest discover -s tests
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import pub
+from pub import database
+from pub import snapshot
+
+config_fname = os.environ.get('CSPUB_TEST_CONFIG')
+
+def bump_version(pmid, n):
+    with database.connect() as db:
+        with db.cursor() as c:
+            query = """UPDATE publication
+                          SET version = version + %s
+                        WHERE pmid = %s"""
+            c.execute(query, (n, int(pmid)))
+    return
+
+@unittest.skipUnless(config_fname, 'CSPUB_TEST_CONFIG is not set')
+class SnapshotTestCase(unittest.TestCase):
+
+    def setUp(self):
+        pub.set_config(config_fname)
+        self.pmids = sorted(pub.Publication.get_known(), key=int)
+        if not self.pmids:
+            self.skipTest('no publications in the database')
+        self.dir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.dir, 'snapshot')
+        snapshot.write(self.fname)
+        self.snapshot = snapshot.Snapshot(self.fname, 10, 3600.0)
+        self.bumped = []
+        return
+
+    def tearDown(self):
+        for pmid in self.bumped:
+            bump_version(pmid, -1)
+        self.snapshot.close()
+        shutil.rmtree(self.dir)
+        return
+
+    def test_decoded_publications_are_kept(self):
+        a = self.snapshot.get(self.pmids[0])
+        self.assertEqual(a.pmid, self.pmids[0])
+        self.assertIs(self.snapshot.get(self.pmids[0]), a)
+        return
+
+    def test_version_checked_every_interval(self):
+        pmid = self.pmids[0]
+        a = self.snapshot.get(pmid)
+        bump_version(pmid, 1)
+        self.bumped.append(pmid)
+        # not checked again until the interval is up
+        self.assertIs(self.snapshot.get(pmid), a)
+        self.snapshot.check_interval = 0
+        self.assertIsNone(self.snapshot.get(pmid))
+        # and the newer version is never served from the snapshot
+        bump_version(pmid, -1)
+        self.bumped.remove(pmid)
+        self.assertIsNone(self.snapshot.get(pmid))
+        return
+
+if __name__ == '__main__':
+    unittest.main()
+
+# eof